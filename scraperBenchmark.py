@@ -0,0 +1,289 @@
+
+# Benchmarks for websiteScraper. These don't touch the real government sites: the pages are made up,
+# but they're shaped like the real ones (a short narrative near the top, then lots of tables and boilerplate).
+# Run it with "python scraperBenchmark.py" (add --help to see the settings).
+
+import time # Time measures how long each approach takes
+import re # re is used to time the way scrape() used to search pages
+import os # os finds the null device and the temporary files
+import sys # sys lets each benchmark run print somewhere other than the report
+import random # random spreads out the stand-in server's latency and picks which requests fail
+import BaseHTTPServer # BaseHTTPServer and SocketServer make the stand-in server
+import SocketServer
+import multiprocessing # multiprocessing runs the server and each benchmark run in their own processes
+import resource # resource reports the peak memory and CPU time of a run
+import tempfile # tempfile and shutil hold the input and output files while the benchmark runs
+import shutil
+import argparse # argparse reads the settings from the command line
+import websiteScraper
+from requests.adapters import HTTPAdapter # HTTPAdapter is used to point congress.gov at the stand-in server
+
+# These are the quotes from OSHAKwargsDict and FAAKwargsDict, written out as the plain text that's on the page.
+
+OSHAStart = 'WIDTH="99%">\n<tr><td class="blueTen">\n'
+OSHAEnd = '\n</td></tr>\n</TABLE>\n</td></tr>\n<tr><td>\n<TABLE bgcolor="white" border="0" cellspacing="1" cellpadding="3" WIDTH="99%">\n<tr><td class="blueBoldTen" valign="top">Keywords:'
+FAAStart = '<div id="narr_text"><br>'
+FAAEnd = '</div>\n<HR>\n<div id="end_1">END REPORT'
+
+def makePage(startText, endText, narrativeSize=2000, pageSize=150000):
+	'''Makes a fake page (unicode) about pageSize characters long with a narrativeSize narrative near the top.'''
+	header = u'<html><head><title>Accident Detail</title></head><body>\n' + u'<TABLE><tr><td>Inspection</td></tr></TABLE>\n' * 20
+	narrative = (u'An employee was working on the ramp when the tug struck the aircraft. ' * (narrativeSize / 70 + 1))[:narrativeSize]
+	filler = u'<tr><td class="blueTen">Field</td><td>Value</td></tr>\n'
+	footer = filler * max(0, (pageSize - len(header) - narrativeSize) / len(filler))
+	return header + startText.decode('utf-8') + narrative + endText.decode('utf-8') + footer + u'</body></html>'
+
+def timeIt(function, repeat):
+	'''Returns the average number of seconds function() takes.'''
+	start = time.time()
+	for i in range(repeat):
+		function()
+	return (time.time() - start) / repeat
+
+def benchmarkExtraction(repeat=200, pageSize=150000):
+	'''Compares the old per-call re.search with the Extractor fast paths on OSHA- and FAA-sized pages,
+	and with a selector (which includes parsing the page, with lxml or HTMLParser).'''
+	selectorName = 'selector (lxml)' if websiteScraper.lxmlHTML is not None else 'selector (HTMLParser)'
+	for siteName, startText, endText, startQuote, endQuote, selector in [
+		('OSHA', OSHAStart, OSHAEnd, websiteScraper.OSHAKwargsDict['startQuote'], websiteScraper.OSHAKwargsDict['endQuote'], 'td.blueTen'),
+		('FAA', FAAStart, FAAEnd, websiteScraper.FAAKwargsDict['startQuote'], websiteScraper.FAAKwargsDict['endQuote'], '#narr_text')]:
+		page = makePage(startText, endText, pageSize=pageSize)
+		escapedStart = websiteScraper.strToRegEx(startText)
+		escapedEnd = websiteScraper.strToRegEx(endText)
+		selectorExtractor = websiteScraper.SelectorExtractor([selector])
+		ways = [
+			('old re.search', lambda page: re.search(str(startQuote + '(.+)' + endQuote), page, re.DOTALL).group(1), repeat),
+			('compiled greedy', websiteScraper.Extractor(startQuote, endQuote, 'greedy').extract, repeat),
+			('compiled lazy', websiteScraper.Extractor(startQuote, endQuote, 'lazy').extract, repeat),
+			('literal greedy', websiteScraper.Extractor(escapedStart, escapedEnd, 'greedy').extract, repeat),
+			('literal lazy', websiteScraper.Extractor(escapedStart, escapedEnd, 'lazy').extract, repeat),
+			(selectorName, lambda page: selectorExtractor.extract(websiteScraper.parseHTML(page)), max(1, repeat / 20))]
+		print "{0} page, {1} KB:".format(siteName, len(page) / 1024)
+		baseline = None
+		for wayName, extract, wayRepeat in ways:
+			if not extract(page):
+				print "  {0} didn't find the narrative!".format(wayName)
+			seconds = timeIt(lambda: extract(page), wayRepeat)
+			if baseline is None:
+				baseline = seconds
+			print "  {0:<21} {1:>9.1f} microseconds  ({2:.1f}x)".format(wayName, seconds * 1e6, baseline / seconds)
+
+# Here's the stand-in for the government sites. It serves pages made by makePage at /osha/<id>, 
+# /faa/<id>, /ntsb/<id> and /crs/bill/113th-congress/<senate-bill or house-bill>/<number>, with the 
+# record's ID at the start of the narrative. Each answer takes between half and one and a half times
+# latency seconds, and about errorRate of the requests get a 503 (with Retry-After: 0) instead.
+
+NTSBStart = 'We used data provided by the NTSB to prepare this aircraft accident report.'
+NTSBEnd = '</p><p>Index for Jan 2014'
+CRSStart = '<h3>Latest Summary <span>(1)</span></h3><p>'
+CRSEnd = '</p></div>'
+
+mockSites = {'osha' : (OSHAStart, OSHAEnd), 'faa' : (FAAStart, FAAEnd), 'ntsb' : (NTSBStart, NTSBEnd),
+	'crs' : (CRSStart, CRSEnd)}
+
+class MockSiteHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+	protocol_version = 'HTTP/1.1'
+	disable_nagle_algorithm = True
+
+	def do_GET(self):
+		time.sleep(random.uniform(0.5, 1.5) * self.server.latency)
+		site = self.path.strip('/').split('/')[0]
+		recordID = self.path.rstrip('/').split('/')[-1]
+		if site not in self.server.pages:
+			self.answer(404, 'No such site')
+		elif random.random() < self.server.errorRate:
+			self.answer(503, 'Busy', [('Retry-After', '0')])
+		else:
+			before, after = self.server.pages[site]
+			self.answer(200, before + 'Record ' + recordID + '. ' + after)
+
+	def answer(self, status, body, headers=[]):
+		self.send_response(status)
+		self.send_header('Content-Type', 'text/html; charset=utf-8')
+		self.send_header('Content-Length', str(len(body)))
+		for name, value in headers:
+			self.send_header(name, value)
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, *args):
+		pass
+
+class MockSiteServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+	daemon_threads = True
+	request_queue_size = 128 # the default of 5 drops connections when a run starts 16 at once
+
+	def handle_error(self, request, clientAddress):
+		pass # clients hang up mid-page on purpose (streamBody does, and so does every run when it ends)
+
+def serveMockSites(connection, latency, pageSize, errorRate):
+	server = MockSiteServer(('127.0.0.1', 0), MockSiteHandler)
+	server.latency = latency
+	server.errorRate = errorRate
+	server.pages = {}
+	for site, (startText, endText) in mockSites.items():
+		page = makePage(startText, endText, pageSize=pageSize).encode('utf-8')
+		narrativeStart = page.index(startText) + len(startText)
+		server.pages[site] = (page[:narrativeStart], page[narrativeStart:])
+	connection.send(server.server_address[1])
+	server.serve_forever()
+
+def startMockServer(latency=0.02, pageSize=150000, errorRate=0.01):
+	'''Starts the stand-in server in a process of its own, so it doesn't count against the scraper's CPU
+	time. Returns (process, base URL); process.terminate() stops it.'''
+	parentEnd, childEnd = multiprocessing.Pipe()
+	process = multiprocessing.Process(target=serveMockSites, args=(childEnd, latency, pageSize, errorRate))
+	process.daemon = True
+	process.start()
+	return process, 'http://127.0.0.1:{0}'.format(parentEnd.recv())
+
+class RedirectAdapter(HTTPAdapter):
+	'''Sends requests for URLs starting with realPrefix to mockPrefix instead. formulateBillURLs always
+	makes beta.congress.gov URLs, so this is how the Congress CRS benchmark reaches the stand-in server.'''
+	def __init__(self, realPrefix, mockPrefix, **kwargs):
+		HTTPAdapter.__init__(self, **kwargs)
+		self.realPrefix = realPrefix
+		self.mockPrefix = mockPrefix
+
+	def send(self, request, **kwargs):
+		request.url = self.mockPrefix + request.url[len(self.realPrefix):]
+		return HTTPAdapter.send(self, request, **kwargs)
+
+# Each site is benchmarked through the function you'd really use for it, with the quotes from its
+# kwargs dictionary. The modes are the settings being compared; every mode also gets benchmarkSettings,
+# so that it's the scraper being measured and not the rate limit.
+
+benchmarkSettings = {'requestsPerSecond' : 1000000, 'retryBackoff' : 0.01, 'progress' : False}
+
+benchmarkModes = [
+	('one at a time', {'concurrency' : 1}),
+	('16 threads', {'concurrency' : 16}),
+	('16 threads, lazy + streamBody', {'concurrency' : 16, 'matchMode' : 'lazy', 'streamBody' : True}),
+	('16 threads, 2 extraction processes', {'concurrency' : 16, 'extractionProcesses' : 2}),
+	('16 threads, adaptive from 2/sec', {'concurrency' : 16, 'adaptive' : True, 'requestsPerSecond' : 2.0,
+		'maxRequestsPerSecond' : 1000.0})]
+
+def writeBenchmarkInput(site, fileName, rows):
+	'''Writes an input file with rows records for site and returns the kwargs for scraping it.'''
+	if site == 'crs':
+		with open(fileName, 'w') as inputFile:
+			inputFile.write('Bill number,Title\n')
+			for i in range(rows):
+				inputFile.write('{0},Bill {1}\n'.format(['S. ', 'H.R. '][i % 2] + str(i + 1), i))
+		kwargs = dict((key, value) for key, value in websiteScraper.congressCRSKwargsDict.items()
+			if key in ('uniqueIDColumnName', 'newColumnName', 'startQuote', 'endQuote', 'specialURLs', 'alternateEndQuoteList'))
+		return dict(kwargs, csv_file=fileName, csv_file_destination=fileName + '.out')
+	if site == 'ntsb':
+		with open(fileName, 'w') as inputFile:
+			inputFile.write('Event Id\tLocation\n')
+			for i in range(rows):
+				inputFile.write('2014{0:06d}X{1:05d}\tAirport {1}\n'.format(i, i))
+		return {'tsv_file' : fileName, 'tsv_file_destination' : fileName + '.out', 'uniqueIDColumnName' : 'Event Id',
+			'newColumnName' : 'Description', 'startQuote' : websiteScraper.NTSBKwargsDict['startQuote'],
+			'endQuote' : websiteScraper.NTSBKwargsDict['endQuote']}
+	siteKwargs = {'osha' : websiteScraper.OSHAKwargsDict, 'faa' : websiteScraper.FAAKwargsDict}[site]
+	with open(fileName, 'w') as inputFile:
+		inputFile.write('ID,Name\n')
+		for i in range(rows):
+			inputFile.write('{0},Record {0}\n'.format(100000 + i))
+	return {'csv_file' : fileName, 'csv_file_destination' : fileName + '.out', 'uniqueIDColumnName' : 'ID',
+		'newColumnName' : siteKwargs['newColumnName'], 'startQuote' : siteKwargs['startQuote'], 
+		'endQuote' : siteKwargs['endQuote']}
+
+def timeCalls(function, durations):
+	'''Wraps function so that how long each call takes is added to durations.'''
+	def timedFunction(*args):
+		start = time.time()
+		try:
+			return function(*args)
+		finally:
+			durations.append(time.time() - start)
+	return timedFunction
+
+def percentile(values, fraction):
+	values = sorted(values)
+	if not values:
+		return 0.0
+	return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def peakMegabytes(usage):
+	if sys.platform == 'darwin':
+		return usage.ru_maxrss / (1024.0 * 1024) # bytes on a Mac
+	return usage.ru_maxrss / 1024.0 # kilobytes on Linux
+
+def runBenchmarkMode(connection, site, baseURL, scrapeKwargs):
+	'''Does one benchmark run. It's done in a new process, so the peak memory belongs to this run alone,
+	and it sends back the number of rows, the seconds it took, each record's download time (including 
+	retries), the peak memory in MB of this process and of the extraction processes, and the CPU seconds.'''
+	sys.stdout = open(os.devnull, 'w')
+	kwargs = dict(scrapeKwargs)
+	if site == 'crs':
+		poolSize = max(10, kwargs.get('concurrency', 1))
+		kwargs['session'] = websiteScraper.createSession(poolSize)
+		kwargs['session'].mount('https://beta.congress.gov/', 
+			RedirectAdapter('https://beta.congress.gov/', baseURL + '/crs/', pool_maxsize=poolSize))
+	else:
+		kwargs['urlFormulaPrefix'] = baseURL + '/' + site + '/'
+	latencies = []
+	fetcher = websiteScraper.fetcherFromKwargs(kwargs)
+	fetcher.fetch = timeCalls(fetcher.fetch, latencies)
+	fetcher.fetchUntil = timeCalls(fetcher.fetchUntil, latencies)
+	kwargs['fetcher'] = fetcher
+	start = time.time()
+	if site == 'ntsb':
+		kwargs['headers'] = websiteScraper.createHeaderList(kwargs['tsv_file'])
+		websiteScraper.scrapeUpdateDict(**kwargs)
+		outputFile = kwargs['tsv_file_destination']
+	else:
+		websiteScraper.csvScrapeUpdateDict(**kwargs)
+		outputFile = kwargs['csv_file_destination']
+	seconds = time.time() - start
+	with open(outputFile) as output:
+		rows = sum(1 for line in output) - 1
+	usage = resource.getrusage(resource.RUSAGE_SELF)
+	childUsage = resource.getrusage(resource.RUSAGE_CHILDREN)
+	connection.send((rows, seconds, latencies, peakMegabytes(usage), peakMegabytes(childUsage),
+		usage.ru_utime + usage.ru_stime + childUsage.ru_utime + childUsage.ru_stime))
+
+def benchmarkScraping(sites=('osha',), rows=200, latency=0.02, pageSize=150000, errorRate=0.01, modes=benchmarkModes):
+	'''Scrapes rows made-up records from the stand-in server for each site, once per mode, and prints 
+	rows/sec, the median and 99th percentile download time per record, peak memory and CPU time.'''
+	server, baseURL = startMockServer(latency, pageSize, errorRate)
+	workDir = tempfile.mkdtemp(prefix='scraperBenchmark')
+	try:
+		for site in sites:
+			print "{0}: {1} rows, {2:g} ms latency, {3} KB pages, {4:g}% errors".format(
+				site.upper(), rows, latency * 1000, pageSize / 1024, errorRate * 100)
+			print "  {0:<36} {1:>9} {2:>8} {3:>8} {4:>7} {5:>9} {6:>7}".format(
+				'mode', 'rows/sec', 'p50 ms', 'p99 ms', 'RSS MB', 'child MB', 'CPU s')
+			for modeName, modeKwargs in modes:
+				scrapeKwargs = writeBenchmarkInput(site, os.path.join(workDir, site + '.input'), rows)
+				scrapeKwargs.update(benchmarkSettings)
+				scrapeKwargs.update(modeKwargs)
+				parentEnd, childEnd = multiprocessing.Pipe()
+				run = multiprocessing.Process(target=runBenchmarkMode, args=(childEnd, site, baseURL, scrapeKwargs))
+				run.start()
+				rowsDone, seconds, latencies, megabytes, childMegabytes, cpuSeconds = parentEnd.recv()
+				run.join()
+				print "  {0:<36} {1:>9.1f} {2:>8.1f} {3:>8.1f} {4:>7.1f} {5:>9.1f} {6:>7.2f}".format(modeName, 
+					rowsDone / seconds, percentile(latencies, 0.5) * 1000, percentile(latencies, 0.99) * 1000,
+					megabytes, childMegabytes, cpuSeconds)
+	finally:
+		server.terminate()
+		shutil.rmtree(workDir, ignore_errors=True)
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Benchmarks websiteScraper against made-up pages.')
+	parser.add_argument('--sites', default='osha', help='comma-separated: osha, faa, ntsb, crs or all (default osha)')
+	parser.add_argument('--rows', type=int, default=200, help='records to scrape per run (default 200)')
+	parser.add_argument('--latency', type=float, default=0.02, help="the server's average response time in seconds (default 0.02)")
+	parser.add_argument('--page-size', type=int, default=150000, help='characters per page (default 150000)')
+	parser.add_argument('--error-rate', type=float, default=0.01, help='share of requests that get a 503 (default 0.01)')
+	parser.add_argument('--skip-extraction', action='store_true', help="don't run the extraction benchmark")
+	arguments = parser.parse_args()
+	if not arguments.skip_extraction:
+		benchmarkExtraction()
+	sites = arguments.sites.split(',')
+	if sites == ['all']:
+		sites = ['osha', 'faa', 'ntsb', 'crs']
+	benchmarkScraping(sites, arguments.rows, arguments.latency, arguments.page_size, arguments.error_rate)
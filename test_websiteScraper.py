@@ -0,0 +1,1268 @@
+
+import unittest # unittest runs these checks: python -m unittest test_websiteScraper
+import threading # threading checks that waiting requests aren't left hanging
+import time # time waits out the short cooldowns used here
+import os # os builds the paths of the files the tests write
+import shutil # shutil cleans up the temporary folders
+import tempfile # tempfile gives each test a folder of its own
+import csv # csv reads back the files a run writes
+import sqlite3 # sqlite3 ages the pages in a ResponseCache
+import re # re checks the extractors against the regular expressions they stand in for
+import random # random makes up pages to try the extractors on
+import json # json writes the job files
+import sys # sys lets a test keep what the command line prints
+import StringIO # StringIO holds what the command line prints
+import multiprocessing # multiprocessing starts the pools the parallel reader can share
+import requests # requests supplies the errors a download can raise
+
+import websiteScraper
+
+class FakeResponse(object):
+	def __init__(self, status_code, text=u''):
+		self.status_code = status_code
+		self.text = text
+		self.headers = {}
+
+	def close(self):
+		pass
+
+class FakeSiteFetcher(websiteScraper.PageFetcher):
+	'''A PageFetcher that answers from pages (URL -> page) instead of the network, with a 404 for
+	anything else, and remembers which URLs it requested.'''
+	def __init__(self, pages, delay=0.0, **settings):
+		websiteScraper.PageFetcher.__init__(self, **settings)
+		self.pages = pages
+		self.delay = delay
+		self.requested = []
+
+	def send(self, session, URL, headers=None, stream=False):
+		self.requested.append(URL)
+		time.sleep(self.delay)
+		if URL in self.pages:
+			return FakeResponse(200, self.pages[URL])
+		return FakeResponse(404)
+
+class FailingFetcher(websiteScraper.PageFetcher):
+	'''A PageFetcher whose requests raise the next error in errors, without touching the network.'''
+	def __init__(self, errors, **settings):
+		websiteScraper.PageFetcher.__init__(self, **settings)
+		self.errors = list(errors)
+
+	def send(self, session, URL, headers=None, stream=False):
+		raise self.errors.pop(0)
+
+def quietly(function, *arguments):
+	'''Calls function, keeping what it prints. Returns (what it returned, what it printed).'''
+	saved, sys.stdout = sys.stdout, StringIO.StringIO()
+	try:
+		return function(*arguments), sys.stdout.getvalue()
+	finally:
+		sys.stdout = saved
+
+class TemporaryFolderTest(unittest.TestCase):
+	def setUp(self):
+		self.folder = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.folder)
+
+	def path(self, name):
+		return os.path.join(self.folder, name)
+
+	def writeCSV(self, name, rows, myDelimiter=','):
+		with open(self.path(name), 'wb') as f:
+			csv.writer(f, delimiter=myDelimiter).writerows(rows)
+		return self.path(name)
+
+	def readCSV(self, name, myDelimiter=','):
+		with open(self.path(name), 'rb') as f:
+			return list(csv.reader(f, delimiter=myDelimiter))
+
+def sitePages(ids):
+	return dict(('http://example.com/page/{0}'.format(ID), u'<p>START{0} summaryEND</p>'.format(ID)) for ID in ids)
+
+scrapeSettings = {'uniqueIDColumnName' : 'ID', 'urlFormulaPrefix' : 'http://example.com/page/',
+	'newColumnName' : 'Summary', 'startQuote' : 'START', 'endQuote' : 'END', 'progress' : False}
+
+class ImapOrderedTests(unittest.TestCase):
+	def testResultsComeBackInOrder(self):
+		# the later items finish first, and still come out last
+		def slowThenFast(number):
+			time.sleep(0.01 * (10 - number))
+			return number * number
+		for workers in (1, 4):
+			self.assertEqual(list(websiteScraper.imapOrdered(slowThenFast, range(10), workers)), [number * number for number in range(10)])
+
+	def testReadsAheadNoMoreThanTheWindow(self):
+		read = []
+		def items():
+			for number in range(20):
+				read.append(number)
+				yield number
+		results = websiteScraper.imapOrdered(lambda number: number, items(), workers=2, window=3)
+		self.assertEqual(next(results), 0)
+		self.assertTrue(len(read) <= 4)
+		self.assertEqual(list(results), range(1, 20))
+
+	def testAnErrorStopsTheRun(self):
+		def failOnThree(number):
+			if number == 3:
+				raise ValueError(number)
+			return number
+		results = websiteScraper.imapOrdered(failOnThree, range(10), workers=3)
+		self.assertEqual([next(results) for number in range(3)], [0, 1, 2])
+		self.assertRaises(ValueError, next, results)
+
+class TimedRowsTests(unittest.TestCase):
+	def testInnerStageTimeIsThisRowsOnly(self):
+		# two chains of stages share one RunMetrics, the way concurrent jobs' threads can; each one's
+		# outer stage should only be charged for its own work, not for the other chain's reading
+		metrics = websiteScraper.RunMetrics(progress=False)
+		def slowly(rows, seconds):
+			for row in rows:
+				time.sleep(seconds)
+				yield row
+		def chain(readSeconds, urlSeconds):
+			rows = websiteScraper.timedRows(slowly(range(5), readSeconds), metrics, 'read')
+			for row in websiteScraper.timedRows(slowly(rows, urlSeconds), metrics, 'URLs', 'read'):
+				pass
+		threads = [threading.Thread(target=chain, args=(0.05, 0.0)), threading.Thread(target=chain, args=(0.0, 0.02))]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		self.assertTrue(metrics.stages['read'][1] >= 0.25)
+		self.assertTrue(0.09 <= metrics.stages['URLs'][1] < 0.2)
+
+class TokenBucketTests(unittest.TestCase):
+	def testKeepsToTheRate(self):
+		bucket = websiteScraper.TokenBucket(50, capacity=1)
+		start = time.time()
+		for request in range(6):
+			bucket.acquire()
+		self.assertTrue(time.time() - start >= 0.09) # the first token is there already; the other five take 0.1 s
+
+class AdaptiveRateLimiterTests(unittest.TestCase):
+	def answer(self, host, outcome, firstByteSeconds=0.02):
+		host.inFlight += 1 # as if acquire had let the request through
+		return host.release(firstByteSeconds if outcome == 'ok' else None, outcome)
+
+	def host(self):
+		return websiteScraper.AdaptiveRateLimiter(2.0, 16, maxRequestsPerSecond=1000.0).hostFor('http://example.com/')
+
+	def testCleanTrafficSpeedsUp(self):
+		host = self.host()
+		for request in range(100):
+			self.assertEqual(self.answer(host, 'ok'), None)
+		self.assertEqual(host.bucket.rate, 102.0)
+		self.assertEqual(host.limit, 16.0)
+
+	def testSustainedThrottlingSlowsDown(self):
+		host = self.host()
+		for request in range(100):
+			self.answer(host, 'ok')
+		answers = []
+		while 'slowed down' not in answers:
+			answers.append(self.answer(host, 'throttled'))
+			self.assertTrue(len(answers) <= 20) # a minimum sample, and no more
+		self.assertEqual((host.bucket.rate, host.limit), (51.0, 8.0))
+		self.assertEqual([self.answer(host, 'throttled') for request in range(30)], [None] * 30) # the cool-down
+		host.lastDecrease -= 2.0
+		self.assertEqual(self.answer(host, 'throttled'), 'slowed down') # the window still has the earlier 503s
+		self.assertEqual((host.bucket.rate, host.limit), (25.5, 4.0))
+
+	def testOneEarly503DoesntCount(self):
+		host = self.host()
+		self.assertEqual(self.answer(host, 'throttled'), None)
+		self.assertEqual(host.bucket.rate, 2.0)
+
+	def testNoiseBelowTheErrorRateDoesntSlowDown(self):
+		# 1 in 100 requests throttled, under the 5% adaptiveErrorRate, even where they bunch up
+		host = self.host()
+		for request in range(3000):
+			outcome = 'throttled' if request % 100 == 10 or request % 700 == 11 else 'ok'
+			self.assertEqual(self.answer(host, outcome), None)
+		self.assertEqual(host.bucket.rate, 1000.0)
+
+class CircuitBreakerTests(unittest.TestCase):
+	def testOpensWhenTooManyRequestsFail(self):
+		breaker = websiteScraper.CircuitBreaker(window=10, errorRate=0.5, cooldown=10.0, minimumRequests=4)
+		for succeeded in (True, False, False):
+			breaker.recordResult(succeeded)
+		self.assertEqual(breaker.state, 'closed') # not enough requests yet to judge
+		breaker.recordResult(False)
+		self.assertEqual(breaker.state, 'open')
+		self.assertTrue(breaker.openUntil > time.time() + 9)
+
+	def testTrialSuccessClosesTheCircuit(self):
+		breaker = websiteScraper.CircuitBreaker(errorRate=0.0, cooldown=0.05, minimumRequests=1)
+		breaker.recordResult(False)
+		self.assertEqual(breaker.state, 'open')
+		start = time.time()
+		self.assertEqual(breaker.beforeRequest(), True) # waits out the cooldown, then makes the trial
+		self.assertTrue(time.time() - start >= 0.04)
+		self.assertEqual(breaker.state, 'trial')
+		breaker.recordResult(True, trial=True)
+		self.assertEqual(breaker.state, 'closed')
+		self.assertEqual(breaker.currentCooldown, 0.05)
+		self.assertEqual(breaker.beforeRequest(), False)
+
+	def testTrialFailureDoublesTheCooldown(self):
+		breaker = websiteScraper.CircuitBreaker(errorRate=0.0, cooldown=0.05, maxCooldown=0.15, minimumRequests=1)
+		breaker.recordResult(False)
+		for cooldown in (0.1, 0.15, 0.15):
+			self.assertEqual(breaker.beforeRequest(), True)
+			breaker.recordResult(False, trial=True)
+			self.assertEqual(breaker.state, 'open')
+			self.assertAlmostEqual(breaker.openUntil - time.time(), cooldown, delta=0.03)
+
+	def testOthersWaitForTheTrial(self):
+		breaker = websiteScraper.CircuitBreaker(errorRate=0.0, cooldown=0.0, minimumRequests=1)
+		breaker.recordResult(False)
+		self.assertEqual(breaker.beforeRequest(), True)
+		answers = []
+		waiter = threading.Thread(target=lambda: answers.append(breaker.beforeRequest()))
+		waiter.daemon = True
+		waiter.start()
+		time.sleep(0.05)
+		self.assertEqual(answers, []) # still waiting on the trial
+		breaker.recordResult(True, trial=True)
+		waiter.join(2.0)
+		self.assertEqual(answers, [False])
+
+	def testTrialFailureNotRetriedStillSettlesTheBreaker(self):
+		# the trial request dies with an error get() doesn't retry, and the breaker has to open again
+		# rather than stay in 'trial', where the next request would wait on it forever
+		breakers = websiteScraper.HostCircuitBreakers(window=4, minimumRequests=1, errorRate=0.0, cooldown=0.05)
+		breaker = breakers.breakerFor('http://example.com/a')
+		breaker.recordResult(False)
+		self.assertEqual(breaker.state, 'open')
+		fetcher = FailingFetcher([requests.exceptions.InvalidURL('bad')], maxRetries=0, circuitBreakers=breakers)
+		time.sleep(0.06)
+		self.assertRaises(requests.exceptions.InvalidURL, fetcher.get, 'http://example.com/a')
+		self.assertEqual(breaker.state, 'open')
+		time.sleep(breaker.openUntil - time.time() + 0.01)
+		finished = []
+		waiter = threading.Thread(target=lambda: finished.append(breaker.beforeRequest()))
+		waiter.daemon = True
+		waiter.start()
+		waiter.join(2.0)
+		self.assertEqual(finished, [True])
+
+	def testBrokenBodiesAreRetried(self):
+		fetcher = FailingFetcher([requests.exceptions.ChunkedEncodingError('cut off'),
+			requests.exceptions.ContentDecodingError('garbled')], maxRetries=1, retryBackoff=0.0)
+		self.assertRaises(requests.exceptions.ContentDecodingError, fetcher.get, 'http://example.com/b')
+		self.assertEqual(fetcher.errors, [])
+		self.assertEqual(fetcher.metrics.events['retry'], 1)
+
+class SlowFetcher(websiteScraper.PageFetcher):
+	'''A PageFetcher whose fetchPage takes a moment and returns answer (or raises it, if it's an error).'''
+	def __init__(self, answer):
+		websiteScraper.PageFetcher.__init__(self)
+		self.answer = answer
+		self.calls = 0
+
+	def fetchPage(self, URL):
+		self.calls += 1
+		time.sleep(0.2)
+		if isinstance(self.answer, Exception):
+			raise self.answer
+		return self.answer
+
+class SharedFetchTests(TemporaryFolderTest):
+	def fetchAtOnce(self, fetchers, URL):
+		results = [None] * len(fetchers)
+		def fetch(number):
+			try:
+				results[number] = fetchers[number].fetch(URL)
+			except Exception as error:
+				results[number] = error
+		threads = [threading.Thread(target=fetch, args=(number,)) for number in range(len(fetchers))]
+		for thread in threads:
+			thread.start()
+			time.sleep(0.02)
+		for thread in threads:
+			thread.join()
+		return results
+
+	def testOneFetcherSharesADownload(self):
+		fetcher = SlowFetcher('page')
+		self.assertEqual(self.fetchAtOnce([fetcher, fetcher], 'http://example.com/c'), ['page', 'page'])
+		self.assertEqual(fetcher.calls, 1)
+		self.assertEqual(fetcher.metrics.events['shared download'], 1)
+
+	def testJobsWithTheSameSettingsShareADownload(self):
+		# what runJobs does: each job gets its own fetcher, with the session they all share
+		session = websiteScraper.createSession()
+		fetchers = [FakeSiteFetcher(sitePages([1]), 0.2, session=session) for job in range(3)]
+		results = self.fetchAtOnce(fetchers, 'http://example.com/page/1')
+		self.assertEqual(results, [u'<p>START1 summaryEND</p>'] * 3)
+		self.assertEqual(sum(len(fetcher.requested) for fetcher in fetchers), 1)
+		self.assertEqual(sum(fetcher.metrics.events['shared download'] for fetcher in fetchers), 2)
+
+	def testFetchersWithOtherSettingsDontShare(self):
+		session = websiteScraper.createSession()
+		offline = FakeSiteFetcher(sitePages([1]), 0.2, session=session,
+			cache=websiteScraper.ResponseCache(self.path('cache'), offline=True))
+		online = FakeSiteFetcher(sitePages([1]), 0.2, session=session, cache=websiteScraper.ResponseCache(self.path('cache')))
+		otherSession = FakeSiteFetcher(sitePages([1]), 0.2, session=websiteScraper.createSession())
+		results = self.fetchAtOnce([offline, online, otherSession], 'http://example.com/page/1')
+		self.assertTrue(isinstance(results[0], websiteScraper.OfflineCacheMiss))
+		self.assertEqual(results[1:], [u'<p>START1 summaryEND</p>'] * 2)
+		self.assertEqual([len(fetcher.requested) for fetcher in (offline, online, otherSession)], [0, 1, 1])
+
+class SharedMemoryCacheTests(unittest.TestCase):
+	def setUp(self):
+		self.saved = websiteScraper.sharedMemoryCache
+		websiteScraper.sharedMemoryCache = None
+
+	def tearDown(self):
+		websiteScraper.sharedMemoryCache = self.saved
+
+	def testGrowsToTheBiggestBudgetAndNeverShrinks(self):
+		cache = websiteScraper.getSharedMemoryCache(1000, 100)
+		self.assertTrue(websiteScraper.getSharedMemoryCache(4000) is cache)
+		self.assertEqual((cache.pages.maxBytes, cache.results.maxBytes), (4000, 1000))
+		websiteScraper.getSharedMemoryCache(500, 50)
+		self.assertEqual((cache.pages.maxBytes, cache.results.maxBytes), (4000, 1000))
+
+class RunJobsTests(TemporaryFolderTest):
+	def setUp(self):
+		TemporaryFolderTest.setUp(self)
+		self.savedMemoryCache = websiteScraper.sharedMemoryCache
+		websiteScraper.sharedMemoryCache = None
+		self.source = self.writeCSV('in.csv', [['ID'], ['1'], ['2']])
+
+	def tearDown(self):
+		websiteScraper.sharedMemoryCache = self.savedMemoryCache
+		TemporaryFolderTest.tearDown(self)
+
+	def job(self, jobName, destination, **settings):
+		return websiteScraper.jobFromSettings(dict(scrapeSettings, csv_file=self.source, csv_file_destination=destination,
+			fetcher=FakeSiteFetcher(sitePages([1, 2])), **settings), jobName)
+
+	def testAFailedJobWithAMemoryCacheDoesntStopTheOthers(self):
+		# the bad job can't open its destination, so it fails before the shared memory cache is made
+		bad = self.job('bad', self.path('no such folder/out.csv'), memoryCacheBytes=1024*1024)
+		good = self.job('good', self.path('good.csv'))
+		results = dict(websiteScraper.runJobs([bad, good], parallel=2))
+		self.assertTrue(isinstance(results['bad'], IOError))
+		self.assertEqual(results['good'], None)
+		self.assertEqual(len(self.readCSV('good.csv')), 3)
+
+class MemoryLRUTests(unittest.TestCase):
+	def testThrowsOutTheLeastRecentlyUsed(self):
+		size = websiteScraper.memorySize('a') + websiteScraper.memorySize(u'x' * 100)
+		cache = websiteScraper.MemoryLRU(size * 2)
+		cache.put('a', u'x' * 100)
+		cache.put('b', u'y' * 100)
+		self.assertEqual(cache.get('a'), u'x' * 100) # now 'b' is the least recently used
+		cache.put('c', u'z' * 100)
+		self.assertEqual(cache.get('b'), None)
+		self.assertEqual(cache.get('c'), u'z' * 100)
+		self.assertEqual(cache.stats()['evictions'], 1)
+
+	def testDoesntKeepWhatsBiggerThanTheBudget(self):
+		cache = websiteScraper.MemoryLRU(100)
+		cache.put('big', u'x' * 1000)
+		self.assertEqual(cache.get('big'), None)
+		self.assertEqual(cache.currentBytes, 0)
+
+class ResponseCacheTests(TemporaryFolderTest):
+	def age(self, cacheDir, URL, seconds):
+		connection = sqlite3.connect(os.path.join(cacheDir, 'index.sqlite'))
+		connection.execute('UPDATE pages SET fetched = fetched - ? WHERE URL = ?', (seconds, URL))
+		connection.commit()
+		connection.close()
+
+	def testPagesExpireAfterTheTTL(self):
+		cacheDir = self.path('cache')
+		cache = websiteScraper.ResponseCache(cacheDir, ttl=60)
+		cache.put('http://example.com/page/1', u'caf\xe9')
+		self.assertEqual(cache.get('http://example.com/page/1'), u'caf\xe9')
+		self.age(cacheDir, 'http://example.com/page/1', 120)
+		self.assertEqual(cache.get('http://example.com/page/1'), None)
+		offline = websiteScraper.ResponseCache(cacheDir, ttl=60, offline=True)
+		self.assertEqual(offline.get('http://example.com/page/1'), u'caf\xe9') # offline, old beats nothing
+
+	def testFetcherUsesTheCacheAndOfflineMissesRaise(self):
+		cacheDir = self.path('cache')
+		online = FakeSiteFetcher(sitePages([1]), cache=websiteScraper.ResponseCache(cacheDir))
+		page = online.fetch('http://example.com/page/1')
+		self.assertEqual(online.fetch('http://example.com/page/1'), page)
+		self.assertEqual(online.requested, ['http://example.com/page/1'])
+		offline = FakeSiteFetcher(sitePages([1, 2]), cache=websiteScraper.ResponseCache(cacheDir, offline=True))
+		self.assertEqual(offline.fetch('http://example.com/page/1'), page)
+		self.assertRaises(websiteScraper.OfflineCacheMiss, offline.fetch, 'http://example.com/page/2')
+		self.assertEqual(offline.requested, [])
+
+	def testEvictsTheLeastRecentlyUsedPages(self):
+		cache = websiteScraper.ResponseCache(self.path('cache'), maxBytes=1)
+		cache.put('http://example.com/page/1', u'one')
+		cache.put('http://example.com/page/2', u'two')
+		self.assertEqual(cache.get('http://example.com/page/1'), None)
+		self.assertEqual(cache.currentBytes, 0)
+
+class CheckpointTests(TemporaryFolderTest):
+	def testResumeOnlyScrapesWhatsLeft(self):
+		rows = [['ID', 'Name']] + [[str(ID), 'row ' + str(ID)] for ID in range(1, 6)]
+		source = self.writeCSV('in.csv', rows)
+		settings = dict(scrapeSettings, csv_file=source, checkpointFile=self.path('checkpoint.db'))
+		firstRun = FakeSiteFetcher(sitePages([1, 2, 4, 5])) # page 3 is missing the first time
+		websiteScraper.csvScrapeUpdateDict(csv_file_destination=self.path('first.csv'), fetcher=firstRun, **settings)
+		journal = websiteScraper.CheckpointJournal(self.path('checkpoint.db'))
+		self.assertEqual(journal.counts(), (4, 1))
+		journal.close()
+		secondRun = FakeSiteFetcher(sitePages([1, 2, 3, 4, 5]))
+		websiteScraper.csvScrapeUpdateDict(csv_file_destination=self.path('second.csv'), fetcher=secondRun, **settings)
+		self.assertEqual(secondRun.requested, ['http://example.com/page/3'])
+		output = self.readCSV('second.csv')
+		self.assertEqual(output[0], ['ID', 'Name', 'URL', 'Summary'])
+		self.assertEqual([row[3] for row in output[1:]], ['{0} summary'.format(ID) for ID in range(1, 6)])
+
+class ShardTests(TemporaryFolderTest):
+	def setUp(self):
+		TemporaryFolderTest.setUp(self)
+		rows = [['ID', 'Name']] + [[str(ID), 'row "{0}",\nwith a comma'.format(ID) if ID % 7 == 0 else 'row ' + str(ID)] for ID in range(1, 41)]
+		self.source = self.writeCSV('in.csv', rows)
+		self.pages = sitePages(range(1, 41))
+
+	def scrape(self, destination, **settings):
+		websiteScraper.csvScrapeUpdateDict(csv_file=self.source, csv_file_destination=self.path(destination),
+			fetcher=FakeSiteFetcher(self.pages), **dict(scrapeSettings, **settings))
+		return self.path(destination)
+
+	def testHashShardsMergeBackIntoTheWholeRun(self):
+		whole = self.scrape('whole.csv')
+		partialFiles = [self.scrape('part{0}.csv'.format(k), shard=(k, 3)) for k in (1, 2, 3)]
+		shardSizes = [len(self.readCSV(os.path.basename(partialFile))) - 1 for partialFile in partialFiles]
+		self.assertEqual(sum(shardSizes), 40)
+		self.assertEqual(websiteScraper.mergeShards(partialFiles, self.path('merged.csv'), self.source), 40)
+		self.assertEqual(self.readCSV('merged.csv'), self.readCSV(os.path.basename(whole)))
+
+	def testByteRangesMergeBackIntoTheWholeRun(self):
+		# byte ranges split on line breaks, so this file has none inside its quoted fields
+		rows = [['ID', 'Name']] + [[str(ID), 'row, ' + str(ID)] for ID in range(1, 41)]
+		self.source = self.writeCSV('plain.csv', rows)
+		whole = self.scrape('whole.csv')
+		partialFiles = [self.scrape('part{0}.csv'.format(k), shardByteRange=byteRange)
+			for k, byteRange in enumerate(websiteScraper.shardByteRanges(self.source, 3))]
+		self.assertEqual(websiteScraper.mergeShards(partialFiles, self.path('merged.csv'), self.source), 40)
+		self.assertEqual(self.readCSV('merged.csv'), self.readCSV(os.path.basename(whole)))
+
+	def testTheCommandLineMergesAJobsPartialFiles(self):
+		whole = self.scrape('whole.csv')
+		partialFiles = [self.scrape('part{0}.csv'.format(k), shard=(k, 2)) for k in (1, 2)]
+		jobFile = self.path('jobs.json')
+		with open(jobFile, 'w') as jobs:
+			json.dump([dict(scrapeSettings, jobName='sharded', csv_file=self.source, csv_file_destination=self.path('part1.csv'), shard=[1, 2]),
+				dict(scrapeSettings, jobName='other', csv_file=self.source)], jobs)
+		self.assertEqual(quietly(websiteScraper.main, [jobFile, '--merge', self.path('merged.csv')] + partialFiles)[0], 2) # which job?
+		self.assertEqual(quietly(websiteScraper.main, [jobFile, '--job', 'sharded', '--merge', self.path('merged.csv')]),
+			(2, "--merge needs the merged file and then the partial files.\n"))
+		self.assertEqual(quietly(websiteScraper.main, [jobFile, '--job', 'sharded', '--merge', self.path('merged.csv')] + partialFiles),
+			(0, "Merged 40 rows from 2 partial file(s) into {0}.\n".format(self.path('merged.csv'))))
+		self.assertEqual(self.readCSV('merged.csv'), self.readCSV(os.path.basename(whole)))
+
+	def testThereHaveToBePartialFilesToMerge(self):
+		self.assertRaises(ValueError, websiteScraper.mergeShards, [], self.path('merged.csv'), self.source)
+		self.assertFalse(os.path.exists(self.path('merged.csv')))
+
+class ParallelRowReaderTests(TemporaryFolderTest):
+	def testReadsLikeRowReaderWithItsProcessesStartedUpFront(self):
+		rows = [['ID', 'Name']] + [[str(ID), 'row "{0}",\nwith a comma'.format(ID) if ID % 7 == 0 else 'row ' + str(ID)] for ID in range(1, 501)]
+		source = self.writeCSV('in.csv', rows)
+		reader = websiteScraper.ParallelRowReader(source, ',', 2, 1024, dict(scrapeSettings))
+		self.assertTrue(reader.pool is not None) # before any rows are read, and before any threads start
+		readRows = [(row['ID'], row['Name'], row['URL']) for row in reader]
+		self.assertEqual(readRows, [(ID, name, 'http://example.com/page/' + ID) for ID, name in rows[1:]])
+		self.assertEqual(reader.pool, None)
+		reader.close() # closing again does no harm
+
+	def testClosingBeforeReadingStopsTheProcesses(self):
+		source = self.writeCSV('in.csv', [['ID'], ['1'], ['2']])
+		reader = websiteScraper.ParallelRowReader(source, ',', 2, 1024, dict(scrapeSettings))
+		processes = list(reader.pool._pool)
+		reader.close()
+		for process in processes:
+			process.join(5.0)
+			self.assertFalse(process.is_alive())
+
+	def testWithoutProcessesTheRowsAreReadInThisProcess(self):
+		rows = [['ID', 'Name']] + [[str(ID), 'row "{0}",\nwith a comma'.format(ID) if ID % 7 == 0 else 'row ' + str(ID)] for ID in range(1, 101)]
+		source = self.writeCSV('in.csv', rows)
+		reader = websiteScraper.ParallelRowReader(source, ',', 0, 256, dict(scrapeSettings))
+		self.assertEqual((reader.pool, reader.formulatesURLs), (None, False)) # the run makes the URLs
+		self.assertEqual([row.values for row in reader], [row.values for row in websiteScraper.RowReader(source)])
+
+	def testReadingProcessesAreOnlyStartedWhenTheyHelp(self):
+		source = self.writeCSV('in.csv', [['ID']] + [[str(ID)] for ID in range(1, 1001)])
+		cores = multiprocessing.cpu_count
+		try:
+			multiprocessing.cpu_count = lambda: 1
+			self.assertEqual(websiteScraper.readingProcesses(True, source, 64), 0) # they'd compete with the run
+			self.assertEqual(websiteScraper.readingProcesses(4, source, 64), 0)
+			multiprocessing.cpu_count = lambda: 4
+			self.assertEqual(websiteScraper.readingProcesses(True, source, 64), 4)
+			self.assertEqual(websiteScraper.readingProcesses(2, source, 64), 2)
+			self.assertEqual(websiteScraper.readingProcesses(1, source, 64), 0)
+			self.assertEqual(websiteScraper.readingProcesses(True, source, 4 * 1024 * 1024), 0) # just one chunk
+		finally:
+			multiprocessing.cpu_count = cores
+
+	def testReadersCanShareAPool(self):
+		source = self.writeCSV('in.csv', [['ID']] + [[str(ID)] for ID in range(1, 201)])
+		pool = multiprocessing.Pool(2)
+		try:
+			for prefix in ('http://example.com/page/', 'http://example.com/other/'):
+				reader = websiteScraper.ParallelRowReader(source, ',', 2, 64, dict(scrapeSettings, urlFormulaPrefix=prefix), pool)
+				self.assertTrue(reader.formulatesURLs)
+				self.assertEqual([row['URL'] for row in reader], [prefix + str(ID) for ID in range(1, 201)])
+			self.assertEqual(pool.apply(len, ('still running',)), 13) # closing the readers left it for its owner
+		finally:
+			pool.terminate()
+
+	def testRunJobsStartsTheReadingProcessesBeforeAnyJob(self):
+		source = self.writeCSV('in.csv', [['ID']] + [[str(ID)] for ID in range(1, 201)])
+		pages = sitePages(range(1, 201))
+		jobs = [websiteScraper.jobFromSettings(dict(scrapeSettings, csv_file=source, csv_file_destination=self.path(name),
+			fetcher=FakeSiteFetcher(pages), parallelRead=True, parallelReadChunkBytes=64, concurrency=4), name) for name in ('one', 'two')]
+		startedWith = []
+		cores, startPool = multiprocessing.cpu_count, multiprocessing.Pool
+		def recordingPool(*arguments):
+			startedWith.append(threading.active_count())
+			return startPool(*arguments)
+		try:
+			multiprocessing.cpu_count = lambda: 2
+			multiprocessing.Pool = recordingPool
+			self.assertEqual(websiteScraper.runJobs(jobs, parallel=2), [('one', None), ('two', None)])
+		finally:
+			multiprocessing.cpu_count, multiprocessing.Pool = cores, startPool
+		self.assertEqual(startedWith, [threading.active_count()]) # one pool, started before the jobs' threads
+		for name in ('one', 'two'):
+			self.assertEqual([row[2] for row in self.readCSV(name)[1:]], ['{0} summary'.format(ID) for ID in range(1, 201)])
+
+class PageArchiveTests(TemporaryFolderTest):
+	def testPagesSurviveReopeningAndNewSegments(self):
+		archiveDir = self.path('archive')
+		archive = websiteScraper.PageArchive(archiveDir, segmentBytes=200, batchSize=2)
+		for ID in range(1, 5):
+			archive.add(str(ID), 'http://example.com/page/{0}'.format(ID), u'page {0} \u2713 '.format(ID) * 20)
+		self.assertTrue(archive.alias('5', 'http://example.com/page/2'))
+		self.assertFalse(archive.alias('6', 'http://example.com/page/9'))
+		self.assertEqual(archive.page('3'), u'page 3 \u2713 ' * 20)
+		archive.close()
+		self.assertTrue(os.path.exists(websiteScraper.archiveSegmentPath(archiveDir, 1)))
+		archive = websiteScraper.PageArchive(archiveDir, readOnly=True)
+		self.assertEqual(archive.page('5'), u'page 2 \u2713 ' * 20)
+		self.assertEqual([row[0] for row in archive.latestPages()], ['1', '2', '5', '3', '4'])
+		self.assertEqual(archive.page('6'), None)
+		archive.close()
+
+class ExtractorTests(unittest.TestCase):
+	def testPlainQuotesMatchWhatTheRegularExpressionFinds(self):
+		# quotes made by strToRegEx skip regular expressions, and have to find the same text they would
+		randomPages = random.Random(6)
+		quotes = [('<td class="x">', '</td>'), ('a.b', 'b?a'), ('(', ')'), ('START', 'END'), (u'caf\xe9 '.encode('utf-8'), '$')]
+		for startText, endText in quotes:
+			startQuote, endQuote = websiteScraper.strToRegEx(startText), websiteScraper.strToRegEx(endText)
+			for matchMode, group in (('greedy', '(.+)'), ('lazy', '(.+?)')):
+				extractor = websiteScraper.Extractor(startQuote, endQuote, matchMode)
+				self.assertEqual(extractor.pattern, None)
+				pattern = re.compile(startQuote + group + endQuote, re.DOTALL)
+				pieces = [startText.decode('utf-8'), endText.decode('utf-8'), u'x', u'\n', u'a', u'b', u'.']
+				for page in range(300):
+					page = u''.join(randomPages.choice(pieces) for piece in range(randomPages.randint(0, 12)))
+					found = pattern.search(page.encode('utf-8'))
+					expected = found.group(1).decode('utf-8') if found else None
+					self.assertEqual(extractor.extract(page), expected, (startText, endText, matchMode, page))
+
+	def testRealRegularExpressionsStillWork(self):
+		extractor = websiteScraper.Extractor(r'Summary:\s+', r'\s*</p>', 'lazy')
+		self.assertNotEqual(extractor.pattern, None)
+		self.assertEqual(extractor.extract(u'<p>Summary:   one</p><p>Summary: two</p>'), u'one')
+		self.assertEqual(websiteScraper.Extractor(r'Summary:\s+', r'\s*</p>').extract(u'<p>Summary: one</p> two</p>'), u'one</p> two')
+		self.assertEqual(extractor.extract(u'nothing here'), None)
+
+	def testBadMatchModeIsRefused(self):
+		self.assertRaises(ValueError, websiteScraper.Extractor, 'a', 'b', 'sloppy')
+
+class MultiFieldTests(TemporaryFolderTest):
+	def testExtractFieldsRunsEveryFieldOverOnePage(self):
+		fields = [('Title', '<h1>', '</h1>'), ('Date', 'Date: ', '<'), ('Missing', 'nope', 'nope')]
+		page = u'<h1>Caf\xe9 rules</h1><p>Date: 2014-01-02</p><p>Summary: short.</p>'
+		scraped = websiteScraper.extractFields(page, websiteScraper.fieldExtractorsFor(fields, 'lazy'))
+		self.assertEqual(scraped, {'Title' : 'Caf\xc3\xa9 rules', 'Date' : '2014-01-02', 'Missing' : None})
+
+	def testAlternateEndQuotesAreOnlyTriedWhenNeeded(self):
+		fieldExtractors = websiteScraper.fieldExtractorsFor([('Summary', 'Summary: ', 'ZZZ')], 'lazy', [r'\.', '</p>'])
+		self.assertEqual(websiteScraper.extractFields(u'<p>Summary: short. More</p>', fieldExtractors), {'Summary' : 'short'})
+		self.assertEqual(websiteScraper.extractFields(u'<p>Summary: end ZZZ.</p>', fieldExtractors), {'Summary' : 'end '})
+
+	def testEachPageIsDownloadedOnceForAllTheColumns(self):
+		source = self.writeCSV('in.csv', [['ID'], ['1'], ['2']])
+		pages = dict(('http://example.com/page/{0}'.format(ID), u'<h1>Title {0}</h1><p>Body {0}</p>'.format(ID)) for ID in (1, 2))
+		fetcher = FakeSiteFetcher(pages)
+		websiteScraper.csvScrapeUpdateDict(csv_file=source, csv_file_destination=self.path('out.csv'), fetcher=fetcher,
+			uniqueIDColumnName='ID', urlFormulaPrefix='http://example.com/page/', progress=False,
+			extractors=[('Title', '<h1>', '</h1>'), ('Body', '<p>', '</p>')])
+		self.assertEqual(self.readCSV('out.csv'), [['ID', 'URL', 'Title', 'Body'], ['1', 'http://example.com/page/1', 'Title 1', 'Body 1'],
+			['2', 'http://example.com/page/2', 'Title 2', 'Body 2']])
+		self.assertEqual(fetcher.requested, ['http://example.com/page/1', 'http://example.com/page/2'])
+
+def slowSquare(number):
+	'''Runs in an extraction process: the early numbers take the longest.'''
+	time.sleep(0.005 * (20 - number))
+	return number * number
+
+class ExtractionProcessTests(TemporaryFolderTest):
+	def testProcessMapKeepsTheOrder(self):
+		pairs = [('key {0}'.format(number), None if number % 5 == 0 else number) for number in range(20)]
+		results = list(websiteScraper.processMapOrdered(slowSquare, pairs, 2, window=4))
+		self.assertEqual(results, [(key, None if number is None else number * number) for key, number in pairs])
+
+	def testExtractionProcessesWriteTheSameRowsInTheSameOrder(self):
+		ids = range(1, 41)
+		source = self.writeCSV('in.csv', [['ID']] + [[str(ID)] for ID in ids])
+		pages = sitePages(ids)
+		pages['http://example.com/page/7'] = u'<p>no quotes here</p>'
+		del pages['http://example.com/page/9']
+		for name, processes in (('threads.csv', 0), ('processes.csv', 2)):
+			websiteScraper.csvScrapeUpdateDict(csv_file=source, csv_file_destination=self.path(name), fetcher=FakeSiteFetcher(pages, 0.002),
+				concurrency=4, extractionProcesses=processes, **scrapeSettings)
+		self.assertEqual(self.readCSV('processes.csv'), self.readCSV('threads.csv'))
+		self.assertEqual([row[0] for row in self.readCSV('processes.csv')[1:]], [str(ID) for ID in ids])
+		self.assertEqual(self.readCSV('processes.csv')[3][2], '3 summary')
+
+class ConditionalSiteFetcher(FakeSiteFetcher):
+	'''A FakeSiteFetcher whose pages have an ETag (a fingerprint of the page), answering 304 when the 
+	request's If-None-Match is still right. It remembers the headers each request was sent with.'''
+	def __init__(self, pages, **settings):
+		FakeSiteFetcher.__init__(self, pages, **settings)
+		self.sentHeaders = []
+
+	def send(self, session, URL, headers=None, stream=False):
+		self.requested.append(URL)
+		self.sentHeaders.append(dict(headers or {}))
+		etag = '"{0}"'.format(hash(self.pages[URL]))
+		if (headers or {}).get('If-None-Match') == etag:
+			response = FakeResponse(304)
+		else:
+			response = FakeResponse(200, self.pages[URL])
+		response.headers['ETag'] = etag
+		return response
+
+class RefreshTests(TemporaryFolderTest):
+	def refresh(self, fetcher, destination):
+		websiteScraper.csvScrapeUpdateDict(csv_file=self.source, csv_file_destination=self.path(destination), fetcher=fetcher,
+			refreshStateFile=self.path('refresh.db'), **scrapeSettings)
+		return [row[2] for row in self.readCSV(destination)[1:]]
+
+	def testUnchangedPagesReuseWhatWasScraped(self):
+		self.source = self.writeCSV('in.csv', [['ID'], ['1'], ['2'], ['3']])
+		pages = sitePages([1, 2, 3])
+		first = ConditionalSiteFetcher(pages)
+		self.assertEqual(self.refresh(first, 'first.csv'), ['1 summary', '2 summary', '3 summary'])
+		self.assertEqual(first.sentHeaders, [{}, {}, {}])
+		pages['http://example.com/page/2'] = u'<p>START2 new summaryEND</p>'
+		second = ConditionalSiteFetcher(pages)
+		self.assertEqual(self.refresh(second, 'second.csv'), ['1 summary', '2 new summary', '3 summary'])
+		self.assertEqual([headers.get('If-None-Match') is not None for headers in second.sentHeaders], [True, True, True])
+		self.assertEqual(second.sentHeaders[0]['If-None-Match'], '"{0}"'.format(hash(pages['http://example.com/page/1'])))
+		self.assertEqual(self.readCSV('second.csv')[0], ['ID', 'URL', 'Summary'])
+
+	def testFetchIfChangedSaysWhenThePageHasntChanged(self):
+		fetcher = ConditionalSiteFetcher(sitePages([1]))
+		page, etag, lastModified = fetcher.fetchIfChanged('http://example.com/page/1')
+		self.assertEqual(page, u'<p>START1 summaryEND</p>')
+		self.assertEqual(fetcher.fetchIfChanged('http://example.com/page/1', etag, lastModified), (None, etag, None))
+		self.assertEqual(fetcher.sentHeaders[1], {'If-None-Match' : etag})
+
+class StreamedResponse(FakeResponse):
+	'''A FakeResponse whose body comes in chunkSize pieces, counting how many were read. With dropAfter,
+	the connection drops (a ChunkedEncodingError) after that many chunks.'''
+	def __init__(self, status_code, text=u'', dropAfter=None):
+		FakeResponse.__init__(self, status_code, text)
+		self.encoding = 'utf-8'
+		self.chunksRead = 0
+		self.dropAfter = dropAfter
+
+	def iter_content(self, chunkSize):
+		body = self.text.encode('utf-8')
+		for start in range(0, len(body), chunkSize):
+			if self.chunksRead == self.dropAfter:
+				raise requests.exceptions.ChunkedEncodingError('Connection broken: IncompleteRead')
+			self.chunksRead += 1
+			yield body[start:start + chunkSize]
+
+class StreamingSiteFetcher(FakeSiteFetcher):
+	'''A FakeSiteFetcher whose responses can be streamed, keeping them so tests can see how much was read.
+	The first drops responses lose their connection after a chunk.'''
+	def __init__(self, pages, drops=0, **settings):
+		FakeSiteFetcher.__init__(self, pages, **settings)
+		self.responses = []
+		self.drops = drops
+
+	def send(self, session, URL, headers=None, stream=False):
+		self.requested.append(URL)
+		dropAfter = 1 if len(self.responses) < self.drops else None
+		response = StreamedResponse(200, self.pages[URL], dropAfter) if URL in self.pages else StreamedResponse(404)
+		self.responses.append(response)
+		return response
+
+def longPages(ids):
+	'''Like sitePages, but with a long tail after the summary that streaming shouldn't need to read.'''
+	return dict((URL, page + u'<p>{0}</p>'.format(u'x' * 50000)) for URL, page in sitePages(ids).items())
+
+class StreamingTests(TemporaryFolderTest):
+	def testFetchUntilStopsOnceItHasWhatItNeeds(self):
+		fetcher = StreamingSiteFetcher(longPages([1]), memoryCache=websiteScraper.MemoryCache(maxBytes=10 ** 6))
+		page = fetcher.fetchUntil('http://example.com/page/1', lambda text: 'END' in text, chunkSize=1000)
+		self.assertTrue(page.startswith(u'<p>START1 summaryEND</p>'))
+		self.assertEqual(len(page), 1000)
+		self.assertEqual(fetcher.responses[0].chunksRead, 1)
+		self.assertEqual(fetcher.metrics.events['stopped early'], 1)
+		self.assertEqual(fetcher.memoryCache.pages.get('http://example.com/page/1'), None) # only whole pages are kept
+
+	def testFetchUntilReadsTheWholePageIfItNeedsTo(self):
+		pages = longPages([1])
+		fetcher = StreamingSiteFetcher(pages, memoryCache=websiteScraper.MemoryCache(maxBytes=10 ** 6))
+		page = fetcher.fetchUntil('http://example.com/page/1', lambda text: 'NEVER' in text, chunkSize=1000)
+		self.assertEqual(page, pages['http://example.com/page/1'])
+		self.assertEqual(fetcher.metrics.events['stopped early'], 0)
+		self.assertEqual(fetcher.memoryCache.pages.get('http://example.com/page/1'), page)
+
+	def testFetchUntilDecodesCharactersSplitBetweenChunks(self):
+		pages = {'http://example.com/page/1' : u'<p>START1 caf\xe9 \u2014 na\xefveEND</p>'}
+		fetcher = StreamingSiteFetcher(pages)
+		self.assertEqual(fetcher.fetchUntil('http://example.com/page/1', lambda text: False, chunkSize=1), pages['http://example.com/page/1'])
+
+	def testABodyThatDropsIsDownloadedAgain(self):
+		pages = longPages([1])
+		breakers = websiteScraper.HostCircuitBreakers(minimumRequests=1, errorRate=1.0) # never opens
+		fetcher = StreamingSiteFetcher(pages, drops=2, retryBackoff=0.0, circuitBreakers=breakers)
+		self.assertEqual(fetcher.fetchUntil('http://example.com/page/1', lambda text: False, chunkSize=1000), pages['http://example.com/page/1'])
+		self.assertEqual(len(fetcher.requested), 3)
+		self.assertEqual(fetcher.metrics.events['retry'], 2)
+		self.assertEqual(list(breakers.breakerFor('http://example.com/page/1').results), [False, False, True])
+
+	def testABodyThatKeepsDroppingRaisesAfterTheRetries(self):
+		breakers = websiteScraper.HostCircuitBreakers(minimumRequests=1, errorRate=1.0) # never opens
+		fetcher = StreamingSiteFetcher(longPages([1]), drops=10, maxRetries=2, retryBackoff=0.0, circuitBreakers=breakers)
+		self.assertRaises(requests.exceptions.ChunkedEncodingError, fetcher.fetchUntil, 'http://example.com/page/1', lambda text: False, 1000)
+		self.assertEqual(len(fetcher.requested), 3)
+		self.assertTrue(all(response.chunksRead == 1 for response in fetcher.responses))
+		self.assertEqual(list(breakers.breakerFor('http://example.com/page/1').results), [False, False, False])
+
+	def testStreamBodyScrapesTheSameAsReadingWholePages(self):
+		source = self.writeCSV('in.csv', [['ID'], ['1'], ['2'], ['3']])
+		pages = longPages([1, 2, 3])
+		for name, streamBody in (('whole.csv', False), ('streamed.csv', True)):
+			fetcher = StreamingSiteFetcher(pages)
+			websiteScraper.csvScrapeUpdateDict(csv_file=source, csv_file_destination=self.path(name), fetcher=fetcher,
+				streamBody=streamBody, matchMode='lazy', **scrapeSettings)
+		self.assertEqual(self.readCSV('streamed.csv'), self.readCSV('whole.csv'))
+		self.assertEqual([row[2] for row in self.readCSV('streamed.csv')[1:]], ['1 summary', '2 summary', '3 summary'])
+		self.assertTrue(all(response.chunksRead == 1 for response in fetcher.responses))
+
+	def testStreamBodyNeedsLazyMatching(self):
+		source = self.writeCSV('in.csv', [['ID'], ['1']])
+		with self.assertRaises(ValueError):
+			websiteScraper.csvScrapeUpdateDict(csv_file=source, csv_file_destination=self.path('out.csv'), 
+				fetcher=StreamingSiteFetcher(longPages([1])), streamBody=True, **scrapeSettings)
+
+class URLTemplateTests(TemporaryFolderTest):
+	def testCongressRulesCleanUpBillNumbers(self):
+		template = websiteScraper.congressCRSURLTemplate()
+		self.assertEqual(template.urlFor({'Bill number' : 'S. 12'}), ('https://beta.congress.gov/bill/113th-congress/senate-bill/12', None))
+		self.assertEqual(template.urlFor({'Bill number' : 'H.R.34'}), ('https://beta.congress.gov/bill/113th-congress/house-bill/34', None))
+		self.assertEqual(template.urlFor({'Bill number' : 'hr 7', 'congress' : '114th'}), ('https://beta.congress.gov/bill/114th-congress/house-bill/7', None))
+
+	def testCongressRulesLeaveNotes(self):
+		template = websiteScraper.congressCRSURLTemplate()
+		self.assertEqual(template.urlFor({'Bill number' : ''}), (None, 'Bill number needed to get CRS summary.'))
+		for billNumber in ('H.Res. 5', 'S.J.Res.3', 'hconres 9'):
+			self.assertEqual(template.urlFor({'Bill number' : billNumber}), (None, 'Code pending for resolutions.'))
+		row = template.apply({'Bill number' : 'sres 2'})
+		self.assertEqual(row, {'Bill number' : 'sres 2', 'CRS Summary' : 'Code pending for resolutions.'})
+
+	def testTemplatesFillInColumnsDefaultsAndSteps(self):
+		template = websiteScraper.URLTemplate('http://example.com/{kind}/{Name}?x={{1}}', 
+			normalizers={'Name' : ['strip', 'lower', ['replace', ' ', '-'], 'quote']}, defaults={'kind' : 'people'})
+		self.assertEqual(template.urlFor({'Name' : ' Ada Lovelace&Co '}), ('http://example.com/people/ada-lovelace%26co?x={1}', None))
+		self.assertEqual(template.urlFor({'Name' : 'x', 'kind' : 'cats'}), ('http://example.com/cats/x?x={1}', None))
+		self.assertEqual(template.urlFor({'Name' : ''}), (None, None)) # a missing value means no URL
+		self.assertEqual(template.apply({'Name' : ''}), {'Name' : ''})
+
+	def testTheFirstMatchingRuleWins(self):
+		template = websiteScraper.URLTemplate('http://example.com/other/{ID}', rules=[
+			{'column' : 'ID', 'match' : r'^(?P<number>\d+)$', 'url' : 'http://example.com/number/{number}'},
+			{'column' : 'ID', 'match' : r'^\d', 'note' : 'never used'},
+			{'column' : 'ID', 'match' : r'^x', 'note' : 'no page for these'}], noteColumns=['Summary'])
+		self.assertEqual(template.urlFor({'ID' : '42'}), ('http://example.com/number/42', None))
+		self.assertEqual(template.urlFor({'ID' : '4b'}), (None, 'never used'))
+		self.assertEqual(template.urlFor({'ID' : 'x1'}), (None, 'no page for these'))
+		self.assertEqual(template.urlFor({'ID' : 'abc'}), ('http://example.com/other/abc', None))
+
+	def testPrefixesAreEscaped(self):
+		template = websiteScraper.prefixURLTemplate('ID', 'http://example.com/{odd}/', '.html')
+		self.assertEqual(template.urlFor({'ID' : '3'}), ('http://example.com/{odd}/3.html', None))
+
+	def testUnknownNormalizerStepsAreRejected(self):
+		with self.assertRaises(ValueError):
+			websiteScraper.URLTemplate('http://example.com/{ID}', normalizers={'ID' : ['shout']})
+
+	def testCongressJobsWriteNotesAndOnlyDownloadBills(self):
+		source = self.writeCSV('in.csv', [['Bill number'], ['S. 12'], [''], ['H.Res. 5']])
+		page = u'<p>STARTA bill summaryEND</p>'
+		fetcher = FakeSiteFetcher({'https://beta.congress.gov/bill/113th-congress/senate-bill/12' : page})
+		websiteScraper.csvScrapeUpdateDict(csv_file=source, csv_file_destination=self.path('out.csv'), fetcher=fetcher,
+			uniqueIDColumnName='Bill number', specialURLs='Congress CRS', newColumnName='CRS Summary', 
+			startQuote='START', endQuote='END', progress=False)
+		self.assertEqual(fetcher.requested, ['https://beta.congress.gov/bill/113th-congress/senate-bill/12'])
+		rows = self.readCSV('out.csv')
+		self.assertEqual(rows[1][-1], 'A bill summary')
+		self.assertEqual(rows[2][-1], 'Bill number needed to get CRS summary.')
+		self.assertEqual(rows[3][-1], 'Code pending for resolutions.')
+
+class RecordTests(TemporaryFolderTest):
+	def setUp(self):
+		TemporaryFolderTest.setUp(self)
+		self.index = websiteScraper.ColumnIndex(['a', 'b', 'c'])
+
+	def testARecordWorksLikeADictionary(self):
+		row = websiteScraper.Record(self.index, ['1', '2', '3'])
+		self.assertEqual((row['a'], row.get('c'), row.get('z'), row.get('z', 'none')), ('1', '3', None, 'none'))
+		self.assertTrue('b' in row)
+		self.assertFalse('z' in row)
+		self.assertRaises(KeyError, lambda: row['z'])
+		row['b'] = '20'
+		row['URL'] = 'http://example.com/1'
+		row.update({'Summary' : 'text', 'c' : '30'})
+		self.assertEqual(row.values, ['1', '20', '30']) # file columns are changed in place
+		self.assertEqual(row.extras, {'URL' : 'http://example.com/1', 'Summary' : 'text'})
+		self.assertEqual(row.keys()[:3], ['a', 'b', 'c'])
+		self.assertEqual(sorted(row.keys()[3:]), ['Summary', 'URL'])
+		self.assertEqual(dict(row.items()), {'a' : '1', 'b' : '20', 'c' : '30', 'URL' : 'http://example.com/1', 'Summary' : 'text'})
+		self.assertEqual(len(row), 5)
+		self.assertEqual(list(row), row.keys())
+
+	def testShortRowsDontHaveTheMissingColumns(self):
+		row = websiteScraper.Record(self.index, ['1'])
+		self.assertEqual(row.keys(), ['a'])
+		self.assertFalse('b' in row)
+		self.assertEqual(row.get('c'), None)
+		self.assertRaises(KeyError, lambda: row['c'])
+
+	def testColumnsSetOnAShortRowComeInTheFilesOrder(self):
+		row = websiteScraper.Record(self.index, ['1'])
+		row['URL'] = 'http://example.com/1'
+		row['c'] = '3'
+		self.assertEqual(row.keys(), ['a', 'c', 'URL'])
+		self.assertEqual(row.items(), [('a', '1'), ('c', '3'), ('URL', 'http://example.com/1')])
+		self.assertEqual(len(row), 3)
+		self.assertTrue('c' in row)
+		self.assertEqual(row['c'], '3')
+
+	def testRowsFromOneFileShareTheirColumnNames(self):
+		source = self.writeCSV('in.csv', [['a', 'b'], ['1', '2'], [], ['3', '4']])
+		reader = websiteScraper.RowReader(source)
+		self.assertEqual(reader.headers, ['a', 'b'])
+		rows = list(reader)
+		self.assertEqual([dict(row.items()) for row in rows], [{'a' : '1', 'b' : '2'}, {'a' : '3', 'b' : '4'}]) # blank lines are skipped
+		self.assertTrue(rows[0].index is rows[1].index)
+		self.assertEqual(websiteScraper.createCSVHeaderList(source), ['a', 'b'])
+
+	def testRecordsAreWrittenLikeDictionaries(self):
+		source = self.writeCSV('in.csv', [['a', 'b'], ['1', '2']])
+		rows = websiteScraper.createListFromCSV(source)
+		rows[0]['URL'] = 'http://example.com/1'
+		rows[0]['Summary'] = 'text'
+		websiteScraper.writeDictToCSV(rows, self.path('out.csv'), source, 'Summary')
+		self.assertEqual(self.readCSV('out.csv'), [['a', 'b', 'URL', 'Summary'], ['1', '2', 'http://example.com/1', 'text']])
+
+class SinkTests(TemporaryFolderTest):
+	def setUp(self):
+		TemporaryFolderTest.setUp(self)
+		self.source = self.writeCSV('in.csv', [['ID', 'Event Id'], ['1', 'a'], ['2', 'b'], ['3', 'c']])
+		self.pages = sitePages([1, 2, 3])
+		self.pages['http://example.com/page/2'] = u'<p>START2 line one\nline two \u2014 doneEND</p>'
+
+	def scrape(self, destination, **settings):
+		websiteScraper.csvScrapeUpdateDict(csv_file=self.source, csv_file_destination=self.path(destination), 
+			fetcher=FakeSiteFetcher(self.pages), **dict(scrapeSettings, **settings))
+
+	def readTable(self, name, table='scraped'):
+		connection = sqlite3.connect(self.path(name))
+		connection.text_factory = str
+		try:
+			cursor = connection.execute('SELECT * FROM "{0}"'.format(table))
+			return [column[0] for column in cursor.description], cursor.fetchall()
+		finally:
+			connection.close()
+
+	def testSQLiteGetsTheSameRowsAsACSVFile(self):
+		self.scrape('out.csv')
+		self.scrape('out.sqlite', outputBatchSize=2)
+		headers, rows = self.readTable('out.sqlite')
+		written = self.readCSV('out.csv')
+		self.assertEqual(headers, written[0])
+		self.assertEqual([list(row) for row in rows], written[1:])
+		self.assertEqual(rows[1][3], u'2 line one\nline two \u2014 done'.encode('utf-8'))
+
+	def testSQLiteIndexesTheUniqueID(self):
+		self.scrape('out.db', outputTable='bills')
+		connection = sqlite3.connect(self.path('out.db'))
+		try:
+			indexed = [row[2] for index in connection.execute('PRAGMA index_list("bills")') 
+				for row in connection.execute('PRAGMA index_info("{0}")'.format(index[1]))]
+		finally:
+			connection.close()
+		self.assertEqual(indexed, ['ID'])
+
+	def testSQLiteCanAddToATable(self):
+		self.scrape('out.sqlite')
+		self.scrape('out.sqlite', outputAppend=True, newColumnName='Details')
+		headers, rows = self.readTable('out.sqlite')
+		self.assertEqual(headers, ['ID', 'Event Id', 'URL', 'Summary', 'Details'])
+		self.assertEqual(len(rows), 6)
+		self.assertEqual((rows[0][3], rows[0][4]), ('1 summary', None))
+		self.assertEqual((rows[3][3], rows[3][4]), (None, '1 summary'))
+		self.scrape('out.sqlite')
+		self.assertEqual(len(self.readTable('out.sqlite')[1]), 3) # without outputAppend, the table is replaced
+
+	def testRowsWrittenBeforeAFailureAreKept(self):
+		sink = websiteScraper.SQLiteSink(self.path('out.sqlite'), ['ID', 'Summary'], batchSize=100)
+		def rows():
+			yield {'ID' : '1', 'Summary' : 'one'}
+			raise RuntimeError('the run died')
+		self.assertRaises(RuntimeError, websiteScraper.writeRowsToSink, rows(), sink)
+		self.assertEqual(self.readTable('out.sqlite')[1], [('1', 'one')])
+
+	@unittest.skipIf(websiteScraper.pyarrow is None, "pyarrow isn't installed")
+	def testParquetGetsTheSameRowsAsACSVFile(self):
+		self.scrape('out.csv')
+		self.scrape('out.parquet', outputBatchSize=2)
+		table = websiteScraper.pyarrow.parquet.read_table(self.path('out.parquet'))
+		written = self.readCSV('out.csv')
+		self.assertEqual(table.schema.names, written[0])
+		self.assertTrue(all(field.type == websiteScraper.pyarrow.string() for field in table.schema))
+		self.assertEqual(table.num_rows, 3)
+		self.assertEqual(table.column('Summary').to_pylist(), [value.decode('utf-8') for value in [row[3] for row in written[1:]]])
+		self.assertEqual(table.column('Summary').to_pylist()[1], u'2 line one\nline two \u2014 done')
+
+	@unittest.skipIf(websiteScraper.pyarrow is None, "pyarrow isn't installed")
+	def testParquetLeavesMissingColumnsEmpty(self):
+		websiteScraper.writeRowsToSink([{'ID' : '1', 'Summary' : 'one'}, {'ID' : '2'}], 
+			websiteScraper.ParquetSink(self.path('out.parquet'), ['ID', 'Summary']))
+		table = websiteScraper.pyarrow.parquet.read_table(self.path('out.parquet'))
+		self.assertEqual(table.column('Summary').to_pylist(), [u'one', None])
+
+	def testParquetFilesCantBeAddedTo(self):
+		with self.assertRaises(ValueError if websiteScraper.pyarrow is not None else ImportError):
+			websiteScraper.ParquetSink(self.path('out.parquet'), ['ID'], append=True)
+
+	def testUnknownFormatsAreRejected(self):
+		with self.assertRaises(ValueError):
+			websiteScraper.sinkFromKwargs({'outputFormat' : 'xlsx'}, self.path('out.xlsx'), ['ID'])
+
+class JobFileTests(TemporaryFolderTest):
+	def setUp(self):
+		TemporaryFolderTest.setUp(self)
+		self.savedMemoryCache = websiteScraper.sharedMemoryCache
+		websiteScraper.sharedMemoryCache = None
+		self.source = self.writeCSV('in.csv', [['ID'], ['1'], ['2']])
+
+	def tearDown(self):
+		websiteScraper.sharedMemoryCache = self.savedMemoryCache
+		TemporaryFolderTest.tearDown(self)
+
+	def writeJobs(self, name, spec):
+		with open(self.path(name), 'w') as jobFile:
+			jobFile.write(spec if isinstance(spec, str) else json.dumps(spec))
+		return self.path(name)
+
+	def goodJob(self, **settings):
+		job = dict(scrapeSettings, csv_file=self.source, csv_file_destination=self.path('out.csv'))
+		job.update(settings)
+		return job
+
+	def testJobFilesGetTheirDefaultsBasesAndDrivers(self):
+		jobs = websiteScraper.loadJobFile(self.writeJobs('jobs.json', {'defaults' : {'requestsPerSecond' : 1, 'concurrency' : 4},
+			'jobs' : [{'jobName' : 'FAA 2015', 'base' : 'FAA', 'concurrency' : 2}, 
+				{'csv_file' : 'a.csv', 'headers' : ['ID']}, {'urlColumnName' : 'Link'}, {'tsv_file' : 'a.tsv'}]}))
+		self.assertEqual([job['jobName'] for job in jobs], ['FAA 2015', 'jobs.json #2', 'jobs.json #3', 'jobs.json #4'])
+		self.assertEqual([job['driver'] for job in jobs], ['csv', 'csv', 'urlList', 'tsv'])
+		self.assertEqual([(job['requestsPerSecond'], job['concurrency']) for job in jobs], [(1, 2), (1, 4), (1, 4), (1, 4)])
+		self.assertEqual(jobs[0]['startQuote'], websiteScraper.FAAKwargsDict['startQuote'])
+		self.assertTrue(isinstance(jobs[1]['csv_file'], str)) # utf-8 strings, not unicode
+
+	def testAJobFileCanBeJustOneJob(self):
+		jobs = websiteScraper.loadJobFile(self.writeJobs('job.json', {'base' : 'OSHA'}))
+		self.assertEqual([(job['jobName'], job['driver']) for job in jobs], [('OSHA', 'csv')])
+
+	@unittest.skipIf(websiteScraper.yaml is None, "PyYAML isn't installed")
+	def testJobFilesCanBeYAML(self):
+		jobs = websiteScraper.loadJobFile(self.writeJobs('jobs.yaml', 'jobs:\n  - jobName: one\n    csv_file: a.csv\n'))
+		self.assertEqual([(job['jobName'], job['driver'], job['csv_file']) for job in jobs], [('one', 'csv', 'a.csv')])
+
+	def testBadJobFilesAreRejected(self):
+		self.assertRaises(ValueError, websiteScraper.loadJobFile, self.writeJobs('list.json', [['not', 'a', 'job']]))
+		self.assertRaises(ValueError, websiteScraper.loadJobFile, self.writeJobs('base.json', {'base' : 'NTSB 2'}))
+
+	def testAGoodJobHasNoProblems(self):
+		self.assertEqual(websiteScraper.checkJob(websiteScraper.jobFromSettings(self.goodJob())), [])
+
+	def testEveryProblemIsReportedAtOnce(self):
+		job = websiteScraper.jobFromSettings(self.goodJob(uniqueIDColumnName='Event Id', startQuote='(', concurency=4, outputFormat='xml'))
+		problems = websiteScraper.checkJob(job)
+		self.assertEqual(len(problems), 4)
+		self.assertEqual(problems[0], "unknown setting 'concurency'")
+		self.assertTrue(any(problem.startswith("the quotes aren't a valid regular expression") for problem in problems))
+		self.assertTrue("there's no 'Event Id' column in {0}".format(self.source) in problems)
+		self.assertTrue("unknown outputFormat 'xml'" in problems)
+
+	def testMissingFilesAndDriversAreProblems(self):
+		self.assertEqual(websiteScraper.checkJob(websiteScraper.jobFromSettings(self.goodJob(csv_file=self.path('gone.csv')))),
+			["the csv_file {0!r} doesn't exist".format(self.path('gone.csv'))])
+		self.assertEqual(websiteScraper.checkJob(websiteScraper.jobFromSettings(self.goodJob(driver='xls'))),
+			["unknown driver 'xls' (the options are csv, tsv, urlList)"])
+
+	def testRunJobsRunsEveryJobAndLeavesTheJobsAlone(self):
+		jobs = [websiteScraper.jobFromSettings(self.goodJob(csv_file_destination=self.path(name), 
+			fetcher=FakeSiteFetcher(sitePages([1, 2]))), name) for name in ('one', 'two', 'three')]
+		self.assertEqual(websiteScraper.runJobs(jobs, parallel=2), [('one', None), ('two', None), ('three', None)])
+		for name in ('one', 'two', 'three'):
+			self.assertEqual([row[2] for row in self.readCSV(name)[1:]], ['1 summary', '2 summary'])
+		self.assertTrue(all(job.get('rateLimiter') is None and job.get('session') is None for job in jobs))
+
+	def testTheCommandLineChecksBeforeRunning(self):
+		jobFile = self.writeJobs('jobs.json', [self.goodJob(jobName='good'), self.goodJob(jobName='bad', startQuote='(')])
+		returned, printed = quietly(websiteScraper.main, [jobFile, '--check'])
+		self.assertEqual(returned, 2)
+		self.assertTrue(printed.startswith("bad: the quotes aren't a valid regular expression"))
+		self.assertFalse(os.path.exists(self.path('out.csv')))
+		self.assertEqual(quietly(websiteScraper.main, [jobFile, '--check', '--job', 'good']), (0, "1 job(s) look ready to run.\n"))
+		self.assertEqual(quietly(websiteScraper.main, [jobFile, '--job', 'other'])[0], 2)
+		self.assertEqual(quietly(websiteScraper.main, [self.path('gone.json')])[0], 2)
+
+selectorPage = u'''<html><body><div id="main" class="report wide">
+<table width="99%"><tr><td class="blueTen">The <b>plane</b> hit a cart &amp; a truck.<td class="other">Other</table>
+<p class="note">First note<p class="note">Second note
+<a href="http://example.com/more">More</a>
+</div></body></html>'''
+
+class SelectorChecks(object):
+	'''Selector tests that have to give the same answers whichever parser is used (see the subclasses).'''
+	def setUp(self):
+		self.savedSelectorExtractors = dict(websiteScraper.selectorExtractors)
+		websiteScraper.selectorExtractors.clear() # these were compiled for the other parser
+
+	def tearDown(self):
+		websiteScraper.selectorExtractors.clear()
+		websiteScraper.selectorExtractors.update(self.savedSelectorExtractors)
+
+	def extract(self, selectors, output='html', page=selectorPage):
+		return websiteScraper.selectorExtractorFor(selectors, output).extract(websiteScraper.parseHTML(page))
+
+	def testSelectorsGiveTheInnerHTMLOrTheText(self):
+		self.assertEqual(self.extract('td.blueTen'), u'The <b>plane</b> hit a cart &amp; a truck.')
+		self.assertEqual(self.extract('td.blueTen', 'text'), u'The plane hit a cart & a truck.')
+
+	def testSimpleCSSWorks(self):
+		self.assertEqual(self.extract('#main > table td[class^=blue] b', 'text'), u'plane')
+		self.assertEqual(self.extract('div.wide table[width="99%"] td.other', 'text'), u'Other')
+		self.assertEqual(self.extract('div > p.note', 'text'), u'First note') # the next <p> closes the first one
+		self.assertEqual(self.extract('a[href$=more]', 'text'), u'More')
+		self.assertEqual(self.extract('body > td'), None)
+
+	def testTheFirstSelectorThatFindsSomethingWins(self):
+		self.assertEqual(self.extract(['td.missing', 'p.note', 'td.blueTen'], 'text'), u'First note')
+		self.assertEqual(self.extract(['td.missing', 'span']), None)
+		self.assertEqual(self.extract('td', page=u''), None)
+
+	def testJobsUseSelectorsWhenTheQuotesArentFound(self):
+		folder = tempfile.mkdtemp()
+		try:
+			source = os.path.join(folder, 'in.csv')
+			with open(source, 'w') as sourceFile:
+				sourceFile.write('ID\n1\n2\n')
+			pages = {'http://example.com/page/1' : selectorPage, 'http://example.com/page/2' : u'<p>START2 summaryEND</p><a>Two</a>'}
+			websiteScraper.csvScrapeUpdateDict(csv_file=source, csv_file_destination=os.path.join(folder, 'out.csv'),
+				fetcher=FakeSiteFetcher(pages), selectors=[('Summary', ['td.blueTen']), ('Link', 'a')], 
+				selectorOutput='text', **scrapeSettings)
+			with open(os.path.join(folder, 'out.csv')) as outFile:
+				rows = list(csv.reader(outFile))
+		finally:
+			shutil.rmtree(folder)
+		self.assertEqual(rows[0], ['ID', 'URL', 'Summary', 'Link'])
+		self.assertEqual(rows[1][2:], ['The plane hit a cart & a truck.', 'More'])
+		self.assertEqual(rows[2][2:], ['2 summary', 'Two'])
+
+@unittest.skipIf(websiteScraper.lxmlHTML is None, "lxml isn't installed")
+class LxmlSelectorTests(SelectorChecks, unittest.TestCase):
+	def testXPathWorks(self):
+		self.assertEqual(self.extract('//a/@href'), u'http://example.com/more')
+		self.assertEqual(self.extract('(//td)[2]', 'text'), u'Other')
+
+@unittest.skipIf(websiteScraper.lxmlHTML is None, "lxml isn't installed")
+class LxmlWithoutCSSSelectTests(SelectorChecks, unittest.TestCase):
+	'''lxml with the simple CSS turned into XPath by cssStepsToXPath, as when cssselect isn't installed.'''
+	def setUp(self):
+		SelectorChecks.setUp(self)
+		self.savedCSSSelect = websiteScraper.cssselect
+		websiteScraper.cssselect = None
+
+	def tearDown(self):
+		websiteScraper.cssselect = self.savedCSSSelect
+		SelectorChecks.tearDown(self)
+
+class HTMLTreeBuilderSelectorTests(SelectorChecks, unittest.TestCase):
+	'''Python's own HTMLParser, as when lxml isn't installed.'''
+	def setUp(self):
+		SelectorChecks.setUp(self)
+		self.savedLxmlHTML = websiteScraper.lxmlHTML
+		websiteScraper.lxmlHTML = None
+
+	def tearDown(self):
+		websiteScraper.lxmlHTML = self.savedLxmlHTML
+		SelectorChecks.tearDown(self)
+
+	def testXPathNeedsLxml(self):
+		self.assertRaises(ValueError, websiteScraper.SelectorExtractor, '//a/@href')
+
+	def testEndTagsCloseWhatsLeftOpen(self):
+		self.assertEqual(self.extract('div', page=u'<div><span>a<i>b</div>c'), u'<span>a<i>b')
+		self.assertEqual(self.extract('li', 'text', page=u'<ul><li>one<li>two</ul>'), u'one')
+
+class ParseCSSTests(unittest.TestCase):
+	def testSelectorsAreSplitIntoSteps(self):
+		self.assertEqual(websiteScraper.parseCSS('div#main > td.blueTen[width="99%"] b'), [
+			(None, u'div', [('id', '=', u'main')]),
+			('>', u'td', [('class', '~=', u'blueTen'), (u'width', u'=', u'99%')]),
+			(' ', u'b', [])])
+		self.assertEqual(websiteScraper.parseCSS('.note[title]'), [(None, u'*', [('class', '~=', u'note'), (u'title', None, None)])])
+
+	def testSelectorsItCantReadAreRejected(self):
+		for selector in ('td:first-child', 'div >', '> td', 'td.a b.c + i', ''):
+			self.assertRaises(ValueError, websiteScraper.parseCSS, selector)
+
+class ProbeTests(TemporaryFolderTest):
+	def probe(self, rows, pages, sampleSize=None, **settings):
+		job = websiteScraper.jobFromSettings(dict(scrapeSettings, csv_file=self.writeCSV('in.csv', rows), 
+			csv_file_destination=self.path('out.csv'), fetcher=FakeSiteFetcher(pages), **settings))
+		self.fetcher = job['fetcher']
+		return websiteScraper.probeJob(job, sampleSize)
+
+	def testAGoodJobLooksGoodWithoutWritingAnything(self):
+		report = self.probe([['ID', 'Name']] + [[str(number), 'x'] for number in range(1, 31)] + [['3', 'again']], sitePages(range(1, 31)))
+		self.assertEqual((report['problems'], report['rows'], report['uniqueURLs'], report['notes']), ([], 31, 30, 0))
+		self.assertEqual((report['rowProblems'], report['sampled'], report['downloadErrors']), ({}, 20, []))
+		self.assertEqual(report['matches'], {'Summary' : 20})
+		self.assertTrue(report['ok'])
+		self.assertEqual(len(set(self.fetcher.requested)), 20)
+		self.assertTrue(report['estimatedSeconds'] >= 30 / 2.0) # no faster than requestsPerSecond allows
+		self.assertFalse(os.path.exists(self.path('out.csv')))
+
+	def testTheSampleIsTheSameEveryTime(self):
+		rows = [['ID']] + [[str(number)] for number in range(1, 101)]
+		self.probe(rows, sitePages(range(1, 101)), 10)
+		first = sorted(self.fetcher.requested)
+		self.probe(rows, sitePages(range(1, 101)), 10)
+		self.assertEqual(sorted(self.fetcher.requested), first)
+		self.assertNotEqual(first, ['http://example.com/page/{0}'.format(number) for number in range(1, 11)]) # from the whole file
+
+	def testRowsThatWontWorkAreCounted(self):
+		report = self.probe([['ID', 'Name'], ['1', 'a'], ['', 'b'], ['3'], ['', 'd']], sitePages([1, 3]))
+		self.assertEqual(report['rowProblems'], {'no unique ID' : (2, [3, 5]), 'no URL' : (2, [3, 5]), 
+			'the wrong number of columns' : (1, [4])})
+		self.assertFalse(report['ok'])
+		report = self.probe([['ID'], ['1']], {}, urlFormulaPrefix='example.com/page/')
+		self.assertEqual(report['rowProblems'], {"a URL that isn't a web address" : (1, [2])})
+
+	def testRowsWithNotesArentProblems(self):
+		# the Congress CRS rules leave a note for a blank bill number, and the bill number is the unique ID
+		report = self.probe([['Bill number'], ['S. 12'], [''], ['H.Res. 5']], 
+			{'https://beta.congress.gov/bill/113th-congress/senate-bill/12' : u'<p>STARTA bill summaryEND</p>'},
+			uniqueIDColumnName='Bill number', specialURLs='Congress CRS')
+		self.assertEqual((report['rowProblems'], report['notes'], report['uniqueURLs'], report['matches']), ({}, 2, 1, {'Summary' : 1}))
+		self.assertTrue(report['ok'])
+
+	def testPagesWhereTheQuotesArentFoundCount(self):
+		pages = sitePages(range(1, 11))
+		pages['http://example.com/page/4'] = u'<p>moved</p>'
+		report = self.probe([['ID']] + [[str(number)] for number in range(1, 11)], pages)
+		self.assertEqual(report['matches'], {'Summary' : 9})
+		self.assertTrue(report['ok'])
+		self.assertFalse(self.probe([['ID']] + [[str(number)] for number in range(1, 11)], pages, probeMinMatchRate=0.95)['ok'])
+
+	def testDownloadErrorsAreReported(self):
+		report = self.probe([['ID'], ['1'], ['2']], sitePages([1]))
+		self.assertEqual([(URL, type(error)) for URL, error in report['downloadErrors']], 
+			[('http://example.com/page/2', websiteScraper.FetchError)])
+		self.assertEqual(report['matches'], {'Summary' : 1})
+
+	def testAJobWithProblemsIsntProbed(self):
+		report = self.probe([['ID'], ['1']], sitePages([1]), startQuote='(')
+		self.assertEqual(len(report['problems']), 1)
+		self.assertFalse(report['ok'])
+		self.assertEqual(self.fetcher.requested, [])
+
+class ReextractTests(TemporaryFolderTest):
+	def setUp(self):
+		TemporaryFolderTest.setUp(self)
+		self.archiveDir = self.path('archive')
+		self.pages = dict((URL, page + u'<i>Type {0}</i>'.format(URL[-1])) for URL, page in sitePages(range(1, 8)).items())
+
+	def scrape(self, rows, **settings):
+		source = self.writeCSV('in.csv', [['ID', 'Page']] + rows)
+		websiteScraper.csvScrapeUpdateDict(csv_file=source, csv_file_destination=self.path('out.csv'), fetcher=FakeSiteFetcher(self.pages),
+			archiveDir=self.archiveDir, **dict(scrapeSettings, uniqueIDColumnName='ID', urlTemplate='http://example.com/page/{Page}', **settings))
+
+	def reextract(self, destination='again.csv', **settings):
+		job = dict(scrapeSettings, uniqueIDColumnName='ID', newColumnName='Type', startQuote='<i>Type ', endQuote='</i>')
+		job.update(settings)
+		return websiteScraper.reextractArchive(self.archiveDir, job, self.path(destination), processes=2, readBytes=200)
+
+	def testNewQuotesRunOverTheArchivedPages(self):
+		self.scrape([[str(ID), str(ID)] for ID in range(1, 8)] + [['8', '3']])
+		self.pages.clear() # nothing can be downloaded now
+		self.assertEqual(self.reextract(), 8)
+		rows = self.readCSV('again.csv')
+		self.assertEqual(rows[0], ['ID', 'URL', 'Type'])
+		self.assertEqual(sorted(rows[1:], key=lambda row: int(row[0])), 
+			[[str(ID), 'http://example.com/page/{0}'.format(page), str(page)] for ID, page in zip(range(1, 9), range(1, 8) + [3])])
+
+	def testTheSameQuotesGiveWhatTheRunScraped(self):
+		self.scrape([[str(ID), str(ID)] for ID in range(1, 8)])
+		self.reextract(newColumnName='Summary', startQuote='START', endQuote='END')
+		scraped = dict((row[0], row[3]) for row in self.readCSV('out.csv')[1:])
+		self.assertEqual(dict((row[0], row[2]) for row in self.readCSV('again.csv')[1:]), scraped)
+
+	def testTheLatestPageOfEachIDIsUsed(self):
+		self.scrape([['1', '1'], ['2', '2']])
+		self.scrape([['2', '5']])
+		self.reextract()
+		self.assertEqual(sorted(self.readCSV('again.csv')[1:]), [['1', 'http://example.com/page/1', '1'], ['2', 'http://example.com/page/5', '5']])
+
+	def testCongressCRSSummariesAreCleanedUp(self):
+		self.pages['http://example.com/page/1'] = u'<div>START<p>A bill</p> END</div>'
+		self.scrape([['1', '1']])
+		self.reextract(specialURLs='Congress CRS', startQuote='<div>START', endQuote='END</div>')
+		self.assertEqual(self.readCSV('again.csv')[1][2], 'A bill')
+
+	def testTheRowsCanGoToSQLite(self):
+		self.scrape([['1', '1'], ['2', '2']])
+		self.assertEqual(self.reextract('again.sqlite'), 2)
+		connection = sqlite3.connect(self.path('again.sqlite'))
+		try:
+			self.assertEqual(sorted(connection.execute('SELECT ID, Type FROM scraped')), [(u'1', u'1'), (u'2', u'2')])
+		finally:
+			connection.close()
+
+	def testThereHasToBeAnArchive(self):
+		self.assertRaises(IOError, self.reextract)
+
+if __name__ == '__main__':
+	unittest.main()
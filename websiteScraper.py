@@ -1,112 +1,860 @@
 
 import requests # Requests interacts with the web and pulls data from websites.
+from requests.adapters import HTTPAdapter # HTTPAdapter controls how many connections to each host are kept open
+from requests.packages.urllib3.connection import HTTPConnection, HTTPSConnection # these open the connections, and
+from requests.packages.urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool # are timed as they connect
 import time # Time allows you to delay your requests so that you don't bombard the other person's server
 import csv # CSV is a module that helps with file handling
 import re # re stands for "regular expressions" and it allows you to recognize a pattern and pull information from it
+import sys # sys lets a worker thread hand its error (with the traceback) back to the main thread
+import threading # threading lets several requests be in flight at once
+import Queue # Queue hands rows out to the worker threads safely
+import urlparse # urlparse pulls the host name out of a URL so each site gets its own rate limit
+import sqlite3 # sqlite3 keeps the checkpoint file, so a run that dies can pick up where it left off
+import os # os handles the folders and files of the page cache
+import hashlib # hashlib names each cached page after a fingerprint of its contents
+import zlib # zlib compresses cached pages so they take up less disk space
+import json # json turns the scraped columns into text for the checkpoint file
+import multiprocessing # multiprocessing lets the regular expression work run on every core
+import collections # collections.deque keeps track of the pages that are out at the extraction processes
+import heapq # heapq merges the partial files from a sharded run back into one, in order
+import random # random adds jitter to retry waits so retries from different threads don't line up
+import email.utils # email.utils reads the dates that servers sometimes put in Retry-After
+import codecs # codecs decodes a page a chunk at a time while it's still downloading
+import urllib # urllib escapes values that go into URLs
+import HTMLParser # HTMLParser reads pages for selectors when lxml isn't installed
+import cgi # cgi.escape puts the text lxml hands back into HTML again
+import argparse # argparse reads the job files and options from the command line
+import mmap # mmap lets the reading processes share a huge input file without copying it
+import cStringIO # cStringIO hands one chunk of a memory-mapped file to csv
+import uuid # uuid gives each archived page a WARC record ID
+import base64 # base64 writes the archived pages' fingerprints the way WARC files do
+try:
+	import pyarrow, pyarrow.parquet # pyarrow writes Parquet files (it's only needed for outputFormat 'parquet')
+except ImportError:
+	pyarrow = None
+try:
+	import lxml.html as lxmlHTML, lxml.etree as lxmlEtree # lxml parses pages for selectors quickly, if it's installed
+except ImportError:
+	lxmlHTML = lxmlEtree = None
+try:
+	import cssselect # cssselect lets lxml understand any CSS selector
+except ImportError:
+	cssselect = None
+try:
+	import yaml # PyYAML reads YAML job files (JSON job files don't need it)
+except ImportError:
+	yaml = None
 
 # Here I'm defining a function to import the file as a list of dictionaries. 
 # That will keep the original order of the rows in the file, but also allow me to pull 
 # information from a given column. I created a method using tab-delineated text file first
 # because the first file I was working with had a lot of internal commas, and NTSB used '|' to delineate fields.
 # But CSV is more conventional, so I'm in the process of building that in. 
+#
+# A row used to be a whole dictionary, with its own copy of every column name. Now each row is a 
+# Record: just the list of values csv hands back, plus a ColumnIndex (column name -> position) that all
+# of the rows from the same file share. A Record can be used like a dictionary (get, [], update, in, 
+# keys, items); columns that aren't in the file, like URL and the new columns, go in a small dictionary
+# of extras. RowReader gets the headers and the rows in one pass over the file.
 
+class ColumnIndex(dict):
+	'''Column name -> position for the rows of one file, plus the column names in order (headers).'''
+	def __init__(self, headers):
+		dict.__init__(self, ((column, position) for position, column in enumerate(headers)))
+		self.headers = list(headers)
+
+class Record(object):
+	'''One row of a file: its values, the file's shared ColumnIndex and any extra columns set on it.'''
+	__slots__ = ('index', 'values', 'extras')
+
+	def __init__(self, index, values):
+		self.index = index
+		self.values = values
+		self.extras = None
+
+	def get(self, column, default=None):
+		position = self.index.get(column)
+		if position is not None and position < len(self.values):
+			return self.values[position]
+		if self.extras is not None:
+			return self.extras.get(column, default)
+		return default
+
+	def __getitem__(self, column):
+		if column not in self:
+			raise KeyError(column)
+		return self.get(column)
+
+	def __setitem__(self, column, value):
+		position = self.index.get(column)
+		if position is not None and position < len(self.values):
+			self.values[position] = value
+		else:
+			if self.extras is None:
+				self.extras = {}
+			self.extras[column] = value
+
+	def __contains__(self, column):
+		position = self.index.get(column)
+		return (position is not None and position < len(self.values)) or (self.extras is not None and column in self.extras)
+
+	def keys(self):
+		columns = self.index.headers[:len(self.values)]
+		if self.extras is not None:
+			# a short row keeps the file's missing columns in extras when they're set, but they still
+			# come in the file's order, before the columns that aren't in the file
+			columns.extend(column for column in self.index.headers[len(self.values):] if column in self.extras)
+			columns.extend(column for column in self.extras if column not in self.index)
+		return columns
+
+	def __iter__(self):
+		return iter(self.keys())
+
+	def __len__(self):
+		return len(self.keys())
+
+	def items(self):
+		return [(column, self.get(column)) for column in self.keys()]
+
+	def update(self, other):
+		for column, value in other.items():
+			self[column] = value
+
+	def __repr__(self):
+		return 'Record({0!r})'.format(dict(self.items()))
+
+class RowReader(object):
+	'''Reads a delimited file in one pass. headers (the first line) is read as soon as the file is
+	opened; iterating over the reader gives the rest of the rows as Records, and closes the file at the end.'''
+	def __init__(self, fileName, myDelimiter=','):
+		self.file = open(fileName, "rU")
+		self.reader = csv.reader(self.file, delimiter=myDelimiter)
+		self.headers = next(self.reader, [])
+		self.index = ColumnIndex(self.headers)
+
+	def __iter__(self):
+		try:
+			for values in self.reader:
+				if values: # csv.DictReader skipped blank lines too
+					yield Record(self.index, values)
+		finally:
+			self.file.close()
+
+	def close(self):
+		self.file.close()
 
 def createListFromTSV(tsvFile):
-	'''This function takes a tab-delineated file (tsvFile) and returns a list of dictionaries.'''
-	with open(tsvFile,"rU") as f:
-		fileReader = csv.DictReader(f,delimiter='\t')
-#		print type(fileReader)
-		fileList = []
-		for line in fileReader:
-			fileList.append(line)
-		return fileList
+	'''This function takes a tab-delineated file (tsvFile) and returns a list of rows (Records).'''
+	return list(iterRowsFromTSV(tsvFile))
 #		print fileList
 
 def createListFromCSV(csvFile,myDelimiter=','):
-	with open(csvFile, "rU") as f:
-		fileReader = csv.DictReader(f,delimiter=myDelimiter)
-		fileList = []
-		for line in fileReader:
-			fileList.append(line)
-		return fileList
+	return list(iterRowsFromCSV(csvFile, myDelimiter))
+
+# The list versions above hold the whole file in memory. The scraping functions use these instead,
+# which hand back one row at a time, so a huge file never has to fit in memory all at once.
+
+def iterRowsFromTSV(tsvFile):
+	'''This function reads a tab-delineated file (tsvFile) one row (Record) at a time.'''
+	return iterRowsFromCSV(tsvFile, '\t')
+
+def iterRowsFromCSV(csvFile,myDelimiter=','):
+	'''This function reads a csv file one row (Record) at a time.'''
+	return iter(RowReader(csvFile, myDelimiter))
 
 # Here I'm creating a list of headers (column names). This will allow me to put the columns
 # back in their original order. Also, I believe some of the DictWriter functions requires a headers list.
+# Only the first line is read (the whole file used to be read in and split up just to get it).
 
 def createHeaderList(tsvFile):
 	'''This function creates a list of headers from a tab-delineated file (tsvfile).'''
-	with open(tsvFile,"rU") as myFile:
-		lines = myFile.read().split("\n")
-		if lines <2:
-			lines = myFile.read().split("\r")
-		headers = lines[0].split("\t")
-		return headers
+	return createCSVHeaderList(tsvFile, '\t')
 
 def createCSVHeaderList(csvFile,myDelimiter=','):
-	with open(csvFile, "rU") as myFile:
-		lines = myFile.read().split("\n")
-		if lines <2:
-			lines = myFile.read().split("\r")
-		headers = lines[0].split(myDelimiter)
-		return headers
+	reader = RowReader(csvFile, myDelimiter)
+	reader.close()
+	return reader.headers
+
+def sourceHeaders(rows, sourceFile, myDelimiter=','):
+	'''The headers of the file rows came from: taken from the rows themselves if they're Records,
+	so the file doesn't have to be opened again.'''
+	if rows and isinstance(rows[0], Record):
+		return list(rows[0].index.headers)
+	return createCSVHeaderList(sourceFile, myDelimiter)
 
 # Here, I'm writing the list of dictionaries back to the file.
 
 def writeDictToTSV(myList, destFile, tsvFile, newColumnName):
-	'''This function writes a list of dictionaries to a tsvFile.'''
-	headers = createHeaderList(tsvFile)
+	'''This function writes a list of rows to a tsvFile.'''
+	headers = sourceHeaders(myList, tsvFile, '\t')
 	headers.append('URL')
 	headers.append(newColumnName)
 #	print headers
-	with open(destFile,"w") as outfile:
-		destination = csv.DictWriter(outfile,headers,delimiter='\t')
-		destination.writeheader()
-		for thing in myList:
-			destination.writerow(thing)
+	writeRowsToFile(myList, destFile, headers, '\t')
 
 def writeDictToCSV(myList, destFile, csvFile, newColumnName='',myDelimiter=','):
-	'''This function writes a list of dictionaries to a csvFile.'''
-	headers = createCSVHeaderList(csvFile)
+	'''This function writes a list of rows to a csvFile.'''
+	headers = sourceHeaders(myList, csvFile)
 	headers.append('URL')
 	headers.append(newColumnName)
-	with open(destFile, "w") as outfile:
-		destination = csv.DictWriter(outfile,headers)
-		destination.writeheader()
-		for thing in myList:
-			destination.writerow(thing)
+	writeRowsToFile(myList, destFile, headers)
+
+# This writes rows as they arrive instead of waiting for the whole list. Each finished row is flushed
+# to the file (or every flushEvery rows), so if the run dies partway through, the rows already
+# scraped are still in the destination file.
+
+def writeRowsToFile(rows, destFile, headers, myDelimiter=',', flushEvery=1, metrics=None):
+	'''Writes each row (a dictionary or Record) from rows (a list or a generator) to destFile, one column
+	per header, and returns how many rows were written. Columns that aren't in headers are left out.
+	If there's a RunMetrics, the writing is timed in it.'''
+	return writeRowsToSink(rows, DelimitedSink(destFile, headers, myDelimiter, flushEvery), metrics)
+
+# A CSV file isn't the only place the rows can go. The long narratives that get scraped (several KB of
+# text, with line breaks inside) make big CSV files slow to load again, so the rows can also go to a
+# SQLite database or a Parquet file, where the new columns can be queried and joined back to the
+# source data without parsing the whole file. Each of these is a "sink": it takes rows one at a time
+# with add() and writes them out in batches (outputBatchSize rows per transaction or Parquet row group).
+#   'outputFormat'    : 'csv', 'tsv', 'sqlite' or 'parquet' (by default it goes by the destination's 
+#                       extension: .sqlite, .sqlite3 and .db are SQLite, .parquet is Parquet, anything
+#                       else is the driver's usual CSV or tab-delineated file)
+#   'outputTable'     : the SQLite table the rows go in (default 'scraped'). The unique ID column is indexed.
+#   'outputAppend'    : True adds the rows to what's already in the destination instead of replacing it.
+#                       SQLite adds any new columns to the table. Parquet files can't be added to.
+#   'outputBatchSize' : how many rows are written at a time (for CSV files, flushEvery still works)
+# Every column is stored as text, the same as in the CSV file. A sink is closed even when the run dies,
+# so the rows that were already scraped are still written out.
+
+outputFormatsByExtension = {'.sqlite' : 'sqlite', '.sqlite3' : 'sqlite', '.db' : 'sqlite', '.parquet' : 'parquet'}
+
+def uniqueColumns(headers):
+	'''headers without repeats (SQLite ignores case in column names, so 'URL' and 'url' count as the same).'''
+	seen = set()
+	columns = []
+	for column in headers:
+		if column.lower() not in seen:
+			seen.add(column.lower())
+			columns.append(column)
+	return columns
+
+def quoteIdentifier(name):
+	'''Quotes a table or column name for SQLite, so names with spaces (like 'Event Id') work.'''
+	return '"' + name.replace('"', '""') + '"'
+
+class DelimitedSink(object):
+	'''Writes rows to a CSV (or tab-delineated) file, flushing every flushEvery rows.'''
+	def __init__(self, destFile, headers, myDelimiter=',', flushEvery=1, append=False):
+		self.headers = headers
+		self.flushEvery = flushEvery
+		self.count = 0
+		addHeaders = not (append and os.path.exists(destFile) and os.path.getsize(destFile) > 0)
+		self.outfile = open(destFile, "a" if append else "w")
+		self.destination = csv.writer(self.outfile, delimiter=myDelimiter)
+		if addHeaders:
+			self.destination.writerow(headers)
+
+	def add(self, row):
+		self.destination.writerow([row.get(column, '') for column in self.headers])
+		self.count += 1
+		if self.count % self.flushEvery == 0:
+			self.outfile.flush()
+
+	def close(self):
+		self.outfile.close()
+
+class SQLiteSink(object):
+	'''Writes rows to a table in a SQLite database, batchSize rows per transaction. The table has one
+	text column per header, and indexColumn (the unique ID) is indexed so the rows can be looked up
+	and joined by it.'''
+	def __init__(self, destFile, headers, table='scraped', indexColumn=None, batchSize=500, append=False):
+		self.columns = uniqueColumns(headers)
+		self.batchSize = batchSize
+		self.batch = []
+		self.connection = sqlite3.connect(destFile)
+		self.connection.text_factory = str # the rows are utf-8 encoded strings, like the checkpoint file
+		quotedTable = quoteIdentifier(table)
+		if not append:
+			self.connection.execute('DROP TABLE IF EXISTS ' + quotedTable)
+		existing = set(info[1].lower() for info in self.connection.execute('PRAGMA table_info(' + quotedTable + ')'))
+		if not existing:
+			self.connection.execute('CREATE TABLE ' + quotedTable + ' (' + 
+				', '.join(quoteIdentifier(column) + ' TEXT' for column in self.columns) + ')')
+		else:
+			for column in self.columns:
+				if column.lower() not in existing:
+					self.connection.execute('ALTER TABLE ' + quotedTable + ' ADD COLUMN ' + quoteIdentifier(column) + ' TEXT')
+		if indexColumn is not None and indexColumn.lower() in set(column.lower() for column in self.columns):
+			self.connection.execute('CREATE INDEX IF NOT EXISTS ' + quoteIdentifier(table + ' ' + indexColumn) + 
+				' ON ' + quotedTable + ' (' + quoteIdentifier(indexColumn) + ')')
+		self.connection.commit()
+		self.insert = ('INSERT INTO ' + quotedTable + ' (' + ', '.join(quoteIdentifier(column) for column in self.columns) + 
+			') VALUES (' + ', '.join('?' for column in self.columns) + ')')
+
+	def add(self, row):
+		self.batch.append(tuple(row.get(column) for column in self.columns))
+		if len(self.batch) >= self.batchSize:
+			self.flush()
+
+	def flush(self):
+		if self.batch:
+			self.connection.executemany(self.insert, self.batch)
+			self.connection.commit()
+			self.batch = []
+
+	def close(self):
+		try:
+			self.flush()
+		finally:
+			self.connection.close()
+
+class ParquetSink(object):
+	'''Writes rows to a Parquet file (needs pyarrow), one row group of batchSize rows at a time. Every 
+	column is a string column; a column a row doesn't have is left empty (null).'''
+	def __init__(self, destFile, headers, batchSize=10000, append=False):
+		if pyarrow is None:
+			raise ImportError("Writing Parquet files needs pyarrow (pip install pyarrow).")
+		if append:
+			raise ValueError("Parquet files can't be added to. Write to a new file, or use SQLite for outputAppend.")
+		self.columns = uniqueColumns(headers)
+		self.batchSize = batchSize
+		self.batch = [[] for column in self.columns]
+		self.schema = pyarrow.schema([pyarrow.field(textFor(column), pyarrow.string()) for column in self.columns])
+		self.writer = pyarrow.parquet.ParquetWriter(destFile, self.schema, compression='snappy')
+
+	def add(self, row):
+		for values, column in zip(self.batch, self.columns):
+			value = row.get(column)
+			values.append(None if value is None else textFor(value))
+		if len(self.batch[0]) >= self.batchSize:
+			self.flush()
+
+	def flush(self):
+		if self.batch and self.batch[0]:
+			arrays = [pyarrow.array(values, type=pyarrow.string()) for values in self.batch]
+			self.writer.write_table(pyarrow.Table.from_arrays(arrays, schema=self.schema))
+			self.batch = [[] for column in self.columns]
+
+	def close(self):
+		try:
+			self.flush()
+		finally:
+			self.writer.close()
+
+def textFor(value):
+	'''Turns a value from a row (usually a utf-8 encoded string) into unicode for pyarrow.'''
+	if isinstance(value, unicode):
+		return value
+	if not isinstance(value, str):
+		value = str(value)
+	return value.decode('utf-8', 'replace')
+
+def sinkFromKwargs(kwargs, destFile, headers, myDelimiter=','):
+	'''Opens the sink that kwargs asks for (see above) for writing headers to destFile. myDelimiter is
+	the delimiter the driver would use for a plain text file.'''
+	outputFormat = kwargs.get('outputFormat')
+	if outputFormat is None:
+		outputFormat = outputFormatsByExtension.get(os.path.splitext(destFile)[1].lower(), 
+			'tsv' if myDelimiter == '\t' else 'csv')
+	append = kwargs.get('outputAppend', False)
+	batchSize = kwargs.get('outputBatchSize')
+	if outputFormat == 'sqlite':
+		indexColumn = kwargs.get('uniqueIDColumnName') or kwargs.get('urlColumnName')
+		return SQLiteSink(destFile, headers, kwargs.get('outputTable', 'scraped'), indexColumn, batchSize or 500, append)
+	elif outputFormat == 'parquet':
+		return ParquetSink(destFile, headers, batchSize or 10000, append)
+	elif outputFormat in ('csv', 'tsv'):
+		if outputFormat == 'tsv':
+			myDelimiter = '\t'
+		elif myDelimiter == '\t':
+			myDelimiter = ','
+		return DelimitedSink(destFile, headers, myDelimiter, batchSize or kwargs.get('flushEvery', 1), append)
+	raise ValueError("I don't know the output format {0!r}. The options are 'csv', 'tsv', 'sqlite' and 'parquet'.".format(outputFormat))
+
+def writeRowsToSink(rows, sink, metrics=None):
+	'''Adds each row from rows (a list or a generator) to sink, closes the sink (even if something goes
+	wrong partway through) and returns how many rows were written. If there's a RunMetrics, the writing 
+	is timed in it.'''
+	count = 0
+	try:
+		for thing in rows:
+			start = time.time()
+			sink.add(thing)
+			count += 1
+			if metrics is not None:
+				metrics.addTime('write', time.time() - start)
+	finally:
+		start = time.time()
+		sink.close()
+		if metrics is not None:
+			metrics.addTime('write', time.time() - start)
+	return count
+
+# Some files are too big for one machine to get through overnight. A sharded run only scrapes part
+# of the file, so several machines can work on the same file at once. There are two ways to split it:
+#  'shard' : (k, n)                   - this machine is shard k of n (k goes from 1 to n); a row goes to 
+#                                       a shard based on a hash of its unique ID, so repeats stay together
+#  'shardByteRange' : (start, end)    - this machine takes the rows that start between those byte 
+#                                       offsets of the file (shardByteRanges() will work the offsets out).
+#                                       This doesn't read the whole file, but it splits on line breaks, so 
+#                                       don't use it on files with line breaks inside quoted fields.
+# Each machine writes its own partial file with an extra shardRowKey column, and mergeShards() puts 
+# the partial files back together into one file in the original row order. From the command line:
+#   python websiteScraper.py jobs.json --job NAME --merge merged.csv part1.csv part2.csv part3.csv
+
+shardRowKeyColumn = 'shardRowKey'
+
+def shardRowKey(rangeStart, index):
+	'''Makes a key that sorts the same way the rows were ordered in the original file.'''
+	return '{0:015d}:{1:010d}'.format(rangeStart, index)
+
+def shardByteRanges(fileName, n):
+	'''Splits fileName into n byte ranges of about the same size, for 'shardByteRange'.'''
+	size = os.path.getsize(fileName)
+	return [(size * k / n, size * (k + 1) / n) for k in range(n)]
+
+def iterRowsFromByteRange(fileName, myDelimiter, start, end):
+	'''Reads the rows (Records) that start at or after byte start and before byte end.'''
+	with open(fileName, 'rb') as f:
+		index = ColumnIndex(next(csv.reader([f.readline()], delimiter=myDelimiter)))
+		if start > f.tell():
+			f.seek(start - 1)
+			f.readline() # skip the rest of the row that started before our range
+		def lines():
+			while f.tell() < end:
+				line = f.readline()
+				if not line:
+					return
+				yield line
+		rows = (values for values in csv.reader(lines(), delimiter=myDelimiter) if values)
+		for rowNumber, values in enumerate(rows):
+			row = Record(index, values)
+			row[shardRowKeyColumn] = shardRowKey(start, rowNumber)
+			yield row
+
+def hashShardRows(rows, uniqueIDColumnName, k, n):
+	'''Keeps the rows whose unique ID hashes to shard k of n.'''
+	if not 1 <= k <= n:
+		raise ValueError("shard should be (k, n) with k from 1 to n, not ({0}, {1})".format(k, n))
+	for rowNumber, row in enumerate(rows):
+		if (zlib.crc32(str(row.get(uniqueIDColumnName))) & 0xffffffff) % n == k - 1:
+			row[shardRowKeyColumn] = shardRowKey(0, rowNumber)
+			yield row
+
+def readRowsForShard(fileName, myDelimiter, kwargs):
+	'''Returns (headers, rows) for fileName, where rows are the rows this run should scrape: all of 
+	them, or just this machine's shard if kwargs has 'shard' or 'shardByteRange'. The headers come from
+	the same pass over the file as the rows (a byte range reads the first line on its own). With 
+	parallelRead, the rows come from a ParallelRowReader, which may have already made their URLs.'''
+	if kwargs.get('shardByteRange') is not None:
+		start, end = kwargs['shardByteRange']
+		return createCSVHeaderList(fileName, myDelimiter), iterRowsFromByteRange(fileName, myDelimiter, start, end)
+	if kwargs.get('parallelRead') and kwargs.get('shard') is None:
+		chunkBytes = kwargs.get('parallelReadChunkBytes',4*1024*1024)
+		processes = readingProcesses(kwargs['parallelRead'], fileName, chunkBytes)
+		reader = ParallelRowReader(fileName, myDelimiter, processes, chunkBytes, kwargs, 
+			kwargs.get('parallelReadPool') if processes else None)
+		return reader.headers, reader # it may make the URLs too (see formulatesURLs)
+	reader = RowReader(fileName, myDelimiter)
+	if kwargs.get('shard') is not None:
+		k, n = kwargs['shard']
+		return reader.headers, hashShardRows(iter(reader), kwargs.get('uniqueIDColumnName'), k, n)
+	return reader.headers, iter(reader)
+
+def shardColumns(kwargs):
+	'''The extra columns a sharded run writes to its partial file.'''
+	if kwargs.get('shard') is not None or kwargs.get('shardByteRange') is not None:
+		return [shardRowKeyColumn]
+	return []
+
+def mergeShards(partialFiles, destFile, sourceFile, myDelimiter=',', partialDelimiter=','):
+	'''Puts the partial files from a sharded run back together into destFile, in the row order of
+	sourceFile (whose headers come first, followed by the URL and new columns). Use '\\t' as
+	partialDelimiter for partial files from scrapeUpdateDict. Returns how many rows were written.'''
+	if not partialFiles:
+		raise ValueError("There are no partial files to merge into {0}.".format(destFile))
+	openFiles = [open(partialFile, "rb") for partialFile in partialFiles]
+	try:
+		readers = [csv.DictReader(f, delimiter=partialDelimiter) for f in openFiles]
+		headers = createCSVHeaderList(sourceFile, myDelimiter)
+		for column in readers[0].fieldnames:
+			if column not in headers and column != shardRowKeyColumn:
+				headers.append(column)
+		def keyedRows(reader, readerNumber):
+			for row in reader:
+				yield row[shardRowKeyColumn], readerNumber, row
+		mergedRows = (row for key, readerNumber, row in heapq.merge(*[keyedRows(reader, number) for number, reader in enumerate(readers)]))
+		rowsWritten = 0
+		with open(destFile, "w") as outfile:
+			destination = csv.DictWriter(outfile, headers, delimiter=partialDelimiter, extrasaction='ignore')
+			destination.writeheader()
+			for row in mergedRows:
+				destination.writerow(row)
+				rowsWritten += 1
+		return rowsWritten
+	finally:
+		for f in openFiles:
+			f.close()
+
+def mergeJobShards(job, partialFiles, destFile):
+	'''mergeShards for the partial files from a sharded run of job (a kwargs dictionary with a driver, 
+	see jobFromSettings), with the job's source file and delimiters.'''
+	if job['driver'] == 'csv':
+		sourceFile, myDelimiter, partialDelimiter = job['csv_file'], job.get('myDelimiter',','), ','
+	elif job['driver'] == 'tsv':
+		sourceFile, myDelimiter, partialDelimiter = job['tsv_file'], '\t', '\t'
+	else:
+		raise ValueError("Only 'csv' and 'tsv' jobs can be sharded, so there's nothing to merge for a {0!r} job.".format(job['driver']))
+	destination = job.get('csv_file_destination' if job['driver'] == 'csv' else 'tsv_file_destination') or ''
+	outputFormat = job.get('outputFormat') or outputFormatsByExtension.get(os.path.splitext(destination)[1].lower())
+	if outputFormat in ('sqlite', 'parquet'):
+		raise ValueError("Only CSV and tab-delineated partial files can be merged, not {0} ones.".format(outputFormat))
+	if outputFormat is not None:
+		partialDelimiter = '\t' if outputFormat == 'tsv' else ','
+	return mergeShards(partialFiles, destFile, sourceFile, myDelimiter, partialDelimiter)
+
+# The NTSB and OSHA exports run to several GB. Rows are read one at a time as the run goes, but reading
+# them and making their URLs all happens on one core, and on a run that mostly reads from the cache (or
+# gets "not changed" answers) that's what the run waits on. With 'parallelRead' : True (or a number of
+# processes), the file is memory-mapped and cut into chunks of about parallelReadChunkBytes (4 MB by
+# default) that always end between two records. A line break only ends a record when there's an even
+# number of double quotes before it, so chunks don't split a quoted field with a line break in it (a
+# field that doesn't start with a quote but has one in the middle, like 5'6", would throw that off).
+# With more than one core (and parallelRead : True, or more than 1), reading processes work through
+# the chunks ahead of the run, parsing them and making the URLs, which is the slow part (the Congress 
+# CRS rules take about four times as long as parsing). Only the URLs come back: sending the parsed rows
+# between processes costs more than parsing the chunk again, so the rows themselves are parsed from 
+# the same memory-mapped chunk as they're handed out. The first rows are ready as soon as the first 
+# chunk is done, however big the file is. On one core the processes would only compete with the run
+# (400,000 rows took nearly twice as long as with the normal reader), and on a file of just a few 
+# chunks starting them costs more than they save, so then none are started: the chunks are parsed, 
+# and the URLs made, in the run's own process. runJobs starts one pool of reading processes for all 
+# of its jobs (parallelReadPool) before any job starts. Files with old Mac line endings (a carriage 
+# return on its own) need the normal reader.
+
+def recordChunks(mapped, start, chunkBytes, firstChunkBytes=None):
+	'''Yields (start, end) byte ranges of about chunkBytes from start to the end of mapped (a string or
+	mmap), each ending just after a line break that isn't inside a quoted field. If firstChunkBytes is 
+	smaller, the chunks start out that size and double until they get to chunkBytes.'''
+	size = len(mapped)
+	nextChunkBytes = min(chunkBytes, firstChunkBytes or chunkBytes)
+	while start < size:
+		end = min(size, start + nextChunkBytes)
+		nextChunkBytes = min(chunkBytes, nextChunkBytes * 2)
+		inQuotes = mapped[start:end].count('"') % 2 == 1
+		while end < size and (inQuotes or mapped[end - 1] != '\n'):
+			lineBreak = mapped.find('\n', end)
+			if lineBreak == -1:
+				end = size
+				break
+			if mapped[end:lineBreak].count('"') % 2 == 1:
+				inQuotes = not inQuotes
+			end = lineBreak + 1
+		yield start, end
+		start = end
+
+def parseChunk(mapped, start, end, myDelimiter=','):
+	'''The rows (lists of values) in bytes start to end of mapped, skipping blank lines like RowReader.'''
+	return (values for values in csv.reader(cStringIO.StringIO(mapped[start:end]), delimiter=myDelimiter) if values)
+
+urlSettingNames = ('urlTemplate', 'urlRules', 'urlNormalizers', 'urlDefaults', 'specialURLs', 'uniqueIDColumnName',
+	'urlFormulaPrefix', 'urlFormulaSuffix', 'extractors', 'newColumnName', 'startQuote', 'endQuote', 'selectors')
+chunkReaders = {} # reader key -> what a reading process needs for that reader's file, set up by chunkReaderFor
+
+def readingProcesses(parallelRead, fileName, chunkBytes):
+	'''How many reading processes a parallelRead (True, or a number of processes) run should start: 
+	none (0) unless there's more than one core and the file is at least a few chunks (see above).'''
+	cores = multiprocessing.cpu_count()
+	processes = cores if parallelRead is True else parallelRead
+	if processes < 2 or cores < 2 or os.path.getsize(fileName) < 4 * chunkBytes:
+		return 0
+	return processes
+
+def chunkReaderFor(readerKey, setup):
+	'''Runs in a reading process: returns what it needs to read chunks for one ParallelRowReader (setup
+	is its (fileName, myDelimiter, headers, urlSettings)), setting it up the first time.'''
+	if readerKey not in chunkReaders:
+		for reader in chunkReaders.values(): # only the latest reader's file is kept open
+			reader['mapped'].close()
+		chunkReaders.clear()
+		fileName, myDelimiter, headers, urlSettings = setup
+		with open(fileName, 'rb') as dataFile:
+			mapped = mmap.mmap(dataFile.fileno(), 0, access=mmap.ACCESS_READ)
+		chunkReaders[readerKey] = {'mapped' : mapped, 'delimiter' : myDelimiter, 'index' : ColumnIndex(headers),
+			'urlTemplate' : urlTemplateFromKwargs(urlSettings)}
+	return chunkReaders[readerKey]
+
+def urlsForChunk(task):
+	'''Runs in a reading process. task is (reader key, setup, byteRange), see chunkReaderFor. Returns
+	(a list with each row's URL or None, {row number : note}) for the rows in byteRange.'''
+	readerKey, setup, byteRange = task
+	chunkReader = chunkReaderFor(readerKey, setup)
+	URLs = []
+	notes = {}
+	urlTemplate, index = chunkReader['urlTemplate'], chunkReader['index']
+	for number, values in enumerate(parseChunk(chunkReader['mapped'], byteRange[0], byteRange[1], chunkReader['delimiter'])):
+		URL, note = urlTemplate.urlFor(Record(index, values))
+		URLs.append(URL)
+		if note is not None:
+			notes[number] = note
+	return URLs, notes
+
+class ParallelRowReader(object):
+	'''Reads a delimited file like RowReader does (headers right away, then Records), but in chunks,
+	with processes (by default, as many as readingProcesses says) making each row's URL from urlKwargs 
+	(see urlTemplateFromKwargs) ahead of the rows being handed out, in pool if one is given. 
+	formulatesURLs says whether it does; with no processes or no urlKwargs, the rows are just read 
+	from the memory-mapped file. The processes are started right away: forking once the run's threads
+	are going could copy a lock one of them holds into the new processes, where nothing would ever 
+	release it. So make the reader (or the pool) before the run starts, and close the reader if its 
+	rows aren't read to the end.'''
+	def __init__(self, fileName, myDelimiter=',', processes=None, chunkBytes=4*1024*1024, urlKwargs=None, pool=None):
+		self.fileName = fileName
+		self.myDelimiter = myDelimiter
+		if processes is None:
+			processes = readingProcesses(True, fileName, chunkBytes)
+		self.processes = processes
+		self.chunkBytes = chunkBytes
+		self.file = open(fileName, 'rb')
+		if os.fstat(self.file.fileno()).st_size > 0:
+			self.mapped = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+		else:
+			self.mapped = '' # an empty file can't be memory-mapped
+		self.dataStart = next(recordChunks(self.mapped, 0, 1), (0, 0))[1] # the headers are the first record
+		self.headers = next(parseChunk(self.mapped, 0, self.dataStart, myDelimiter), [])
+		self.index = ColumnIndex(self.headers)
+		self.urlTemplate = urlTemplateFromKwargs(urlKwargs) if urlKwargs is not None else None
+		self.formulatesURLs = self.urlTemplate is not None and (processes > 0 or pool is not None)
+		self.pool = None
+		self.ownsPool = False
+		if self.formulatesURLs:
+			urlSettings = dict((name, urlKwargs[name]) for name in urlSettingNames if name in urlKwargs)
+			self.setup = (fileName, myDelimiter, self.headers, urlSettings)
+			self.key = uuid.uuid4().hex
+			self.pool = pool
+			if pool is None:
+				self.pool = multiprocessing.Pool(processes)
+				self.ownsPool = True
+
+	def __iter__(self):
+		try:
+			chunks = recordChunks(self.mapped, self.dataStart, self.chunkBytes, 64*1024) # a small first chunk gets the run going sooner
+			if self.formulatesURLs:
+				chunks = processMapOrdered(urlsForChunk, ((byteRange, (self.key, self.setup, byteRange)) for byteRange in chunks), 
+					self.processes or 1, pool=self.pool)
+			else:
+				chunks = ((byteRange, None) for byteRange in chunks)
+			for (start, end), madeURLs in chunks:
+				for number, values in enumerate(parseChunk(self.mapped, start, end, self.myDelimiter)):
+					row = Record(self.index, values)
+					if madeURLs is not None:
+						self.urlTemplate.setURL(row, madeURLs[0][number], madeURLs[1].get(number))
+					yield row
+		finally:
+			self.close()
+
+	def close(self):
+		if self.pool is not None and self.ownsPool:
+			self.pool.terminate()
+		self.pool = None
+		if not isinstance(self.mapped, str):
+			self.mapped.close()
+		self.file.close()
+
+# URLs are made from templates: the URL with column names in braces, like
+#   'urlTemplate' : 'https://www.osha.gov/pls/imis/accidentsearch.accident_detail?id={Summary NR}'
+# ({{ and }} are plain braces). A template can use as many columns as it needs. Before a column's value
+# goes in, it can be cleaned up with a list of steps:
+#   'urlNormalizers' : {'Bill number' : ['lower', ['remove', '. ']]}
+# The steps are 'strip', 'lower', 'upper', 'quote' (escapes it for a URL), ['remove', characters] and
+# ['replace', old, new]. When one template doesn't fit every row, urlRules picks one for each row with
+# regular expressions. The first rule whose pattern matches the (cleaned up) column wins, and the 
+# pattern's named groups can go in its template. A rule can have a note instead of a URL; the note goes 
+# in the new column(s), and the row isn't downloaded:
+#   'urlRules' : [{'column' : 'Bill number', 'match' : '^$', 'note' : 'Bill number needed to get CRS summary.'},
+#                 {'column' : 'Bill number', 'match' : '^s(?P<number>\d+)$', 'url' : '.../senate-bill/{number}'}]
+# If no rule matches, urlTemplate (if there is one) is used. urlDefaults gives values for names in 
+# braces that aren't columns, like {congress} in the Congress CRS rules below. Templates, steps and 
+# patterns are all compiled once, before the first row; a row that's missing a value the template 
+# needs doesn't get a URL. The old urlFormulaPrefix + unique ID + urlFormulaSuffix still works.
+
+urlTemplateNamePattern = re.compile(r'\{\{|\}\}|\{([^{}]+)\}')
+
+def compileURLTemplate(template):
+	'''Splits a URL template into a list of (isName, text) pieces.'''
+	pieces = []
+	position = 0
+	for match in urlTemplateNamePattern.finditer(template):
+		pieces.append((False, template[position:match.start()]))
+		if match.group(1) is None:
+			pieces.append((False, match.group(0)[0])) # {{ or }}
+		else:
+			pieces.append((True, match.group(1)))
+		position = match.end()
+	pieces.append((False, template[position:]))
+	return [piece for piece in pieces if piece[0] or piece[1]]
+
+def escapeURLTemplate(text):
+	'''Makes text safe to put in a URL template as plain text.'''
+	return text.replace('{', '{{').replace('}', '}}')
+
+def removeCharacters(value, characters):
+	if isinstance(value, unicode):
+		return value.translate(dict((ord(character), None) for character in characters))
+	return value.translate(None, characters)
+
+def compileNormalizer(steps):
+	'''Turns a list of clean-up steps (see above) into one function.'''
+	functions = []
+	for step in steps:
+		if callable(step):
+			functions.append(step)
+		elif step == 'strip':
+			functions.append(lambda value: value.strip())
+		elif step == 'lower':
+			functions.append(lambda value: value.lower())
+		elif step == 'upper':
+			functions.append(lambda value: value.upper())
+		elif step == 'quote':
+			functions.append(lambda value: urllib.quote(value, safe=''))
+		elif step[0] == 'remove':
+			functions.append(lambda value, characters=step[1]: removeCharacters(value, characters))
+		elif step[0] == 'replace':
+			functions.append(lambda value, old=step[1], new=step[2]: value.replace(old, new))
+		else:
+			raise ValueError("Unknown URL normalizer step: {0!r}".format(step))
+	def normalize(value):
+		for function in functions:
+			value = function(value)
+		return value
+	return normalize
+
+class URLTemplate(object):
+	'''Makes each row's URL from template and/or rules (see above), putting it in urlColumnName. 
+	A rule's note goes in each of noteColumns.'''
+	def __init__(self, template=None, rules=(), normalizers=None, defaults=None, urlColumnName='URL', noteColumns=()):
+		self.template = compileURLTemplate(template) if template is not None else None
+		self.rules = []
+		for rule in rules:
+			pieces = compileURLTemplate(rule['url']) if rule.get('url') is not None else None
+			self.rules.append((rule['column'], re.compile(rule['match']), pieces, rule.get('note')))
+		self.normalizers = dict((column, compileNormalizer(steps)) for column, steps in (normalizers or {}).items())
+		self.defaults = defaults or {}
+		self.urlColumnName = urlColumnName
+		self.noteColumns = list(noteColumns)
+
+	def value(self, row, name):
+		value = row.get(name)
+		if value is None:
+			value = self.defaults.get(name)
+		if value is not None and name in self.normalizers:
+			value = self.normalizers[name](value)
+		return value
+
+	def fill(self, pieces, row, groups):
+		'''Fills in a compiled template, or returns None if one of its names has no value.'''
+		text = []
+		for isName, piece in pieces:
+			if isName:
+				piece = groups[piece] if piece in groups else self.value(row, piece)
+				if not piece:
+					return None
+			text.append(piece)
+		return ''.join(text)
+
+	def urlFor(self, row):
+		'''Returns (URL, note) for row. Either one (or both) can be None.'''
+		for column, pattern, pieces, note in self.rules:
+			match = pattern.search(self.value(row, column) or '')
+			if match is None:
+				continue
+			if note is not None:
+				return None, note
+			return self.fill(pieces, row, match.groupdict()), None
+		if self.template is not None:
+			return self.fill(self.template, row, {}), None
+		return None, None
+
+	def setURL(self, row, URL, note):
+		'''Puts what urlFor returned in row and returns it.'''
+		if note is not None:
+			for noteColumn in self.noteColumns:
+				row[noteColumn] = note
+		elif URL is not None:
+			row[self.urlColumnName] = URL
+		return row
+
+	def apply(self, row):
+		'''Adds the URL (or a note) to row and returns it.'''
+		URL, note = self.urlFor(row)
+		return self.setURL(row, URL, note)
+
+	def formulate(self, rows):
+		'''Adds the URLs to rows (a list or generator) one at a time as they're read.'''
+		for row in rows:
+			yield self.apply(row)
+
+def prefixURLTemplate(uniqueIDColumnName, urlFormulaPrefix, urlFormulaSuffix=''):
+	'''The URLTemplate for urlFormulaPrefix + the unique ID + urlFormulaSuffix.'''
+	return URLTemplate(escapeURLTemplate(urlFormulaPrefix) + '{' + uniqueIDColumnName + '}' + escapeURLTemplate(urlFormulaSuffix))
+
+# Congress bill numbers come written every which way ("S. 12", "H.R.34", "hres 5"), so they're cleaned
+# up to something like "s12" first. Resolutions (simple, joint and concurrent) don't have summaries 
+# the same way yet, so they get a note instead of a URL.
+
+def congressCRSURLRules(billNumberColumn='Bill number'):
+	return [{'column' : billNumberColumn, 'match' : r'^$', 'note' : 'Bill number needed to get CRS summary.'},
+		{'column' : billNumberColumn, 'match' : r'^[hs](j|con)?res', 'note' : 'Code pending for resolutions.'},
+		{'column' : billNumberColumn, 'match' : r'^s(?P<number>.+)$', 
+			'url' : 'https://beta.congress.gov/bill/{congress}-congress/senate-bill/{number}'},
+		{'column' : billNumberColumn, 'match' : r'^hr(?P<number>.+)$', 
+			'url' : 'https://beta.congress.gov/bill/{congress}-congress/house-bill/{number}'}]
+
+def congressCRSURLTemplate(billNumberColumn='Bill number', noteColumns=('CRS Summary',), defaults=None):
+	'''The URLTemplate for Congress CRS summary pages. The congress is the 113th unless defaults (or a
+	congress column) says otherwise.'''
+	return URLTemplate(rules=congressCRSURLRules(billNumberColumn), 
+		normalizers={billNumberColumn : ['lower', ['remove', '. ']]}, 
+		defaults=dict({'congress' : '113th'}, **(defaults or {})), noteColumns=noteColumns)
+
+def urlTemplateFromKwargs(kwargs):
+	'''Compiles the URLTemplate a scraping function should use: urlTemplate/urlRules (with urlNormalizers
+	and urlDefaults) if there are any, the Congress CRS rules if specialURLs is 'Congress CRS', or else 
+	urlFormulaPrefix + the unique ID + urlFormulaSuffix. Returns None for a specialURLs it doesn't know.'''
+	noteColumns = newColumnNamesFor(kwargs)
+	if kwargs.get('urlTemplate') is not None or kwargs.get('urlRules'):
+		return URLTemplate(kwargs.get('urlTemplate'), kwargs.get('urlRules',[]), kwargs.get('urlNormalizers'),
+			kwargs.get('urlDefaults'), 'URL', noteColumns)
+	if kwargs.get('specialURLs') == 'Congress CRS':
+		return congressCRSURLTemplate(kwargs.get('uniqueIDColumnName'), noteColumns, kwargs.get('urlDefaults'))
+	if kwargs.get('specialURLs') is not None:
+		return None
+	return prefixURLTemplate(kwargs.get('uniqueIDColumnName'), kwargs.get('urlFormulaPrefix',''), kwargs.get('urlFormulaSuffix',''))
 
 # This function pulls the unique identifiers out of your fileList and then creates URLs based
 # on a formula you specify.
 
 def formulateURLList(fileList, uniqueIDColumnName, urlFormulaPrefix, urlFormulaSuffix=''):
 	'''This creates a list of URLs based on a list of unique identifiers.'''
-	for entry in fileList: # fileList is a list of dicts
-		uniqueID = entry.get(uniqueIDColumnName)
-		URL = urlFormulaPrefix+uniqueID+urlFormulaSuffix
-		entry['URL'] = URL
+	for entry in formulateURLs(fileList, uniqueIDColumnName, urlFormulaPrefix, urlFormulaSuffix):
+		pass
 	return fileList
 
-def formulateBillURLList(file, billNumberColumn='Bill number',myDelimiter=','):
-	billFileList = createListFromCSV(file, myDelimiter)
-	for record in billFileList:
-		billNo = record.get('Bill number')
-		billNo = billNo.replace('.','')
-		billNo = billNo.replace(' ','')
-		billNo = billNo.lower()
-		print "Formatted bill number in line 99ish is: ",billNo
-		if billNo == '':
-			record['CRS Summary'] = 'Bill number needed to get CRS summary.'
-		elif billNo[1:3] == 'res':
-			record['CRS Summary'] = 'Code pending for resolutions.'
-		elif billNo[0] == 's':
-			record['URL'] = "https://beta.congress.gov/bill/113th-congress/senate-bill/{0}".format(billNo[1:])
-		elif billNo[:2] == 'hr':
-			record['URL'] = "https://beta.congress.gov/bill/113th-congress/house-bill/{0}".format(billNo[2:])
-		else:
-			print "Bill format not recognized. Please try again. (Line 106ish)"
-	return billFileList
-			
-	
+def formulateURLs(rows, uniqueIDColumnName, urlFormulaPrefix, urlFormulaSuffix=''):
+	'''Same as formulateURLList, but adds the URL to one row at a time as the rows are read.'''
+	return prefixURLTemplate(uniqueIDColumnName, urlFormulaPrefix, urlFormulaSuffix).formulate(rows)
+
+def formulateBillURLList(fileList, billNumberColumn='Bill number',myDelimiter=','):
+	'''Adds the Congress CRS URLs to rows that have already been read. (It still takes a file name too,
+	and reads the file, for older scripts.)'''
+	if isinstance(fileList, basestring):
+		fileList = createListFromCSV(fileList, myDelimiter)
+	for record in formulateBillURLs(fileList, billNumberColumn):
+		pass
+	return fileList
+
+def formulateBillURLs(rows, billNumberColumn='Bill number'):
+	'''Same as formulateBillURLList, but works on rows that have already been read (one at a time).'''
+	return congressCRSURLTemplate(billNumberColumn).formulate(rows)
 
 # This function scrapes the html/text between your startQuote and your endQuote.
 # It uses regular expressions, which is kind of finicky. Here's a regular expressions cheat sheet:
@@ -128,26 +876,2360 @@ def strToRegEx(string):
 	return string
 
 
-def scrape(URL, startQuote, endQuote):
+# Being polite to the other person's server used to mean sleeping half a second before every request.
+# That only works when requests go out one at a time, so instead each host gets a "token bucket": 
+# tokens drip in at requestsPerSecond and every request has to take one. Hosts don't slow each other down.
+
+class TokenBucket(object):
+	'''Allows rate requests per second on average, with bursts of up to capacity requests.'''
+	def __init__(self, rate, capacity=1):
+		self.rate = float(rate)
+		self.capacity = float(capacity)
+		self.tokens = float(capacity)
+		self.lastRefill = time.time()
+		self.lock = threading.Lock()
+
+	def acquire(self):
+		'''Blocks until a token is available and then takes it.'''
+		while True:
+			with self.lock:
+				now = time.time()
+				self.tokens = min(self.capacity, self.tokens + (now - self.lastRefill) * self.rate)
+				self.lastRefill = now
+				if self.tokens >= 1:
+					self.tokens -= 1
+					return
+				wait = (1 - self.tokens) / self.rate
+			time.sleep(wait)
+
+class HostRateLimiter(object):
+	'''Keeps one TokenBucket per host. The default of 2 requests per second matches the old 
+	time.sleep(0.5) for a single host.'''
+	def __init__(self, requestsPerSecond=2.0, burst=1):
+		self.requestsPerSecond = requestsPerSecond
+		self.burst = burst
+		self.buckets = {}
+		self.lock = threading.Lock()
+
+	def bucketFor(self, URL, requestsPerSecond=None):
+		host = urlparse.urlparse(URL).netloc
+		requestsPerSecond = requestsPerSecond or self.requestsPerSecond
+		with self.lock:
+			if host not in self.buckets:
+				self.buckets[host] = TokenBucket(requestsPerSecond, self.burst)
+			bucket = self.buckets[host]
+		if requestsPerSecond < bucket.rate:
+			with bucket.lock:
+				bucket.rate = min(bucket.rate, float(requestsPerSecond))
+		return bucket
+
+	def wait(self, URL, requestsPerSecond=None):
+		'''Blocks until the host of URL may be sent another request. When several jobs share the limiter,
+		each can pass its own requestsPerSecond, and a host goes at the slowest rate any of them asked for.'''
+		self.bucketFor(URL, requestsPerSecond).acquire()
+
+	def finished(self, URL, firstByteSeconds, outcome):
+		'''A fixed rate doesn't change with how requests go (see AdaptiveRateLimiter).'''
+		return None
+
+	def forJob(self, requestsPerSecond):
+		'''A rate limiter for one job that waits on these shared buckets at the job's requestsPerSecond.'''
+		return JobRateLimiter(self, requestsPerSecond)
+
+class JobRateLimiter(object):
+	def __init__(self, shared, requestsPerSecond):
+		self.shared = shared
+		self.requestsPerSecond = requestsPerSecond
+
+	def wait(self, URL):
+		self.shared.wait(URL, self.requestsPerSecond)
+
+	def finished(self, URL, firstByteSeconds, outcome):
+		return self.shared.finished(URL, firstByteSeconds, outcome)
+
+# Picking requestsPerSecond by hand means guessing: congress.gov could take far more than the old half 
+# second between requests, and the OSHA IMIS site falls over if it gets much more. With adaptive=True, 
+# each host gets its own controller instead, which works both the rate and the number of requests in 
+# flight up and down the way TCP does (AIMD: additive increase, multiplicative decrease):
+# - at first, every answer that comes back in good time doubles the rate and the in-flight limit about
+#   once a second ("slow start", so a fast host doesn't take minutes to get up to speed)
+# - when the server pushes back, both are multiplied by adaptiveDecrease (a half by default). Pushing 
+#   back means more than adaptiveErrorRate of the last 100 requests were throttled (429, 503 and the
+#   other "try again later" statuses), timed out or couldn't connect, or the time to first byte has 
+#   grown to more than latencyTolerance times what it usually is when the server isn't busy (the 
+#   fastest tenth of the recent times), which means the server is queueing requests. The error rate
+#   isn't judged until adaptiveMinRequests (20) requests have come back, so one 503 early on doesn't
+#   count as a high rate. After a decrease, there's a cool-down of a second (or one smoothed response 
+#   time, if that's longer) and another adaptiveMinRequests requests before the next one, so the same
+#   throttled requests don't slow the host down twice.
+# - after the first push back, each good answer only adds a little: the rate goes up by about 
+#   adaptiveIncrease requests per second every second, and the in-flight limit by about one for 
+#   each round of requests
+# The rate stays between minRequestsPerSecond and maxRequestsPerSecond (it starts at requestsPerSecond),
+# and the in-flight limit between minConcurrency and maxConcurrency (concurrency by default, since 
+# that's how many threads there are). Each job then settles near the most each host can keep up with.
+
+class AdaptiveHost(object):
+	'''The AIMD controller for one host: a TokenBucket whose rate it changes, and an in-flight limit.'''
+	def __init__(self, settings):
+		self.settings = settings
+		self.condition = threading.Condition()
+		self.bucket = TokenBucket(settings['startRate'])
+		self.limit = float(settings['startConcurrency'])
+		self.inFlight = 0
+		self.latencies = collections.deque(maxlen=100) # recent times to first byte
+		self.smoothedLatency = None
+		self.outcomes = collections.deque(maxlen=100) # recent answers: True if the server pushed back
+		self.lastDecrease = 0.0
+		self.sinceDecrease = 0 # answers since the last decrease
+		self.slowStart = True
+
+	def acquire(self):
+		'''Blocks until there's room for another request in flight and the rate allows it.'''
+		with self.condition:
+			while self.inFlight >= int(self.limit):
+				self.condition.wait(1.0) # a timeout keeps Ctrl-C working
+			self.inFlight += 1
+		self.bucket.acquire()
+
+	def release(self, firstByteSeconds, outcome):
+		'''Records how a request went and adjusts the rate and limit. outcome is 'ok' (with 
+		firstByteSeconds), 'throttled', 'timeout', 'connection error' or 'error' (anything else, which
+		doesn't change anything). Returns 'slowed down' if the host was slowed down, otherwise None.'''
+		settings = self.settings
+		with self.condition:
+			self.inFlight -= 1
+			self.condition.notify()
+			if outcome == 'error':
+				return None
+			pushedBack = outcome != 'ok'
+			self.outcomes.append(pushedBack)
+			self.sinceDecrease += 1
+			tooSlow = False
+			if not pushedBack and firstByteSeconds is not None:
+				self.latencies.append(firstByteSeconds)
+				if self.smoothedLatency is None:
+					self.smoothedLatency = firstByteSeconds
+				self.smoothedLatency = 0.8 * self.smoothedLatency + 0.2 * firstByteSeconds
+				if len(self.latencies) >= settings['minRequests']:
+					usual = sorted(self.latencies)[len(self.latencies) / 10]
+					tooSlow = self.smoothedLatency > settings['latencyTolerance'] * usual
+			errorRate = sum(self.outcomes) / float(len(self.outcomes))
+			tooManyErrors = pushedBack and len(self.outcomes) >= settings['minRequests'] and errorRate > settings['errorRate']
+			if tooManyErrors or tooSlow:
+				now = time.time()
+				if now - self.lastDecrease < max(1.0, self.smoothedLatency or 0.0) or self.sinceDecrease < settings['minRequests']:
+					return None
+				self.lastDecrease = now
+				self.sinceDecrease = 0
+				self.slowStart = False
+				self.latencies.clear() # the fastest time has to be found again at the new rate
+				self.limit = max(settings['minConcurrency'], self.limit * settings['decrease'])
+				self.setRate(max(settings['minRate'], self.bucket.rate * settings['decrease']))
+				return 'slowed down'
+			if pushedBack:
+				return None
+			if self.slowStart:
+				self.limit = min(settings['maxConcurrency'], self.limit + 1.0)
+				self.setRate(min(settings['maxRate'], self.bucket.rate + 1.0))
+			else:
+				self.limit = min(settings['maxConcurrency'], self.limit + 1.0 / self.limit)
+				self.setRate(min(settings['maxRate'], self.bucket.rate + settings['increase'] / self.bucket.rate))
+			return None
+
+	def setRate(self, rate):
+		with self.bucket.lock:
+			self.bucket.rate = rate
+
+class AdaptiveRateLimiter(object):
+	'''Keeps an AdaptiveHost for each host (see above). It's used just like a HostRateLimiter, but
+	PageFetcher also tells it how each request went (finished).'''
+	def __init__(self, requestsPerSecond=2.0, concurrency=1, minRequestsPerSecond=0.5, maxRequestsPerSecond=50.0,
+			minConcurrency=1, maxConcurrency=None, latencyTolerance=2.0, errorRate=0.05, increase=1.0, decrease=0.5,
+			minRequests=20):
+		maxConcurrency = maxConcurrency or max(concurrency, minConcurrency)
+		self.settings = {'startRate' : min(max(requestsPerSecond, minRequestsPerSecond), maxRequestsPerSecond),
+			'startConcurrency' : min(max(1, minConcurrency), maxConcurrency), 'minRate' : minRequestsPerSecond,
+			'maxRate' : maxRequestsPerSecond, 'minConcurrency' : minConcurrency, 'maxConcurrency' : maxConcurrency,
+			'latencyTolerance' : latencyTolerance, 'errorRate' : errorRate, 'increase' : increase, 'decrease' : decrease,
+			'minRequests' : minRequests}
+		self.hosts = {}
+		self.lock = threading.Lock()
+
+	def hostFor(self, URL):
+		host = urlparse.urlparse(URL).netloc
+		with self.lock:
+			if host not in self.hosts:
+				self.hosts[host] = AdaptiveHost(self.settings)
+			return self.hosts[host]
+
+	def wait(self, URL):
+		self.hostFor(URL).acquire()
+
+	def finished(self, URL, firstByteSeconds, outcome):
+		'''Called once for every wait, when the request is over (see AdaptiveHost.release).'''
+		return self.hostFor(URL).release(firstByteSeconds, outcome)
+
+	def state(self):
+		'''Returns {host : (requests per second, in-flight limit, smoothed time to first byte)}.'''
+		with self.lock:
+			hosts = dict(self.hosts)
+		return dict((host, (adaptive.bucket.rate, int(adaptive.limit), adaptive.smoothedLatency)) for host, adaptive in hosts.items())
+
+def rateLimiterFromKwargs(kwargs):
+	'''The rate limiter a job should use: kwargs['rateLimiter'] if it has one, an AdaptiveRateLimiter
+	if adaptive is True, and otherwise a HostRateLimiter at requestsPerSecond.'''
+	if kwargs.get('rateLimiter') is not None:
+		return kwargs['rateLimiter']
+	if not kwargs.get('adaptive',False):
+		return HostRateLimiter(kwargs.get('requestsPerSecond',2.0))
+	return AdaptiveRateLimiter(kwargs.get('requestsPerSecond',2.0), kwargs.get('concurrency',1), 
+		kwargs.get('minRequestsPerSecond',0.5), kwargs.get('maxRequestsPerSecond',50.0), kwargs.get('minConcurrency',1),
+		kwargs.get('maxConcurrency'), kwargs.get('latencyTolerance',2.0), kwargs.get('adaptiveErrorRate',0.05),
+		kwargs.get('adaptiveIncrease',1.0), kwargs.get('adaptiveDecrease',0.5), kwargs.get('adaptiveMinRequests',20))
+
+# Calling requests.get on its own opens a brand new connection (and does a new TLS handshake) for every
+# record, even though every record is on the same site. A Session keeps connections open and reuses them.
+# Everything in this module shares one session unless you hand it a different one. If you want to 
+# measure the difference, pass session=requests to get the old one-connection-per-record behavior.
+
+# To see how long connecting takes (the DNS lookup plus the TCP and TLS handshakes), the session's
+# connections time themselves as they connect. The time is added to connectTiming.seconds for the
+# thread that's making the request, which is where PageFetcher.get picks it up.
+
+connectTiming = threading.local()
+
+def addConnectTime(seconds):
+	connectTiming.seconds = getattr(connectTiming, 'seconds', 0.0) + seconds
+
+class TimedHTTPConnection(HTTPConnection):
+	def connect(self):
+		start = time.time()
+		try:
+			HTTPConnection.connect(self)
+		finally:
+			addConnectTime(time.time() - start)
+
+class TimedHTTPSConnection(HTTPSConnection):
+	def connect(self):
+		start = time.time()
+		try:
+			HTTPSConnection.connect(self)
+		finally:
+			addConnectTime(time.time() - start)
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+	ConnectionCls = TimedHTTPConnection
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+	ConnectionCls = TimedHTTPSConnection
+
+class TimedHTTPAdapter(HTTPAdapter):
+	'''An HTTPAdapter whose connections add the time they take to connect to connectTiming.'''
+	def init_poolmanager(self, *args, **kwargs):
+		HTTPAdapter.init_poolmanager(self, *args, **kwargs)
+		self.poolmanager.pool_classes_by_scheme = {'http' : TimedHTTPConnectionPool, 'https' : TimedHTTPSConnectionPool}
+
+def createSession(poolSize=10, compression=True):
+	'''Returns a requests.Session that keeps up to poolSize connections per host alive and reuses them.
+	If compression is True the server is asked to gzip pages; if False it is asked not to.'''
+	session = requests.Session()
+	adapter = TimedHTTPAdapter(pool_maxsize=poolSize)
+	session.mount('http://', adapter)
+	session.mount('https://', adapter)
+	session.headers['Connection'] = 'keep-alive'
+	if compression:
+		session.headers['Accept-Encoding'] = 'gzip, deflate'
+	else:
+		session.headers['Accept-Encoding'] = 'identity'
+	return session
+
+sharedSession = None
+sharedSessionLock = threading.Lock()
+
+def getSharedSession():
+	'''Returns the module's shared session, creating it the first time it's needed.'''
+	global sharedSession
+	with sharedSessionLock:
+		if sharedSession is None:
+			sharedSession = createSession()
+		return sharedSession
+
+def sessionFromKwargs(kwargs):
+	'''Picks the session a driver should use: the one in kwargs['session'] if there is one, the shared
+	session if nothing was configured, or a new session sized for kwargs['poolSize'] / kwargs['concurrency'].'''
+	if kwargs.get('session') is not None:
+		return kwargs['session']
+	if 'poolSize' not in kwargs and 'compression' not in kwargs and kwargs.get('concurrency',1) <= 10:
+		return getSharedSession()
+	poolSize = kwargs.get('poolSize', max(10, kwargs.get('concurrency',1)))
+	return createSession(poolSize, kwargs.get('compression', True))
+
+# This runs a function over a list with several worker threads so that N requests can be in flight
+# at the same time. The results come back in the same order as the list, so the output file
+# still matches the input file row for row. Only a small window of rows is read ahead of the
+# row that's being written, so memory depends on the number of workers and not on the file size.
+
+def imapOrdered(function, items, workers=1, window=None):
+	'''Calls function on every item (a list or generator) using up to workers threads and yields
+	the results in the order of items. At most window items (twice the workers by default) are
+	read ahead. If a call raises, the remaining items are abandoned and the error is re-raised.'''
+	if workers <= 1:
+		for item in items:
+			yield function(item)
+		return
+	if window is None:
+		window = workers * 2
+	todo = Queue.Queue()
+	done = Queue.Queue()
+	stop = object()
+	def worker():
+		while True:
+			job = todo.get()
+			if job is stop:
+				return
+			index, item = job
+			try:
+				done.put((index, True, function(item)))
+			except Exception:
+				done.put((index, False, sys.exc_info()))
+	threads = [threading.Thread(target=worker) for i in range(workers)]
+	for thread in threads:
+		thread.daemon = True
+		thread.start()
+	items = iter(items)
+	submitted = 0
+	nextIndex = 0
+	finished = {}
+	exhausted = False
+	try:
+		while True:
+			while not exhausted and submitted - nextIndex < window:
+				try:
+					item = next(items)
+				except StopIteration:
+					exhausted = True
+					break
+				todo.put((submitted, item))
+				submitted += 1
+			if nextIndex == submitted:
+				return
+			while nextIndex not in finished:
+				index, ok, result = done.get(True, 24*60*60) # a timeout keeps Ctrl-C working
+				finished[index] = (ok, result)
+			ok, result = finished.pop(nextIndex)
+			nextIndex += 1
+			if not ok:
+				errorType, error, traceback = result
+				raise errorType, error, traceback
+			yield result
+	finally:
+		try:
+			while True: # if we're stopping early, throw out the work that hasn't started yet
+				todo.get_nowait()
+		except Queue.Empty:
+			pass
+		for thread in threads:
+			todo.put(stop)
+		for thread in threads:
+			while thread.is_alive():
+				thread.join(0.1) # a bare join() would keep Ctrl-C from getting through
+
+def concurrentMap(function, items, workers=1):
+	'''Calls function on every item using up to workers threads and returns the results in the
+	order of items. If a call raises, the remaining items are abandoned and the error is re-raised.'''
+	return list(imapOrdered(function, items, workers))
+
+# When you're tweaking startQuote and endQuote, you end up downloading the same pages over and over.
+# The page cache saves every page it downloads (compressed) in a folder, so the next run can read it
+# from disk instead. Pages are stored under a fingerprint (sha1) of their contents, and a small SQLite 
+# index says which URL points to which page, when it was downloaded and when it was last used.
+# Old pages can be expired (cacheTTL, in seconds), the least recently used pages are thrown out once
+# the cache is bigger than cacheMaxBytes, and offline=True never touches the network at all.
+
+class OfflineCacheMiss(Exception):
+	'''Raised in offline mode when a page isn't in the cache.'''
+	pass
+
+class ResponseCache(object):
+	'''Keeps downloaded pages on disk in cacheDir.'''
+	def __init__(self, cacheDir, ttl=None, maxBytes=None, offline=False):
+		self.cacheDir = cacheDir
+		self.ttl = ttl
+		self.maxBytes = maxBytes
+		self.offline = offline
+		self.lock = threading.Lock()
+		if not os.path.isdir(os.path.join(cacheDir, 'pages')):
+			os.makedirs(os.path.join(cacheDir, 'pages'))
+		self.connection = sqlite3.connect(os.path.join(cacheDir, 'index.sqlite'), check_same_thread=False)
+		self.connection.execute('''CREATE TABLE IF NOT EXISTS pages (URL TEXT PRIMARY KEY, digest TEXT, 
+			size INTEGER, fetched REAL, lastUsed REAL)''')
+		self.connection.execute('CREATE INDEX IF NOT EXISTS pagesByLastUsed ON pages (lastUsed)')
+		self.connection.execute('CREATE INDEX IF NOT EXISTS pagesByDigest ON pages (digest)')
+		self.connection.commit()
+		self.currentBytes = self.connection.execute(
+			'SELECT COALESCE(SUM(size), 0) FROM (SELECT DISTINCT digest, size FROM pages)').fetchone()[0]
+
+	def pagePath(self, digest):
+		return os.path.join(self.cacheDir, 'pages', digest[:2], digest[2:] + '.z')
+
+	def get(self, URL):
+		'''Returns the cached page for URL (as unicode), or None if it isn't cached or has expired.
+		Expired pages are still returned in offline mode, since there's nowhere else to get them.'''
+		with self.lock:
+			row = self.connection.execute('SELECT digest, fetched FROM pages WHERE URL = ?', (URL,)).fetchone()
+			if row is None:
+				return None
+			digest, fetched = row
+			if self.ttl is not None and not self.offline and time.time() - fetched > self.ttl:
+				return None
+			try:
+				with open(self.pagePath(digest), 'rb') as pageFile:
+					page = zlib.decompress(pageFile.read()).decode('utf-8')
+			except (IOError, zlib.error):
+				return None # the page file went missing or got cut off, so treat it as not cached
+			self.connection.execute('UPDATE pages SET lastUsed = ? WHERE URL = ?', (time.time(), URL))
+			self.connection.commit()
+			return page
+
+	def put(self, URL, page):
+		'''Saves page (unicode) as the cached copy of URL, then evicts old pages if the cache is too big.'''
+		data = page.encode('utf-8')
+		digest = hashlib.sha1(data).hexdigest()
+		path = self.pagePath(digest)
+		with self.lock:
+			if not os.path.exists(path): # identical pages are only stored once
+				if not os.path.isdir(os.path.dirname(path)):
+					os.makedirs(os.path.dirname(path))
+				with open(path + '.tmp', 'wb') as pageFile:
+					pageFile.write(zlib.compress(data))
+				os.rename(path + '.tmp', path)
+				self.currentBytes += os.path.getsize(path)
+			oldRow = self.connection.execute('SELECT digest FROM pages WHERE URL = ?', (URL,)).fetchone()
+			now = time.time()
+			self.connection.execute('INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?)',
+				(URL, digest, os.path.getsize(path), now, now))
+			if oldRow is not None and oldRow[0] != digest:
+				self.removeIfUnused(oldRow[0])
+			if self.maxBytes is not None:
+				self.evict()
+			self.connection.commit()
+
+	def removeIfUnused(self, digest):
+		'''Deletes the page file for digest if no URL points to it anymore. Call with the lock held.'''
+		if self.connection.execute('SELECT 1 FROM pages WHERE digest = ?', (digest,)).fetchone() is None:
+			path = self.pagePath(digest)
+			if os.path.exists(path):
+				self.currentBytes -= os.path.getsize(path)
+				os.remove(path)
+
+	def evict(self):
+		'''Throws out the least recently used pages until the cache fits in maxBytes. Call with the lock held.'''
+		while self.currentBytes > self.maxBytes:
+			oldest = self.connection.execute('SELECT URL, digest FROM pages ORDER BY lastUsed LIMIT 100').fetchall()
+			if oldest == []:
+				break
+			for URL, digest in oldest:
+				self.connection.execute('DELETE FROM pages WHERE URL = ?', (URL,))
+				self.removeIfUnused(digest)
+				if self.currentBytes <= self.maxBytes:
+					break
+
+def cacheFromKwargs(kwargs):
+	'''Opens the ResponseCache in kwargs['cacheDir'] (using cacheTTL, cacheMaxBytes and offline), 
+	or returns None if there's no cacheDir.'''
+	if kwargs.get('cacheDir') is None:
+		return None
+	return ResponseCache(kwargs['cacheDir'], kwargs.get('cacheTTL'), kwargs.get('cacheMaxBytes'), kwargs.get('offline',False))
+
+# The page cache still has to read and decompress a page from disk, and it only holds pages. Inside one
+# run (or one Python session where you call scrape() or the scraping functions over and over while
+# tweaking a job), the same URL and the same quotes come up again and again. The memory cache keeps
+# the most recently used pages, and separately what was scraped from them, in memory:
+#   'memoryCacheBytes'  : about how many bytes of pages to keep (off unless it's set)
+#   'memoryResultBytes' : about how many bytes of scraped results to keep (a quarter of memoryCacheBytes
+#                         by default). Results are keyed by the URL and the quotes/selectors/settings
+#                         that scraped them, so changing the quotes only reuses the page.
+# Pages and results are thrown out least recently used first once there are too many bytes of them.
+# Every scraping function (and every job in runJobs) that sets memoryCacheBytes uses the same memory
+# cache, so the second job over the same URLs, or a job run again with new quotes, doesn't download
+# anything. stats() says how many lookups were hits and misses, and how much was thrown out.
+
+def memorySize(value):
+	'''About how many bytes value (a string, or dictionaries, lists and tuples of them) takes up.'''
+	if isinstance(value, dict):
+		return sys.getsizeof(value) + sum(memorySize(key) + memorySize(item) for key, item in value.items())
+	if isinstance(value, (list, tuple)):
+		return sys.getsizeof(value) + sum(memorySize(item) for item in value)
+	return sys.getsizeof(value)
+
+class MemoryLRU(object):
+	'''A dictionary that holds about maxBytes (see memorySize) and throws out the least recently used
+	entries to stay under that. It's safe to use from several threads.'''
+	def __init__(self, maxBytes):
+		self.maxBytes = maxBytes
+		self.lock = threading.Lock()
+		self.entries = collections.OrderedDict() # key -> (value, size), least recently used first
+		self.currentBytes = 0
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+
+	def get(self, key):
+		'''Returns the value for key, or None if it isn't there.'''
+		with self.lock:
+			entry = self.entries.pop(key, None)
+			if entry is None:
+				self.misses += 1
+				return None
+			self.entries[key] = entry # it goes back to the most recently used end
+			self.hits += 1
+			return entry[0]
+
+	def put(self, key, value):
+		'''Keeps value for key, unless it's bigger than the whole budget.'''
+		size = memorySize(key) + memorySize(value)
+		with self.lock:
+			old = self.entries.pop(key, None)
+			if old is not None:
+				self.currentBytes -= old[1]
+			if size > self.maxBytes:
+				return
+			self.entries[key] = (value, size)
+			self.currentBytes += size
+			self.evict()
+
+	def resize(self, maxBytes):
+		with self.lock:
+			self.maxBytes = maxBytes
+			self.evict()
+
+	def evict(self):
+		'''Throws out the least recently used entries until they fit in maxBytes. Call with the lock held.'''
+		while self.currentBytes > self.maxBytes and self.entries:
+			key, (value, size) = self.entries.popitem(False)
+			self.currentBytes -= size
+			self.evictions += 1
+
+	def stats(self):
+		with self.lock:
+			return {'hits' : self.hits, 'misses' : self.misses, 'evictions' : self.evictions,
+				'entries' : len(self.entries), 'bytes' : self.currentBytes, 'maxBytes' : self.maxBytes}
+
+class MemoryCache(object):
+	'''Keeps pages (URL -> the page as unicode) and scraped results (see resultKey) in two separate
+	MemoryLRUs, so a few big pages can't push out the results, which are much smaller.'''
+	def __init__(self, maxBytes=64*1024*1024, resultBytes=None):
+		self.pages = MemoryLRU(maxBytes)
+		self.results = MemoryLRU(resultBytes if resultBytes is not None else maxBytes // 4)
+
+	def resize(self, maxBytes, resultBytes=None):
+		self.pages.resize(maxBytes)
+		self.results.resize(resultBytes if resultBytes is not None else maxBytes // 4)
+
+	def stats(self):
+		'''Returns {'pages' : MemoryLRU.stats(), 'results' : MemoryLRU.stats()}.'''
+		return {'pages' : self.pages.stats(), 'results' : self.results.stats()}
+
+	def summary(self):
+		'''One line about how the memory cache did.'''
+		parts = []
+		for name, stats in sorted(self.stats().items()):
+			parts.append("{0}: {1} hits, {2} misses, {3} thrown out, {4} kept ({5:.1f} MB)".format(name, stats['hits'],
+				stats['misses'], stats['evictions'], stats['entries'], stats['bytes'] / 1048576.0))
+		return "Memory cache - " + "; ".join(parts)
+
+sharedMemoryCache = None
+sharedMemoryCacheLock = threading.Lock()
+
+def getSharedMemoryCache(maxBytes=64*1024*1024, resultBytes=None):
+	'''Returns the MemoryCache every scraping function shares, making it the first time. It's sized for 
+	the biggest budgets it's been asked for, so a job that asks for less doesn't shrink it under a job 
+	that's still using it.'''
+	global sharedMemoryCache
+	if resultBytes is None:
+		resultBytes = maxBytes // 4
+	with sharedMemoryCacheLock:
+		if sharedMemoryCache is None:
+			sharedMemoryCache = MemoryCache(maxBytes, resultBytes)
+		elif maxBytes > sharedMemoryCache.pages.maxBytes or resultBytes > sharedMemoryCache.results.maxBytes:
+			sharedMemoryCache.resize(max(maxBytes, sharedMemoryCache.pages.maxBytes),
+				max(resultBytes, sharedMemoryCache.results.maxBytes))
+		return sharedMemoryCache
+
+def memoryCacheFromKwargs(kwargs):
+	'''Returns kwargs['memoryCache'] if there is one, the shared MemoryCache if kwargs has memoryCacheBytes
+	(and memoryResultBytes), or None.'''
+	if kwargs.get('memoryCache') is not None:
+		return kwargs['memoryCache']
+	if not kwargs.get('memoryCacheBytes'):
+		return None
+	return getSharedMemoryCache(kwargs['memoryCacheBytes'], kwargs.get('memoryResultBytes'))
+
+# Government sites are slow and flaky. Without a timeout, one hung request used to hang the whole run,
+# and an error page or a redirect just looked like a page where the quotes weren't found. Now:
+# - every request has a connect timeout and a read timeout (connectTimeout and readTimeout, in seconds)
+# - timeouts, dropped connections and "try again later" statuses (429, 500, 502, 503, 504) are retried 
+#   up to maxRetries times, waiting a random time that roughly doubles each try (or as long as the 
+#   server's Retry-After asks, up to maxRetryWait)
+# - a redirect or any other error status raises FetchError, so it's reported as what it is
+# - each host gets a circuit breaker: when too many recent requests to a host fail, requests to that 
+#   host pause for a while instead of piling onto a server that's already struggling
+
+retryableStatuses = set([429, 500, 502, 503, 504])
+# a dropped connection can also show up while the body is being read, as a truncated or garbled body
+retryableErrors = (requests.exceptions.ConnectionError, requests.exceptions.Timeout, 
+	requests.exceptions.ChunkedEncodingError, requests.exceptions.ContentDecodingError)
+
+class FetchError(requests.exceptions.RequestException):
+	'''Raised when a page can't be downloaded: an error status, a redirect, or too many retries.'''
+	pass
+
+class CircuitBreaker(object):
+	'''Watches the last window requests to one host. Once at least minimumRequests have been made and
+	more than errorRate of them failed, the circuit "opens": requests wait cooldown seconds, then one
+	trial request goes through. If it works the circuit closes again; if not, it stays open and the 
+	cooldown doubles (up to maxCooldown).'''
+	def __init__(self, window=20, errorRate=0.5, cooldown=30.0, maxCooldown=600.0, minimumRequests=5):
+		self.results = collections.deque(maxlen=window)
+		self.errorRate = errorRate
+		self.cooldown = cooldown
+		self.maxCooldown = maxCooldown
+		self.minimumRequests = minimumRequests
+		self.currentCooldown = cooldown
+		self.state = 'closed' # or 'open' (waiting) or 'trial' (one request is testing the water)
+		self.openUntil = 0
+		self.condition = threading.Condition()
+
+	def beforeRequest(self):
+		'''Blocks while the circuit is open. Returns True if the caller is making the trial request.'''
+		with self.condition:
+			while True:
+				if self.state == 'closed':
+					return False
+				now = time.time()
+				if self.state == 'open' and now >= self.openUntil:
+					self.state = 'trial'
+					return True
+				if self.state == 'open':
+					self.condition.wait(self.openUntil - now)
+				else:
+					self.condition.wait(1.0)
+
+	def recordResult(self, succeeded, trial=False):
+		'''Tells the breaker how a request went. Pass trial=True for the trial request.'''
+		with self.condition:
+			if trial:
+				if succeeded:
+					self.state = 'closed'
+					self.results.clear()
+					self.currentCooldown = self.cooldown
+				else:
+					self.trip()
+				self.condition.notify_all()
+				return
+			self.results.append(succeeded)
+			failures = self.results.count(False)
+			if self.state == 'closed' and len(self.results) >= self.minimumRequests and failures > self.errorRate * len(self.results):
+				self.trip()
+
+	def trip(self):
+		'''Opens the circuit. Call with the condition held.'''
+		print "Too many errors from this host, so pausing requests to it for {0:g} seconds.".format(self.currentCooldown)
+		self.state = 'open'
+		self.openUntil = time.time() + self.currentCooldown
+		self.currentCooldown = min(self.currentCooldown * 2, self.maxCooldown)
+
+class HostCircuitBreakers(object):
+	'''Keeps one CircuitBreaker per host, made with the settings passed in.'''
+	def __init__(self, **breakerSettings):
+		self.breakerSettings = breakerSettings
+		self.breakers = {}
+		self.lock = threading.Lock()
+
+	def breakerFor(self, URL):
+		host = urlparse.urlparse(URL).netloc
+		with self.lock:
+			if host not in self.breakers:
+				self.breakers[host] = CircuitBreaker(**self.breakerSettings)
+			return self.breakers[host]
+
+def retryAfterSeconds(retryAfter):
+	'''Turns a Retry-After header (a number of seconds or a date) into seconds, or None if it can't.'''
+	if retryAfter is None:
+		return None
+	try:
+		return max(0.0, float(retryAfter))
+	except ValueError:
+		retryDate = email.utils.parsedate_tz(retryAfter)
+		if retryDate is None:
+			return None
+		return max(0.0, email.utils.mktime_tz(retryDate) - time.time())
+
+# Here's how a run keeps track of where its time goes. RunMetrics adds up the time spent in each stage
+# (reading the file, making the URLs, waiting on the rate limit, connecting, waiting for the first byte,
+# downloading, decoding, waiting to retry, extracting, post-processing and writing) and counts how each
+# row turned out. While the run goes it keeps a progress line with an ETA on stderr, and if there's a metricsFile
+# it writes everything there every metricsEvery seconds: a file ending in .prom is rewritten in the
+# Prometheus text format (node_exporter's textfile collector can pick it up), and any other file gets
+# one JSON line added each time. Messages about single rows go through say(), so they don't get
+# tangled up with the progress line.
+
+runStages = ['read', 'URLs', 'rate limit', 'connect', 'first byte', 'download', 'decode', 'retry wait',
+	'extract', 'post-process', 'write']
+failureEvents = ['missing URL', 'offline miss', 'HTTP error', 'connection error', 'timeout', 'other error', 'no match']
+
+class RunMetrics(object):
+	'''Stage timings and row counts for one run. expectedRows (if it's known) gives the ETA. The progress
+	line is redrawn every progressEvery seconds (by default every second on a terminal, or a new line
+	every minute when stderr is a log file); progress=False turns it and the summary off. When several
+	jobs run at once, name (the jobName) goes at the start of the progress line and the summary.'''
+	def __init__(self, expectedRows=None, progress=True, progressEvery=None, metricsFile=None,
+			metricsEvery=10.0, metricsFormat=None, name=None):
+		self.lock = threading.Lock()
+		self.prefix = '[{0}] '.format(name) if name else ''
+		self.start = time.time()
+		self.expectedRows = expectedRows
+		self.progress = progress
+		self.interactive = hasattr(sys.stderr, 'isatty') and sys.stderr.isatty()
+		if progressEvery is None:
+			progressEvery = 1.0 if self.interactive else 60.0
+		self.progressEvery = progressEvery
+		self.metricsFile = metricsFile
+		self.metricsEvery = metricsEvery
+		if metricsFormat is None and metricsFile is not None:
+			metricsFormat = 'prometheus' if metricsFile.endswith('.prom') else 'json'
+		self.metricsFormat = metricsFormat
+		self.rows = 0
+		self.events = collections.Counter()
+		self.stages = dict((stage, [0, 0.0, 0.0]) for stage in runStages) # calls, seconds, longest
+		self.lastProgress = self.start
+		self.lastMetrics = self.start
+		self.progressWidth = 0
+		self.closed = False
+
+	def addTime(self, stage, seconds):
+		with self.lock:
+			timing = self.stages.setdefault(stage, [0, 0.0, 0.0])
+			timing[0] += 1
+			timing[1] += seconds
+			timing[2] = max(timing[2], seconds)
+
+	def count(self, event, n=1):
+		with self.lock:
+			self.events[event] += n
+
+	def rowDone(self):
+		'''Counts a finished row, and updates the progress line and metrics file if it's time.'''
+		with self.lock:
+			self.rows += 1
+		now = time.time()
+		if self.progress and now - self.lastProgress >= self.progressEvery:
+			self.lastProgress = now
+			self.showProgress()
+		if self.metricsFile is not None and now - self.lastMetrics >= self.metricsEvery:
+			self.lastMetrics = now
+			self.writeMetrics()
+
+	def progressLine(self):
+		elapsed = time.time() - self.start
+		rate = self.rows / elapsed if elapsed > 0 else 0.0
+		failed = sum(self.events[event] for event in failureEvents)
+		if self.expectedRows:
+			line = "{0:,} of about {1:,} rows ({2:.1f}%), {3:.1f} rows/sec, {4:,} failed".format(
+				self.rows, self.expectedRows, 100.0 * self.rows / self.expectedRows, rate, failed)
+			if rate > 0 and self.rows < self.expectedRows:
+				line += ", ETA " + formatSeconds((self.expectedRows - self.rows) / rate)
+			return self.prefix + line
+		return self.prefix + "{0:,} rows, {1:.1f} rows/sec, {2:,} failed".format(self.rows, rate, failed)
+
+	def showProgress(self):
+		with self.lock:
+			line = self.progressLine()
+			if self.interactive:
+				sys.stderr.write('\r' + line.ljust(self.progressWidth))
+				self.progressWidth = len(line)
+			else:
+				sys.stderr.write(line + '\n')
+			sys.stderr.flush()
+
+	def say(self, message):
+		'''Prints a message about one row without breaking up the progress line.'''
+		with self.lock:
+			if self.progress and self.interactive and self.progressWidth:
+				sys.stderr.write('\r' + ' ' * self.progressWidth + '\r')
+				sys.stderr.flush()
+				self.progressWidth = 0
+			print message
+
+	def snapshot(self):
+		with self.lock:
+			elapsed = time.time() - self.start
+			return {'time' : time.time(), 'elapsedSeconds' : elapsed, 'rows' : self.rows,
+				'expectedRows' : self.expectedRows, 'rowsPerSecond' : self.rows / elapsed if elapsed > 0 else 0.0,
+				'events' : dict(self.events), 'stages' : dict((stage, {'calls' : calls, 'seconds' : seconds,
+				'longestSeconds' : longest}) for stage, (calls, seconds, longest) in self.stages.items())}
+
+	def writeMetrics(self):
+		snapshot = self.snapshot()
+		if self.metricsFormat == 'prometheus':
+			lines = ['# TYPE scraper_rows_total counter', 'scraper_rows_total {0}'.format(snapshot['rows']),
+				'# TYPE scraper_elapsed_seconds gauge', 'scraper_elapsed_seconds {0:.3f}'.format(snapshot['elapsedSeconds'])]
+			if snapshot['expectedRows'] is not None:
+				lines += ['# TYPE scraper_expected_rows gauge', 'scraper_expected_rows {0}'.format(snapshot['expectedRows'])]
+			lines.append('# TYPE scraper_events_total counter')
+			for event, n in sorted(snapshot['events'].items()):
+				lines.append('scraper_events_total{{event="{0}"}} {1}'.format(event, n))
+			for name, key in [('scraper_stage_calls_total', 'calls'), ('scraper_stage_seconds_total', 'seconds')]:
+				lines.append('# TYPE {0} counter'.format(name))
+				for stage in sorted(snapshot['stages']):
+					lines.append('{0}{{stage="{1}"}} {2}'.format(name, stage, snapshot['stages'][stage][key]))
+			with open(self.metricsFile + '.tmp', 'w') as metricsFile:
+				metricsFile.write('\n'.join(lines) + '\n')
+			os.rename(self.metricsFile + '.tmp', self.metricsFile) # so a reader never sees half a file
+		else:
+			with open(self.metricsFile, 'a') as metricsFile:
+				metricsFile.write(json.dumps(snapshot) + '\n')
+
+	def close(self):
+		'''Finishes the progress line, prints where the time went and writes the metrics file one last time.'''
+		if self.closed:
+			return
+		self.closed = True
+		if self.metricsFile is not None:
+			self.writeMetrics()
+		if not self.progress:
+			return
+		self.showProgress()
+		if self.interactive:
+			sys.stderr.write('\n')
+		elapsed = time.time() - self.start
+		lines = [self.prefix + "Finished {0:,} rows in {1}.".format(self.rows, formatSeconds(elapsed))]
+		if self.events:
+			lines.append("  " + ", ".join("{0}: {1:,}".format(event, n) for event, n in sorted(self.events.items())))
+		lines.append("  {0:<14} {1:>10} {2:>9} {3:>10}".format('stage', 'seconds', 'avg ms', 'longest ms'))
+		for stage in runStages + sorted(set(self.stages) - set(runStages)):
+			calls, seconds, longest = self.stages[stage]
+			if calls:
+				lines.append("  {0:<14} {1:>10.2f} {2:>9.2f} {3:>10.1f}".format(stage, seconds, 1000 * seconds / calls, 1000 * longest))
+		print '\n'.join(lines) # in one go, so the summaries of jobs running at once don't get mixed up
+
+def formatSeconds(seconds):
+	'''Turns a number of seconds into H:MM:SS.'''
+	minutes, seconds = divmod(int(seconds), 60)
+	hours, minutes = divmod(minutes, 60)
+	return "{0}:{1:02d}:{2:02d}".format(hours, minutes, seconds)
+
+def metricsFromKwargs(kwargs, expectedRows=None):
+	'''Makes the RunMetrics for a run from kwargs (progress, progressEvery, metricsFile, metricsEvery,
+	metricsFormat, which is 'prometheus' or 'json', and jobName).'''
+	return RunMetrics(expectedRows, kwargs.get('progress',True), kwargs.get('progressEvery'),
+		kwargs.get('metricsFile'), kwargs.get('metricsEvery',10.0), kwargs.get('metricsFormat'), kwargs.get('jobName'))
+
+timedRowsClock = threading.local() # the seconds each timedRows stage has taken in each thread
+
+def timedRowsSeconds():
+	'''Returns {(id(metrics), stage) : seconds} for the timedRows that have run in this thread.'''
+	if not hasattr(timedRowsClock, 'seconds'):
+		timedRowsClock.seconds = collections.defaultdict(float)
+	return timedRowsClock.seconds
+
+def timedRows(rows, metrics, stage, innerStage=None):
+	'''Passes rows through, adding the time spent waiting for each one to stage. If rows is built on
+	another timedRows, give its stage as innerStage so that time isn't counted twice. The inner stage's
+	time is what it took for this row (the inner rows are read in the same thread, while we wait), so 
+	other threads or jobs adding to the same stage in metrics at the same time don't come into it.'''
+	rows = iter(rows)
+	while True:
+		clock = timedRowsSeconds()
+		innerBefore = clock[id(metrics), innerStage]
+		start = time.time()
+		try:
+			row = next(rows)
+		except StopIteration:
+			return
+		seconds = time.time() - start
+		clock[id(metrics), stage] += seconds
+		if innerStage is not None:
+			seconds -= clock[id(metrics), innerStage] - innerBefore
+		metrics.addTime(stage, seconds)
+		yield row
+
+def countLines(fileName):
+	'''Counts the lines in fileName without parsing it (so a quoted field with a line break in it
+	counts twice). It's only used for the ETA.'''
+	with open(fileName, 'rb') as countedFile:
+		return sum(block.count('\n') for block in iter(lambda: countedFile.read(1 << 20), ''))
+
+def estimateLines(fileName, sampleBytes=16*1024*1024):
+	'''Counts the lines in fileName, or, if it's more than a few times sampleBytes, estimates them from
+	the first sampleBytes, so a huge file doesn't have to be read through before the run can start.'''
+	size = os.path.getsize(fileName)
+	if size <= 4 * sampleBytes:
+		return countLines(fileName)
+	with open(fileName, 'rb') as countedFile:
+		sample = countedFile.read(sampleBytes)
+	return int(size * sample.count('\n') / float(len(sample)))
+
+def expectedRowsFor(fileName, kwargs):
+	'''About how many rows a driver will scrape from fileName, or None for a sharded run.'''
+	if kwargs.get('shard') is not None or kwargs.get('shardByteRange') is not None:
+		return None
+	return max(0, estimateLines(fileName) - 1)
+
+# A job's threads can ask for the same page at the same time. InFlightRequests lets them share: the 
+# first thread to ask for a URL downloads it, and any thread that asks for the same URL while that 
+# download is still going waits for it and gets the same page (or the same error) instead of making 
+# a request of its own. That works across jobs too, as long as their fetchers would get the same 
+# answer: the keys include PageFetcher.sharingKey(), so a fetcher with another session, page cache,
+# offline setting, timeout or number of retries makes its own request (an offline job's 
+# OfflineCacheMiss is no answer for an online one).
+
+class InFlightRequests(object):
+	'''Shares one call of function between threads that ask for the same key at the same time.'''
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.pending = {}
+
+	def share(self, key, function):
+		'''Returns function(), or, if another thread is already running it for key, what that call returns
+		(or raises). The second value returned says whether it was shared.'''
+		with self.lock:
+			waiter = self.pending.get(key)
+			leader = waiter is None
+			if leader:
+				waiter = self.pending[key] = [threading.Event(), None]
+		if not leader:
+			while not waiter[0].is_set():
+				waiter[0].wait(1.0) # waiting a second at a time keeps Ctrl-C working
+			succeeded, result = waiter[1]
+			if not succeeded:
+				errorType, error, traceback = result
+				raise errorType, error, traceback
+			return result, True
+		try:
+			result = function()
+			waiter[1] = (True, result)
+			return result, False
+		except Exception:
+			waiter[1] = (False, sys.exc_info())
+			raise
+		finally:
+			with self.lock:
+				del self.pending[key]
+			waiter[0].set()
+
+sharedFetches = InFlightRequests()
+
+# A PageFetcher is everything that sits between a URL and the text of its page: the session, the rate
+# limiter, the cache, the timeouts and retries, and the circuit breakers. The scraping functions build
+# one from their kwargs and share it between rows.
+
+class PageFetcher(object):
+	'''Downloads pages through session (the shared session by default), waiting on rateLimiter (or half 
+	a second if there isn't one) and checking cache first if there is one. timeout is (connect, read)
+	in seconds. circuitBreakers is a HostCircuitBreakers, or None to go without. The download stages
+	are timed in metrics (a RunMetrics; without one, they're kept in one of its own). If there's a
+	memoryCache (a MemoryCache), pages are looked for there before the page cache and the network.'''
+	def __init__(self, session=None, rateLimiter=None, cache=None, timeout=(10, 60), maxRetries=3,
+			retryBackoff=1.0, maxRetryWait=300.0, circuitBreakers=None, metrics=None, memoryCache=None):
+		self.session = session
+		self.rateLimiter = rateLimiter
+		self.cache = cache
+		self.timeout = timeout
+		self.maxRetries = maxRetries
+		self.retryBackoff = retryBackoff
+		self.maxRetryWait = maxRetryWait
+		self.circuitBreakers = circuitBreakers
+		self.metrics = metrics if metrics is not None else RunMetrics(progress=False)
+		self.memoryCache = memoryCache
+
+	def retryWait(self, attempt, retryAfter=None):
+		'''How long to wait before retry number attempt + 1: what the server asked for if it said,
+		otherwise a random time up to retryBackoff * 2 ** attempt.'''
+		seconds = retryAfterSeconds(retryAfter)
+		if seconds is None:
+			seconds = random.uniform(0, self.retryBackoff * 2 ** attempt)
+		return min(seconds, self.maxRetryWait)
+
+	def fetch(self, URL):
+		'''Returns the text of the page at URL. If another thread is already downloading URL, this waits 
+		for that download instead of starting another one.'''
+		page, shared = sharedFetches.share((self.sharingKey(), 'fetch', URL), lambda: self.fetchPage(URL))
+		if shared:
+			self.metrics.count('shared download')
+		return page
+
+	def sharingKey(self):
+		'''What another fetcher has to have in common with this one to share its downloads (see 
+		InFlightRequests): the same session, page cache settings, timeout and retries.'''
+		session = self.session if self.session is not None else getSharedSession()
+		cache = None
+		if self.cache is not None:
+			cache = (os.path.abspath(self.cache.cacheDir), self.cache.ttl, self.cache.offline)
+		return (id(session), cache, self.timeout, self.maxRetries)
+
+	def fetchPage(self, URL):
+		page = self.cachedPage(URL)
+		if page is not None:
+			return page
+		response = self.get(URL)
+		start = time.time()
+		page = response.text
+		self.metrics.addTime('decode', time.time() - start)
+		if response.status_code == 200: # don't keep error pages around
+			self.keepPage(URL, page)
+		return page
+
+	def cachedPage(self, URL):
+		'''Returns the page for URL from the memory cache or the page cache, or None if it has to be 
+		downloaded. Raises OfflineCacheMiss if it has to be downloaded in offline mode.'''
+		if self.memoryCache is not None:
+			page = self.memoryCache.pages.get(URL)
+			if page is not None:
+				self.metrics.count('memory page hit')
+				return page
+		if self.cache is not None:
+			page = self.cache.get(URL)
+			if page is not None:
+				self.metrics.count('cache hit')
+				if self.memoryCache is not None:
+					self.memoryCache.pages.put(URL, page)
+				return page
+			if self.cache.offline:
+				raise OfflineCacheMiss(URL)
+		return None
+
+	def keepPage(self, URL, page):
+		'''Puts a whole page that was just downloaded in the memory cache and the page cache.'''
+		if self.memoryCache is not None:
+			self.memoryCache.pages.put(URL, page)
+		if self.cache is not None:
+			self.cache.put(URL, page)
+
+	def fetchIfChanged(self, URL, etag=None, lastModified=None):
+		'''Like fetch, but asks the server not to send the page if it hasn't changed since etag / 
+		lastModified. Returns (page, etag, lastModified), where page is None if it hasn't changed.
+		This always asks the server (it doesn't read from the cache), but new pages still go in the cache.'''
+		headers = {}
+		if etag:
+			headers['If-None-Match'] = etag
+		if lastModified:
+			headers['If-Modified-Since'] = lastModified
+		response = self.get(URL, headers)
+		if response.status_code == 304:
+			return None, etag, lastModified
+		page = response.text
+		if response.status_code == 200:
+			self.keepPage(URL, page)
+		return page, response.headers.get('ETag'), response.headers.get('Last-Modified')
+
+	def fetchUntil(self, URL, isComplete, chunkSize=16384):
+		'''Like fetch, but reads the page a chunk at a time and stops (dropping the connection) as soon as 
+		isComplete(the text so far) returns True, so the rest of the page is never downloaded. If that
+		never happens, the whole page is returned. Only whole pages go in the cache.'''
+		page, shared = sharedFetches.share((self.sharingKey(), 'until', URL, isComplete), lambda: self.fetchPageUntil(URL, isComplete, chunkSize))
+		if shared:
+			self.metrics.count('shared download')
+		return page
+
+	def fetchPageUntil(self, URL, isComplete, chunkSize):
+		page = self.cachedPage(URL)
+		if page is not None:
+			return page
+		def readUntil(response):
+			'''Returns (the page so far, whether it's the whole page).'''
+			start = time.time()
+			try:
+				try:
+					decoder = codecs.getincrementaldecoder(response.encoding or 'utf-8')(errors='replace')
+				except LookupError:
+					decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+				page = u''
+				for chunk in response.iter_content(chunkSize):
+					page += decoder.decode(chunk)
+					if isComplete(page):
+						self.metrics.count('stopped early')
+						return page, False
+				return page + decoder.decode('', True), True
+			finally:
+				self.metrics.addTime('download', time.time() - start)
+				response.close()
+		response, (page, whole) = self.get(URL, stream=True, read=readUntil)
+		if whole and response.status_code == 200:
+			self.keepPage(URL, page)
+		return page
+
+	def get(self, URL, headers=None, stream=False, read=None):
+		'''Requests URL, retrying as needed, and returns the response. Raises FetchError for a redirect
+		or an error status, and the requests error if it still can't connect after the retries. With
+		stream=True the body is left to be read (and the response closed) by the caller, or by read: 
+		read(response) is called on a successful response inside the retries, so a connection that drops 
+		partway through the body (a ChunkedEncodingError) is retried, and counted against the host's 
+		circuit breaker, the same as one that couldn't connect. With read, this returns (the response, 
+		what read returned).'''
+		session = self.session
+		if session is None:
+			session = getSharedSession()
+		breaker = self.circuitBreakers.breakerFor(URL) if self.circuitBreakers is not None else None
+		attempt = 0
+		result = None
+		while True:
+			trial = breaker.beforeRequest() if breaker is not None else False
+			try:
+				response = self.send(session, URL, headers, stream)
+				if read is not None and response.status_code < 300:
+					result = read(response)
+			except retryableErrors as error:
+				if breaker is not None:
+					breaker.recordResult(False, trial)
+				if attempt >= self.maxRetries:
+					raise
+				wait = self.retryWait(attempt)
+				reason = repr(error)
+			except Exception:
+				# anything else still has to settle a trial request, or the host's breaker stays 
+				# in 'trial' and every later request to it waits forever
+				if breaker is not None:
+					breaker.recordResult(False, trial)
+				raise
+			else:
+				retryable = response.status_code in retryableStatuses
+				if breaker is not None:
+					breaker.recordResult(not retryable, trial)
+				if not retryable:
+					break
+				response.close()
+				if attempt >= self.maxRetries:
+					raise FetchError("{0} still returned {1} after {2} retries".format(URL, response.status_code, attempt), response=response)
+				wait = self.retryWait(attempt, response.headers.get('Retry-After'))
+				reason = "status {0}".format(response.status_code)
+			self.metrics.say("Retrying {0} in {1:.1f} seconds ({2}).".format(URL, wait, reason))
+			self.metrics.count('retry')
+			time.sleep(wait)
+			self.metrics.addTime('retry wait', wait)
+			attempt += 1
+		if response.status_code >= 300 and response.status_code != 304:
+			response.close()
+		if 300 <= response.status_code < 400 and response.status_code != 304:
+			raise FetchError("{0} redirected to {1}".format(URL, response.headers.get('Location')), response=response)
+		if response.status_code >= 400:
+			raise FetchError("{0} returned {1}".format(URL, response.status_code), response=response)
+		if read is not None:
+			return response, result
+		return response
+
+	def send(self, session, URL, headers=None, stream=False):
+		'''Makes one request for URL when the rate limiter allows it, tells the rate limiter how it went 
+		(which matters for an AdaptiveRateLimiter) and returns the response.'''
+		start = time.time()
+		if self.rateLimiter is None:
+			time.sleep(0.5)
+		else:
+			self.rateLimiter.wait(URL)
+		self.metrics.addTime('rate limit', time.time() - start)
+		outcome = 'error'
+		firstByteSeconds = None
+		try:
+			connectTiming.seconds = 0.0
+			start = time.time()
+			response = session.get(URL, allow_redirects=False, timeout=self.timeout, headers=headers, stream=stream)
+			firstByteSeconds = self.timeResponse(response, time.time() - start, stream)
+			outcome = 'throttled' if response.status_code in retryableStatuses else 'ok'
+		except requests.exceptions.Timeout:
+			outcome = 'timeout'
+			raise
+		except retryableErrors:
+			outcome = 'connection error'
+			raise
+		finally:
+			if self.rateLimiter is not None and self.rateLimiter.finished(URL, firstByteSeconds, outcome) is not None:
+				self.metrics.count('slowed down')
+		return response
+
+	def timeResponse(self, response, seconds, stream):
+		'''Splits the seconds session.get took into connecting, waiting for the first byte (requests 
+		times up to the end of the headers) and, unless the body is being streamed, downloading.
+		Returns the time to first byte.'''
+		connectSeconds = getattr(connectTiming, 'seconds', 0.0)
+		headerSeconds = response.elapsed.total_seconds()
+		firstByteSeconds = max(0.0, headerSeconds - connectSeconds)
+		if connectSeconds > 0:
+			self.metrics.addTime('connect', connectSeconds)
+		self.metrics.addTime('first byte', firstByteSeconds)
+		if not stream:
+			self.metrics.addTime('download', max(0.0, seconds - headerSeconds))
+		return firstByteSeconds
+
+def fetcherFromKwargs(kwargs, metrics=None):
+	'''Builds the PageFetcher a scraping function should use from its kwargs (see sessionFromKwargs,
+	rateLimiterFromKwargs, cacheFromKwargs, memoryCacheFromKwargs, connectTimeout, readTimeout, maxRetries,
+	retryBackoff, maxRetryWait and the circuit breaker settings below), unless kwargs already has a 
+	'fetcher'. Its download stages are timed in metrics.'''
+	if kwargs.get('fetcher') is not None:
+		return kwargs['fetcher']
+	rateLimiter = rateLimiterFromKwargs(kwargs) # a fixed requestsPerSecond, or adaptive (see AdaptiveRateLimiter)
+	circuitBreakers = None
+	if kwargs.get('circuitBreaker',True):
+		circuitBreakers = HostCircuitBreakers(errorRate=kwargs.get('circuitErrorRate',0.5), 
+			cooldown=kwargs.get('circuitCooldown',30.0), maxCooldown=kwargs.get('circuitMaxCooldown',600.0))
+	return PageFetcher(sessionFromKwargs(kwargs), rateLimiter, cacheFromKwargs(kwargs),
+		(kwargs.get('connectTimeout',10), kwargs.get('readTimeout',60)), kwargs.get('maxRetries',3),
+		kwargs.get('retryBackoff',1.0), kwargs.get('maxRetryWait',300.0), circuitBreakers, metrics,
+		memoryCacheFromKwargs(kwargs))
+
+# scrape() used to glue startQuote + '(.+)' + endQuote together and search for it on every single page.
+# An Extractor does the setup once per job: it compiles the regular expression once, or, if the quotes
+# are plain text (like the ones strToRegEx makes), it skips regular expressions and uses str.find.
+# matchMode 'greedy' (the default) grabs everything from the first startQuote to the LAST endQuote 
+# after it, which is what scrape() has always done. 'lazy' stops at the FIRST endQuote, which is 
+# usually what you want and is much faster on big pages, because the search doesn't have to run to the 
+# end of the page and back.
+
+class NoMatchError(AttributeError):
+	'''Raised when startQuote and endQuote can't be found on a page. It's an AttributeError because
+	that's what scrape() has always raised then, and the scraping functions rely on it.'''
+	pass
+
+def regExToLiteral(pattern):
+	'''Undoes strToRegEx. Returns the plain text that pattern matches, or None if pattern uses
+	real regular expression features (like \s or .).'''
+	literal = []
+	escaped = False
+	for character in pattern:
+		if escaped:
+			if character not in '\\^$.|?*+()[]{}':
+				return None
+			literal.append(character)
+			escaped = False
+		elif character == '\\':
+			escaped = True
+		elif character in '^$.|?*+()[{':
+			return None
+		else:
+			literal.append(character)
+	if escaped:
+		return None
+	literal = ''.join(literal)
+	if isinstance(literal, str):
+		literal = literal.decode('utf-8') # pages come back as unicode
+	return literal
+
+class Extractor(object):
+	'''Pulls the text between startQuote and endQuote out of a page.'''
+	def __init__(self, startQuote, endQuote, matchMode='greedy'):
+		if matchMode not in ('greedy', 'lazy'):
+			raise ValueError("matchMode must be 'greedy' or 'lazy', not {0!r}".format(matchMode))
+		self.startQuote = startQuote
+		self.endQuote = endQuote
+		self.matchMode = matchMode
+		self.startLiteral = regExToLiteral(startQuote)
+		self.endLiteral = regExToLiteral(endQuote)
+		if self.startLiteral is None or self.endLiteral is None:
+			group = '(.+)' if matchMode == 'greedy' else '(.+?)'
+			self.pattern = re.compile(str(startQuote + group + endQuote), re.DOTALL)
+		else:
+			self.pattern = None
+
+	def extract(self, page):
+		'''Returns the text between the quotes on page, or None if they aren't there.'''
+		if self.pattern is not None:
+			scraping = self.pattern.search(page)
+			if scraping is None:
+				return None
+			return scraping.group(1)
+		start = page.find(self.startLiteral)
+		if start == -1:
+			return None
+		start += len(self.startLiteral)
+		if self.matchMode == 'greedy':
+			end = page.rfind(self.endLiteral, start + 1) # (.+) needs at least one character
+		else:
+			end = page.find(self.endLiteral, start + 1)
+		if end == -1:
+			return None
+		return page[start:end]
+
+extractors = {}
+
+def extractorFor(startQuote, endQuote, matchMode='greedy'):
+	'''Returns an Extractor for these quotes, reusing one that was already made if possible.'''
+	key = (startQuote, endQuote, matchMode)
+	if key not in extractors:
+		extractors[key] = Extractor(startQuote, endQuote, matchMode)
+	return extractors[key]
+
+def scrape(URL, startQuote, endQuote, rateLimiter=None, session=None, fetcher=None, extractor=None, memoryCache=None):
 	'''string --> string
 	Scrapes data from a given section in a given URL. Currently, you need to write
 	startQuote and endQuote in regular expression-friendly format (i.e. put \ before 
-	some characters, \s instead of space, etc.).
+	some characters, \s instead of space, etc.). If you pass a HostRateLimiter, it decides
+	when the request can go out; otherwise scrape() waits half a second like it always has.
+	The request goes through session, or the shared session if you don't give one.
+	If you pass a PageFetcher, it's used instead of rateLimiter and session, and if you
+	pass an Extractor, it's used instead of startQuote and endQuote.
+	With a MemoryCache (like getSharedMemoryCache()), or a fetcher that has one, asking for the same URL
+	and quotes again returns what was scraped the first time, and new quotes on the same URL reuse the page.
+	Raises NoMatchError if the quotes aren't on the page.
 	'''
-	time.sleep(0.5)
-	webpage = requests.get(URL, allow_redirects=False).text
+	if fetcher is None:
+		fetcher = PageFetcher(session, rateLimiter, memoryCache=memoryCache)
+	elif memoryCache is None:
+		memoryCache = fetcher.memoryCache
+	if extractor is None:
+		extractor = extractorFor(startQuote, endQuote)
+	resultKey = ('scrape', URL, extractor.startQuote, extractor.endQuote, extractor.matchMode)
+	if memoryCache is not None:
+		scraping = memoryCache.results.get(resultKey)
+		if scraping is not None:
+			return scraping
+	webpage = fetcher.fetch(URL)
 #	print webpage
-	searchStr = str(startQuote + '(.+)' + endQuote)
-#	print type(searchStr)
-	scraping = re.search(searchStr,webpage,re.DOTALL)
+	scraping = extractor.extract(webpage)
 #	print "webpage: ",webpage
 	# add try here instead of this way, also add "source\sof\sthis\sinformation\."
-	return scraping.group(1).encode('utf-8')
+	if scraping is None:
+		raise NoMatchError("Couldn't find startQuote and endQuote on {0}".format(URL))
+	scraping = scraping.encode('utf-8')
+	if memoryCache is not None:
+		memoryCache.results.put(resultKey, scraping)
+	return scraping
 		#	if scraping == None:
 #		print "Scraping program couldn't find the information for {0}.".format(URL)
 #	return scraping.group(1)
 #	print scraping
 
+# To pull several things off the same page, give the scraping functions a list of extractors:
+# 'extractors' : [(newColumnName, startQuote, endQuote), (anotherColumnName, startQuote, endQuote), ...]
+# Each page is downloaded once, every extractor is run over that one copy, and all of the new 
+# columns are written out together. Without the list, newColumnName/startQuote/endQuote work like always.
+
+def fieldsFromKwargs(kwargs):
+	'''Returns the list of (column, startQuote, endQuote) a job's kwargs asks for (which is empty for a
+	job that only uses selectors, see below).'''
+	if kwargs.get('extractors'):
+		return kwargs['extractors']
+	if kwargs.get('selectors') and kwargs.get('startQuote') is None:
+		return []
+	return [(kwargs.get('newColumnName'), kwargs.get('startQuote'), kwargs.get('endQuote'))]
+
+def fieldExtractorsFor(fields, matchMode='greedy', alternateEndQuoteList=[]):
+	'''Returns a list of (column, Extractor, list of alternate Extractors) for fields. The alternates
+	come from alternateEndQuoteList and are only tried when the main endQuote isn't found.'''
+	fieldExtractors = []
+	for column, startQuote, endQuote in fields:
+		alternates = [extractorFor(startQuote, quote, matchMode) for quote in alternateEndQuoteList]
+		fieldExtractors.append((column, extractorFor(startQuote, endQuote, matchMode), alternates))
+	return fieldExtractors
+
+def extractFields(webpage, fieldExtractors, selectorExtractors=()):
+	'''Runs every extractor over one downloaded page and returns a dictionary of column -> scraped 
+	text (utf-8), with None for the columns whose quotes weren't found (even with the alternates).
+	selectorExtractors is a list of (column, SelectorExtractor), which are only tried for columns
+	that are still None; the page is parsed (once) the first time one of them is needed.'''
+	newInfo = {}
+	for column, extractor, alternates in fieldExtractors:
+		scraping = extractor.extract(webpage)
+		for alternate in alternates:
+			if scraping is not None:
+				break
+			scraping = alternate.extract(webpage)
+		if scraping is not None:
+			scraping = scraping.encode('utf-8')
+		newInfo[column] = scraping
+	document = None
+	parsed = False
+	for column, extractor in selectorExtractors:
+		if newInfo.get(column) is not None:
+			continue
+		if not parsed:
+			document = parseHTML(webpage)
+			parsed = True
+		scraping = extractor.extract(document)
+		newInfo[column] = scraping.encode('utf-8') if scraping is not None else None
+	return newInfo
+
+# Quotes break when a site moves a tag or adds a space, and the long OSHA endQuote that runs across 
+# several table rows is the worst of them. A selector points at the element itself instead:
+#   'selectors' : [('Accident Description', ['td.blueTen', '//table[@width="99%"]//td[1]'])]
+# Each column gets a list of selectors (or just one), tried in order until one of them finds something.
+# Selectors that start with / or ( are XPath; anything else is CSS. The page is parsed once, however 
+# many columns and fallbacks there are, and only when it's needed: a column can have quotes and 
+# selectors both, and then the page is only parsed if the quotes (and the alternates) aren't found. 
+# selectorOutput says what goes in the column: 'html' (everything inside the element, like quotes 
+# around it would give) or 'text' (just its text, with the tags taken out).
+# With lxml installed, pages are parsed by lxml (which is fast) and any CSS (with cssselect) or XPath 
+# works. Without it, Python's own HTMLParser builds the tree. That's slower and only understands simple
+# CSS: tag names, *, #id, .class, [attribute], [attribute=value] (and ~= ^= $= *=), and the 
+# descendant (space) and child (>) combinators.
+
+cssTokenPattern = re.compile(r'''\s*(>)\s*|(\s+)|(\*|[\w-]+)|#([\w-]+)|\.([\w-]+)|\[\s*([\w-]+)\s*(?:([~^$*]?=)\s*(?:"([^"]*)"|'([^']*)'|([^\]\s]+))\s*)?\]''')
+
+def parseCSS(selector):
+	'''Splits a simple CSS selector into a list of steps: (combinator, tag, [(attribute, operator, value)]).
+	The combinator is '>' for a child, ' ' for a descendant (and None for the first step).'''
+	if isinstance(selector, str):
+		selector = selector.decode('utf-8')
+	selector = selector.strip()
+	steps = []
+	combinator = None
+	needStep = True # at the start, and after a combinator
+	position = 0
+	while position < len(selector):
+		match = cssTokenPattern.match(selector, position)
+		if match is None:
+			raise ValueError("I can't read the CSS selector {0!r} (at {1!r}). Installing lxml and cssselect lets you use any CSS.".format(selector, selector[position:]))
+		position = match.end()
+		child, space, tag, elementID, className, attribute, operator = match.groups()[:7]
+		if child or space:
+			if needStep:
+				raise ValueError("I can't read the CSS selector {0!r}.".format(selector))
+			combinator = '>' if child else ' '
+			needStep = True
+			continue
+		if needStep:
+			steps.append((combinator, (tag or '*').lower(), []))
+			combinator = None
+			needStep = False
+			if tag is not None:
+				continue
+		elif tag is not None:
+			raise ValueError("I can't read the CSS selector {0!r} (a tag name has to come first).".format(selector))
+		conditions = steps[-1][2]
+		if elementID is not None:
+			conditions.append(('id', '=', elementID))
+		elif className is not None:
+			conditions.append(('class', '~=', className))
+		else:
+			values = [value for value in match.groups()[7:] if value is not None]
+			conditions.append((attribute.lower(), operator, values[0] if values else None))
+	if needStep:
+		raise ValueError("I can't read the CSS selector {0!r}.".format(selector))
+	return steps
+
+def xpathLiteral(value):
+	if "'" not in value:
+		return "'" + value + "'"
+	if '"' not in value:
+		return '"' + value + '"'
+	return "concat('" + "', \"'\", '".join(value.split("'")) + "')"
+
+def cssStepsToXPath(steps):
+	'''Turns the steps from parseCSS into an XPath expression (for lxml when cssselect isn't installed).'''
+	path = ''
+	for combinator, tag, conditions in steps:
+		path += '/' if combinator == '>' else '//'
+		path += tag
+		for attribute, operator, value in conditions:
+			attribute = '@' + attribute
+			if operator is None:
+				predicate = attribute
+			else:
+				literal = xpathLiteral(value)
+				predicate = {'=' : '{0} = {1}',
+					'~=' : "contains(concat(' ', normalize-space({0}), ' '), concat(' ', {1}, ' '))",
+					'^=' : 'starts-with({0}, {1})',
+					'$=' : 'substring({0}, string-length({0}) - string-length({1}) + 1) = {1}',
+					'*=' : 'contains({0}, {1})'}[operator].format(attribute, literal)
+			path += '[' + predicate + ']'
+	return path
+
+class HTMLElement(object):
+	'''An element of a page parsed by HTMLTreeBuilder. Its inner HTML is page[innerStart:innerEnd], and
+	its text is the document's texts[textStart:textEnd].'''
+	__slots__ = ('document', 'tag', 'attributes', 'parent', 'innerStart', 'innerEnd', 'textStart', 'textEnd')
+	def __init__(self, document, tag, attributes, parent, innerStart, textStart):
+		self.document = document
+		self.tag = tag
+		self.attributes = attributes
+		self.parent = parent
+		self.innerStart = innerStart
+		self.innerEnd = None
+		self.textStart = textStart
+		self.textEnd = None
+
+	def innerHTML(self):
+		return self.document.page[self.innerStart:self.innerEnd]
+
+	def text(self):
+		return u''.join(self.document.texts[self.textStart:self.textEnd])
+
+class HTMLTreeBuilder(HTMLParser.HTMLParser):
+	'''Parses a page (unicode) with Python's own HTMLParser into HTMLElements. elements has every 
+	element in the order it starts on the page. End tags that don't match anything are skipped, and 
+	an end tag closes any elements inside it that were left open. Like in a browser, a <p>, <li>, <tr>,
+	<td> or <option> that's still open is closed when the next one starts.'''
+	voidTags = set(['area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param', 'source', 'track', 'wbr'])
+	impliedEnds = {'p' : ('p',), 'li' : ('li',), 'tr' : ('tr', 'td', 'th'), 'td' : ('td', 'th'), 'th' : ('td', 'th'),
+		'option' : ('option',)}
+
+	def __init__(self, page):
+		HTMLParser.HTMLParser.__init__(self)
+		self.page = page
+		self.lineStarts = [0] + [match.end() for match in re.finditer('\n', page)]
+		self.texts = []
+		self.elements = []
+		self.root = HTMLElement(self, None, {}, None, 0, 0)
+		self.stack = [self.root]
+		try:
+			self.feed(page)
+			self.close()
+		except HTMLParser.HTMLParseError:
+			pass # keep what was parsed before the page went wrong
+		for element in self.stack:
+			element.innerEnd = len(page)
+			element.textEnd = len(self.texts)
+
+	def pageOffset(self):
+		line, column = self.getpos()
+		return self.lineStarts[line - 1] + column
+
+	def handle_starttag(self, tag, attributes):
+		if tag in self.impliedEnds:
+			start = self.pageOffset()
+			while len(self.stack) > 1 and self.stack[-1].tag in self.impliedEnds[tag]:
+				element = self.stack.pop()
+				element.innerEnd = start
+				element.textEnd = len(self.texts)
+		element = HTMLElement(self, tag, dict(attributes), self.stack[-1], 
+			self.pageOffset() + len(self.get_starttag_text()), len(self.texts))
+		self.elements.append(element)
+		if tag in self.voidTags:
+			element.innerEnd = element.innerStart
+			element.textEnd = element.textStart
+		else:
+			self.stack.append(element)
+
+	def handle_startendtag(self, tag, attributes):
+		self.handle_starttag(tag, attributes)
+		if tag not in self.voidTags:
+			self.handle_endtag(tag)
+
+	def handle_endtag(self, tag):
+		for depth in range(len(self.stack) - 1, 0, -1):
+			if self.stack[depth].tag == tag:
+				end = self.pageOffset()
+				while len(self.stack) > depth:
+					element = self.stack.pop()
+					element.innerEnd = end
+					element.textEnd = len(self.texts)
+				return
+
+	def handle_data(self, data):
+		self.texts.append(data)
+
+	def handle_entityref(self, name):
+		self.texts.append(self.unescape('&' + name + ';'))
+
+	def handle_charref(self, name):
+		self.texts.append(self.unescape('&#' + name + ';'))
+
+def stepMatches(element, step):
+	combinator, tag, conditions = step
+	if tag != '*' and element.tag != tag:
+		return False
+	for attribute, operator, value in conditions:
+		actual = element.attributes.get(attribute)
+		if actual is None:
+			return False
+		if operator == '=' and actual != value:
+			return False
+		if operator == '~=' and value not in actual.split():
+			return False
+		if operator == '^=' and not actual.startswith(value):
+			return False
+		if operator == '$=' and not actual.endswith(value):
+			return False
+		if operator == '*=' and value not in actual:
+			return False
+	return True
+
+def cssMatches(element, steps, index=None):
+	'''Whether element (an HTMLElement) matches steps[:index + 1] from parseCSS.'''
+	if index is None:
+		index = len(steps) - 1
+	if element.tag is None or not stepMatches(element, steps[index]):
+		return False
+	if index == 0:
+		return True
+	parent = element.parent
+	if steps[index][0] == '>':
+		return parent is not None and cssMatches(parent, steps, index - 1)
+	while parent is not None:
+		if cssMatches(parent, steps, index - 1):
+			return True
+		parent = parent.parent
+	return False
+
+lxmlParsers = threading.local() # lxml parsers shouldn't be shared between threads
+
+def parseHTML(webpage):
+	'''Parses a page (unicode) once for all of the selectors: with lxml if it's installed, otherwise with
+	HTMLTreeBuilder. Returns None if there's nothing to parse.'''
+	if not webpage:
+		return None
+	if lxmlHTML is None:
+		return HTMLTreeBuilder(webpage)
+	if not hasattr(lxmlParsers, 'parser'):
+		lxmlParsers.parser = lxmlHTML.HTMLParser(encoding='utf-8')
+	try: # lxml won't take unicode that has an encoding declaration, so it gets utf-8 and is told so
+		return lxmlHTML.document_fromstring(webpage.encode('utf-8'), parser=lxmlParsers.parser)
+	except lxmlEtree.ParserError:
+		return None
+
+def compileSelector(selector):
+	'''Compiles one selector (CSS, or XPath if it starts with / or ( ) for whichever parser parseHTML 
+	uses. Returns a function that takes a parsed page and returns the first thing the selector finds
+	(an element, or a string for XPath like //a/@href), or None.'''
+	isXPath = selector.lstrip()[:1] in ('/', '(')
+	if lxmlHTML is None:
+		if isXPath:
+			raise ValueError("XPath selectors like {0!r} need lxml (pip install lxml).".format(selector))
+		steps = parseCSS(selector)
+		def select(document):
+			for element in document.elements:
+				if cssMatches(element, steps):
+					return element
+			return None
+		return select
+	if isXPath:
+		expression = selector
+	elif cssselect is not None:
+		expression = cssselect.HTMLTranslator().css_to_xpath(selector)
+	else:
+		expression = cssStepsToXPath(parseCSS(selector))
+	xpath = lxmlEtree.XPath(expression)
+	def select(document):
+		found = xpath(document)
+		if isinstance(found, list):
+			found = found[0] if found else None
+		return found
+	return select
+
+def innerHTMLOf(element):
+	if isinstance(element, HTMLElement):
+		return element.innerHTML()
+	inner = [cgi.escape(element.text or u'')]
+	inner.extend(lxmlEtree.tostring(child, encoding=unicode, method='html', with_tail=True) for child in element)
+	return u''.join(inner)
+
+def textOf(element):
+	if isinstance(element, HTMLElement):
+		return element.text().strip()
+	return element.text_content().strip()
+
+class SelectorExtractor(object):
+	'''Finds a column on a parsed page with the first of selectors that finds something, and returns 
+	that element's inner HTML or text (output is 'html' or 'text').'''
+	def __init__(self, selectors, output='html'):
+		if output not in ('html', 'text'):
+			raise ValueError("selectorOutput must be 'html' or 'text', not {0!r}".format(output))
+		if isinstance(selectors, basestring):
+			selectors = [selectors]
+		self.selectors = [compileSelector(selector) for selector in selectors]
+		self.output = output
+
+	def extract(self, document):
+		'''Returns what the first matching selector finds on document (from parseHTML), or None.'''
+		if document is None:
+			return None
+		for select in self.selectors:
+			found = select(document)
+			if found is None:
+				continue
+			if isinstance(found, basestring):
+				return unicode(found)
+			return textOf(found) if self.output == 'text' else innerHTMLOf(found)
+		return None
+
+selectorExtractors = {}
+
+def selectorExtractorFor(selectors, output='html'):
+	'''Returns a SelectorExtractor for these selectors, reusing one that was already made if possible.'''
+	if isinstance(selectors, basestring):
+		selectors = [selectors]
+	key = (tuple(selectors), output)
+	if key not in selectorExtractors:
+		selectorExtractors[key] = SelectorExtractor(selectors, output)
+	return selectorExtractors[key]
+
+def selectorsFromKwargs(kwargs):
+	'''Returns the list of (column, list of selectors) a job's kwargs asks for. 'selectors' can also be
+	a dictionary (from a job file), and then the columns go in alphabetical order.'''
+	selectors = kwargs.get('selectors') or []
+	if isinstance(selectors, dict):
+		selectors = sorted(selectors.items())
+	return [(column, [columnSelectors] if isinstance(columnSelectors, basestring) else list(columnSelectors)) 
+		for column, columnSelectors in selectors]
+
+def newColumnNamesFor(kwargs):
+	'''The names of the new columns a job adds: the quotes' columns, then any columns that only have selectors.'''
+	columns = [column for column, startQuote, endQuote in fieldsFromKwargs(kwargs)]
+	for column, selectors in selectorsFromKwargs(kwargs):
+		if column not in columns:
+			columns.append(column)
+	return columns
+
+# Long runs die sometimes (a network blip, an error nobody has seen before), and starting over from 
+# row one costs hours. If you give the scraping functions a checkpointFile, every row's result is saved
+# there as soon as it's scraped, keyed by the unique ID. Running the same job again skips the IDs that
+# already worked and only retries the failures and the rows that were never reached.
+
+class CheckpointJournal(object):
+	'''Remembers, in a SQLite file, which unique IDs were scraped successfully and what was scraped.'''
+	def __init__(self, checkpointFile):
+		self.lock = threading.Lock()
+		self.connection = sqlite3.connect(checkpointFile, check_same_thread=False)
+		self.connection.text_factory = str # scrape() returns utf-8 encoded strings, so keep them that way
+		self.connection.execute('''CREATE TABLE IF NOT EXISTS checkpoints (uniqueID TEXT PRIMARY KEY, 
+			succeeded INTEGER, value TEXT, error TEXT, updated REAL)''')
+		self.connection.commit()
+
+	def lookup(self, uniqueID):
+		'''Returns the saved dictionary of new columns if uniqueID was already scraped successfully, 
+		otherwise None.'''
+		with self.lock:
+			row = self.connection.execute('SELECT value FROM checkpoints WHERE uniqueID = ? AND succeeded = 1',
+				(uniqueID,)).fetchone()
+		if row is None:
+			return None
+		return newInfoFromJSON(row[0])
+
+	def record(self, uniqueID, succeeded, newInfo=None, error=''):
+		'''Saves the result (a dictionary of new columns) for uniqueID. It's committed right away
+		so it survives a crash.'''
+		with self.lock:
+			self.connection.execute('INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?)',
+				(uniqueID, int(succeeded), json.dumps(newInfo or {}), error, time.time()))
+			self.connection.commit()
+
+	def counts(self):
+		'''Returns (number of successes, number of failures) saved so far.'''
+		with self.lock:
+			succeeded, failed = self.connection.execute(
+				'SELECT COALESCE(SUM(succeeded), 0), COALESCE(SUM(1 - succeeded), 0) FROM checkpoints').fetchone()
+		return succeeded, failed
+
+	def close(self):
+		with self.lock:
+			self.connection.close()
+
+def newInfoFromJSON(text):
+	'''Turns a saved dictionary of new columns back into utf-8 strings (json hands back unicode, but the
+	csv writer wants utf-8).'''
+	newInfo = {}
+	for column, value in json.loads(text).items():
+		if isinstance(value, unicode):
+			value = value.encode('utf-8')
+		newInfo[column.encode('utf-8')] = value
+	return newInfo
+
+def journalFromKwargs(kwargs):
+	'''Opens the CheckpointJournal named by kwargs['checkpointFile'], or returns None if there isn't one.'''
+	checkpointFile = kwargs.get('checkpointFile')
+	if checkpointFile is None:
+		return None
+	journal = CheckpointJournal(checkpointFile)
+	succeeded, failed = journal.counts()
+	if succeeded or failed:
+		print "Resuming from {0}: {1} rows already scraped, {2} failures to retry.".format(checkpointFile, succeeded, failed)
+	return journal
+
+# A nightly refresh of records that hardly ever change shouldn't have to download every page in full.
+# With a refreshStateFile, each page's ETag, Last-Modified date and a fingerprint (sha1) of its contents
+# are saved along with what was scraped from it. The next run asks the server whether the page has
+# changed (If-None-Match / If-Modified-Since). If the server says it hasn't (304), or sends back the 
+# same page, the saved values are reused without extracting anything. The saved values are tied to
+# the quotes and settings that made them, so changing the quotes means everything is scraped again.
+
+class RefreshState(object):
+	'''Remembers, in a SQLite file, each URL's validators, content fingerprint and scraped columns.'''
+	def __init__(self, refreshStateFile, extractionKey):
+		self.extractionKey = extractionKey
+		self.lock = threading.Lock()
+		self.connection = sqlite3.connect(refreshStateFile, check_same_thread=False)
+		self.connection.text_factory = str
+		self.connection.execute('''CREATE TABLE IF NOT EXISTS pages (URL TEXT PRIMARY KEY, extractionKey TEXT,
+			etag TEXT, lastModified TEXT, contentHash TEXT, value TEXT, updated REAL)''')
+		self.connection.commit()
+
+	def lookup(self, URL):
+		'''Returns (etag, lastModified, contentHash, newInfo) from the last run, or None if URL wasn't
+		scraped with the same settings.'''
+		with self.lock:
+			row = self.connection.execute('SELECT etag, lastModified, contentHash, value FROM pages WHERE URL = ? AND extractionKey = ?',
+				(URL, self.extractionKey)).fetchone()
+		if row is None:
+			return None
+		etag, lastModified, contentHash, value = row
+		return etag, lastModified, contentHash, newInfoFromJSON(value)
+
+	def record(self, URL, etag, lastModified, contentHash, newInfo):
+		with self.lock:
+			self.connection.execute('INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?)',
+				(URL, self.extractionKey, etag, lastModified, contentHash, json.dumps(newInfo), time.time()))
+			self.connection.commit()
+
+	def close(self):
+		with self.lock:
+			self.connection.close()
+
+def contentHash(webpage):
+	return hashlib.sha1(webpage.encode('utf-8')).hexdigest()
+
+# To check where a scraped value came from, or to run better quotes (or better Congress CRS cleanup)
+# over pages that were already downloaded, give the scraping functions an archiveDir. Every page that
+# gets scraped is kept there (with streamBody, just the part that was downloaded), along with the
+# unique ID and URL it was scraped for:
+#   'archiveDir'          : the folder the archive goes in (a run adds to what's already there)
+#   'archiveSegmentBytes' : how big each segment file gets before a new one is started (256 MB by default)
+#   'archiveBatchSize'    : how many pages are written (and indexed) at a time (500 by default)
+# The segment files are WARC files (pages-00000.warc.gz, ...): each page is a WARC "resource" record,
+# compressed on its own, so any WARC tool can read them and one page can be read without the rest. A
+# small SQLite index says which segment and byte offset each unique ID's page is at, and when it was
+# downloaded. The pages are written before their index rows, so the index never points at a page that
+# isn't there. Only one run should write to an archive at a time.
+# reextractArchive() (or --reextract on the command line) goes through an archive from start to end,
+# runs a job's quotes/selectors over the latest page of each unique ID in processes (one per core),
+# and writes the unique ID, the URL and the new columns to a file without downloading anything.
+
+def archiveSegmentPath(archiveDir, segment):
+	return os.path.join(archiveDir, 'pages-{0:05d}.warc.gz'.format(segment))
+
+def archiveRecord(URL, page, fetched):
+	'''Returns (a compressed WARC record for page, the sha1 of the page) for PageArchive.'''
+	data = page.encode('utf-8')
+	digest = hashlib.sha1(data)
+	if isinstance(URL, unicode):
+		URL = URL.encode('utf-8')
+	header = ['WARC/1.0', 'WARC-Type: resource', 'WARC-Record-ID: <urn:uuid:{0}>'.format(uuid.uuid4()),
+		'WARC-Date: ' + time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(fetched)), 'WARC-Target-URI: ' + URL,
+		'WARC-Payload-Digest: sha1:' + base64.b32encode(digest.digest()), 'Content-Type: text/html; charset=utf-8',
+		'Content-Length: {0}'.format(len(data))]
+	compressor = zlib.compressobj(6, zlib.DEFLATED, 31) # 31 makes it a gzip member, like the ones in .warc.gz files
+	return compressor.compress('\r\n'.join(header) + '\r\n\r\n' + data + '\r\n\r\n') + compressor.flush(), digest.hexdigest()
+
+def pageFromArchiveRecord(compressed):
+	'''Returns the page (unicode) in one compressed WARC record.'''
+	text = zlib.decompress(compressed, 31)
+	headerEnd = text.index('\r\n\r\n')
+	length = int(re.search(r'\r\nContent-Length: (\d+)', text[:headerEnd]).group(1))
+	return text[headerEnd + 4:headerEnd + 4 + length].decode('utf-8')
+
+class PageArchive(object):
+	'''Keeps scraped pages in archiveDir (see above). With readOnly, it only reads an archive (and
+	doesn't tidy up after a run that died, which a run that's still going would look like).'''
+	def __init__(self, archiveDir, segmentBytes=256*1024*1024, batchSize=500, readOnly=False):
+		self.archiveDir = archiveDir
+		self.segmentBytes = segmentBytes
+		self.batchSize = batchSize
+		self.readOnly = readOnly
+		self.lock = threading.Lock()
+		indexFile = os.path.join(archiveDir, 'index.sqlite')
+		if readOnly and not os.path.exists(indexFile):
+			raise IOError("There's no page archive in {0}.".format(archiveDir))
+		if not os.path.isdir(archiveDir):
+			os.makedirs(archiveDir)
+		self.connection = sqlite3.connect(indexFile, check_same_thread=False)
+		self.connection.text_factory = str
+		self.pending = [] # compressed records that haven't been written yet
+		self.batch = [] # their index rows (and the ones for repeated URLs)
+		self.recentLocations = collections.OrderedDict() # URL -> where its page is, for the last 10000 URLs
+		if not readOnly:
+			self.connection.execute('''CREATE TABLE IF NOT EXISTS pages (uniqueID TEXT, URL TEXT, segment INTEGER,
+				offset INTEGER, length INTEGER, fetched REAL, digest TEXT)''')
+			self.connection.execute('CREATE INDEX IF NOT EXISTS pagesByID ON pages (uniqueID)')
+			self.connection.execute('CREATE INDEX IF NOT EXISTS pagesByURL ON pages (URL)')
+			self.connection.commit()
+			self.openSegment()
+
+	def openSegment(self):
+		'''Picks up where the last run left off: the last segment, cut back to the end of its last indexed
+		page (a run that died while writing can leave part of one behind), or a new one if it's full.'''
+		last = self.connection.execute('SELECT segment, offset + length FROM pages ORDER BY segment DESC, offset DESC LIMIT 1').fetchone()
+		self.segment, self.segmentSize = last if last is not None else (0, 0)
+		if self.segmentSize >= self.segmentBytes:
+			self.segment, self.segmentSize = self.segment + 1, 0
+		path = archiveSegmentPath(self.archiveDir, self.segment)
+		if os.path.exists(path) and os.path.getsize(path) > self.segmentSize:
+			with open(path, 'r+b') as segmentFile:
+				segmentFile.truncate(self.segmentSize)
+		self.segmentFile = open(path, 'ab')
+
+	def add(self, uniqueID, URL, page):
+		'''Archives page (unicode) as the page scraped for uniqueID from URL.'''
+		fetched = time.time()
+		compressed, digest = archiveRecord(URL, page, fetched)
+		with self.lock:
+			if self.segmentSize > 0 and self.segmentSize + len(compressed) > self.segmentBytes:
+				self.flush()
+				self.segmentFile.close()
+				self.segment, self.segmentSize = self.segment + 1, 0
+				self.segmentFile = open(archiveSegmentPath(self.archiveDir, self.segment), 'wb')
+			location = (self.segment, self.segmentSize, len(compressed), fetched, digest)
+			self.pending.append(compressed)
+			self.segmentSize += len(compressed)
+			self.recentLocations.pop(URL, None)
+			self.recentLocations[URL] = location
+			if len(self.recentLocations) > 10000:
+				self.recentLocations.popitem(False)
+			self.addIndexRow((uniqueID, URL) + location)
+
+	def alias(self, uniqueID, URL):
+		'''Points uniqueID at the page that was last archived for URL (for a row that repeats an earlier
+		row's URL). Returns False if there isn't one.'''
+		with self.lock:
+			location = self.recentLocations.get(URL)
+			if location is None:
+				self.flush()
+				location = self.connection.execute('''SELECT segment, offset, length, fetched, digest FROM pages
+					WHERE URL = ? ORDER BY rowid DESC LIMIT 1''', (URL,)).fetchone()
+				if location is None:
+					return False
+			self.addIndexRow((uniqueID, URL) + tuple(location))
+			return True
+
+	def addIndexRow(self, row):
+		'''Call with the lock held.'''
+		self.batch.append(row)
+		if len(self.batch) >= self.batchSize:
+			self.flush()
+
+	def flush(self):
+		'''Writes the waiting pages, and then their index rows. Call with the lock held.'''
+		if self.pending:
+			self.segmentFile.write(''.join(self.pending))
+			self.segmentFile.flush()
+			self.pending = []
+		if self.batch:
+			self.connection.executemany('INSERT INTO pages VALUES (?, ?, ?, ?, ?, ?, ?)', self.batch)
+			self.connection.commit()
+			self.batch = []
+
+	def page(self, uniqueID):
+		'''Returns the page (unicode) that was last archived for uniqueID, or None.'''
+		with self.lock:
+			if not self.readOnly:
+				self.flush()
+			location = self.connection.execute('SELECT segment, offset, length FROM pages WHERE uniqueID = ? ORDER BY rowid DESC LIMIT 1',
+				(uniqueID,)).fetchone()
+		if location is None:
+			return None
+		segment, offset, length = location
+		with open(archiveSegmentPath(self.archiveDir, segment), 'rb') as segmentFile:
+			segmentFile.seek(offset)
+			return pageFromArchiveRecord(segmentFile.read(length))
+
+	def latestPages(self):
+		'''Yields (uniqueID, URL, segment, offset, length) for the page that was last archived for each
+		unique ID, in the order they're stored.'''
+		return self.connection.execute('''SELECT uniqueID, URL, segment, offset, length FROM pages
+			WHERE rowid IN (SELECT MAX(rowid) FROM pages GROUP BY uniqueID) ORDER BY segment, offset''')
+
+	def close(self):
+		with self.lock:
+			if not self.readOnly:
+				self.flush()
+				self.segmentFile.close()
+			self.connection.close()
+
+def archiveFromKwargs(kwargs):
+	'''Opens the PageArchive in kwargs['archiveDir'] (with archiveSegmentBytes and archiveBatchSize), or
+	returns None if there's no archiveDir.'''
+	if kwargs.get('archiveDir') is None:
+		return None
+	return PageArchive(kwargs['archiveDir'], kwargs.get('archiveSegmentBytes',256*1024*1024), kwargs.get('archiveBatchSize',500))
+
+archiveReader = {} # what a re-extraction process needs, set up once by startArchiveReader
+
+def startArchiveReader(archiveDir, extractionSettings):
+	'''Runs once in each re-extraction process.'''
+	archiveReader['archiveDir'] = archiveDir
+	archiveReader['extractionSettings'] = extractionSettings
+
+def reextractPages(pages):
+	'''Runs in a re-extraction process. pages is (segment, [(offset, length), ...]), all close together,
+	which are read in one go. Returns the dictionary from extractPage for each page.'''
+	segment, locations = pages
+	start = locations[0][0]
+	with open(archiveSegmentPath(archiveReader['archiveDir'], segment), 'rb') as segmentFile:
+		segmentFile.seek(start)
+		data = segmentFile.read(locations[-1][0] + locations[-1][1] - start)
+	return [extractPage((pageFromArchiveRecord(data[offset - start:offset - start + length]),) + archiveReader['extractionSettings'])[0]
+		for offset, length in locations]
+
+def reextractArchive(archiveDir, kwargs, destFile, processes=None, readBytes=8*1024*1024):
+	'''Runs the quotes/selectors in kwargs (and the Congress CRS cleanup, if it's a Congress CRS job) over
+	the latest archived page of every unique ID in archiveDir, with processes (one per core by default)
+	each reading about readBytes of the archive at a time. Writes the unique ID, the URL and the new
+	columns to destFile (CSV, or SQLite or Parquet going by its extension), in the order the pages are
+	stored, and returns how many rows it wrote.'''
+	start = time.time()
+	archive = PageArchive(archiveDir, readOnly=True)
+	extractionSettings = extractionSettingsFromKwargs(kwargs)
+	newColumnNames = newColumnNamesFor(kwargs)
+	idColumn = kwargs.get('uniqueIDColumnName') or kwargs.get('urlColumnName') or 'ID'
+	headers = uniqueColumns([idColumn, 'URL'] + newColumnNames)
+	def batches():
+		'''Yields (the (uniqueID, URL) pairs for each page, (segment, [(offset, length) of each page])).'''
+		keys, locations, segment = [], [], None
+		for uniqueID, URL, pageSegment, offset, length in archive.latestPages():
+			if locations and pageSegment == segment and locations[-1][0] == offset:
+				keys[-1].append((uniqueID, URL)) # another ID whose row had the same URL
+				continue
+			if locations and (pageSegment != segment or offset + length - locations[0][0] > readBytes):
+				yield keys, (segment, locations)
+				keys, locations = [], []
+			segment = pageSegment
+			keys.append([(uniqueID, URL)])
+			locations.append((offset, length))
+		if locations:
+			yield keys, (segment, locations)
+	found = dict((column, 0) for column in newColumnNames)
+	pageCount = rowCount = 0
+	sink = sinkFromKwargs({'uniqueIDColumnName' : idColumn}, destFile, headers)
+	try:
+		for keys, scrapedPages in processMapOrdered(reextractPages, batches(), processes or multiprocessing.cpu_count(),
+				initializer=startArchiveReader, initargs=(archiveDir, extractionSettings)):
+			for pageKeys, scrapedInfo in zip(keys, scrapedPages):
+				pageCount += 1
+				row = {}
+				for column in newColumnNames:
+					if scrapedInfo[column] is not None:
+						found[column] += 1
+					row[column] = scrapedInfo[column] if scrapedInfo[column] is not None else ''
+				for uniqueID, URL in pageKeys:
+					row[idColumn], row['URL'] = uniqueID, URL
+					sink.add(row)
+					rowCount += 1
+	finally:
+		sink.close()
+		archive.close()
+	print "Re-extracted {0:,} archived pages ({1:,} rows) into {2} in {3}.".format(pageCount, rowCount, destFile,
+		formatSeconds(time.time() - start))
+	for column in newColumnNames:
+		print "  {0} was found on {1:,} of them.".format(column, found[column])
+	return rowCount
+
+# Here's the engine that all of the scraping functions share. Rows go through it in stages:
+# 1) download the page (several threads at once, see concurrency), 2) pull the new columns out of it
+# (in those same threads, or in separate processes if you set extractionProcesses, so the regular 
+# expressions and the cleanup can use every core instead of waiting on each other), and 3) fill in
+# the row and save it to the checkpoint file. Rows come out in the same order they went in.
+
+def cleanCRSSummary(newInfo):
+	'''Takes the leftover html out of a Congress CRS summary.'''
+	newInfo = newInfo.replace('<p>','')
+	newInfo = newInfo.replace('</li> <li>','')
+	newInfo = newInfo.replace('</p>','')
+	newInfo = newInfo.strip()
+	return newInfo
+
+def extractPage(job):
+	'''job is (webpage, fields, matchMode, alternateEndQuoteList, postProcess, selectors, selectorOutput).
+	Returns (the dictionary from extractFields with postProcess, if there is one, applied to everything 
+	that was found, seconds spent extracting, seconds spent post-processing). It's a plain function with
+	plain arguments so it can be sent to an extraction process.'''
+	webpage, fields, matchMode, alternateEndQuoteList, postProcess, selectors, selectorOutput = job
+	start = time.time()
+	scrapedInfo = extractFields(webpage, fieldExtractorsFor(fields, matchMode, alternateEndQuoteList),
+		[(column, selectorExtractorFor(columnSelectors, selectorOutput)) for column, columnSelectors in selectors])
+	extracted = time.time()
+	if postProcess is not None:
+		for column in scrapedInfo:
+			if scrapedInfo[column] is not None:
+				scrapedInfo[column] = postProcess(scrapedInfo[column])
+	return scrapedInfo, extracted - start, time.time() - extracted
+
+def extractionSettingsFromKwargs(kwargs):
+	'''Returns what extractPage needs besides the page: (fields, matchMode, alternateEndQuoteList, 
+	postProcess, selectors, selectorOutput). Every selector is compiled here, so one that doesn't work
+	stops the run before the first download.'''
+	postProcess = cleanCRSSummary if kwargs.get('specialURLs') == 'Congress CRS' else None
+	selectors = selectorsFromKwargs(kwargs) # (column, list of selectors) for each column that has selectors
+	selectorOutput = kwargs.get('selectorOutput','html')
+	for column, columnSelectors in selectors:
+		selectorExtractorFor(columnSelectors, selectorOutput)
+	return (fieldsFromKwargs(kwargs), kwargs.get('matchMode','greedy'), kwargs.get('alternateEndQuoteList',[]),
+		postProcess, selectors, selectorOutput)
+
+def processMapOrdered(function, pairs, processes, window=None, initializer=None, initargs=(), pool=None):
+	'''For each (key, argument) in pairs, runs function(argument) in a pool of processes and yields
+	(key, result) in the same order. Keys stay in this process; arguments that are None are passed 
+	through as a None result. At most window arguments (four per process by default) are out at once.
+	function (and initializer, which each process runs once with initargs) has to be a plain 
+	module-level function so it can be sent to the processes. pool can be a multiprocessing.Pool that 
+	was started earlier, which is left running for whoever started it; a pool made here is shut down 
+	at the end.'''
+	if window is None:
+		window = processes * 4
+	ownPool = pool is None
+	if ownPool:
+		pool = multiprocessing.Pool(processes, initializer, initargs)
+	pending = collections.deque()
+	try:
+		for key, argument in pairs:
+			if argument is None:
+				pending.append((key, None))
+			else:
+				pending.append((key, pool.apply_async(function, (argument,))))
+			while len(pending) > window or (pending and (pending[0][1] is None or pending[0][1].ready())):
+				key, result = pending.popleft()
+				yield key, (result.get(24*60*60) if result is not None else None) # a timeout keeps Ctrl-C working
+		while pending:
+			key, result = pending.popleft()
+			yield key, (result.get(24*60*60) if result is not None else None)
+		if ownPool:
+			pool.close()
+			pool.join()
+	finally:
+		if ownPool:
+			pool.terminate()
+
+def scrapeRows(fileRows, kwargs, strict=False, metrics=None):
+	'''Takes rows (dictionaries) that already have their URL in kwargs['urlColumnName'] (or 'URL'), downloads
+	and scrapes each one as kwargs says, and yields the finished rows in their original order. If strict
+	is True, anything that goes wrong (including quotes that can't be found) stops the run; otherwise
+	the row is left with a note or blank and the run goes on. Timings and counts go in metrics (by 
+	default a RunMetrics made from kwargs, which is closed when the rows run out).'''
+	urlColumnName = kwargs.get('urlColumnName','URL')
+	uniqueIDColumnName = kwargs.get('uniqueIDColumnName') or urlColumnName
+	alternateEndQuoteList = kwargs.get('alternateEndQuoteList',[])
+	concurrency = kwargs.get('concurrency',1) # how many requests can be in flight at once
+	extractionProcesses = kwargs.get('extractionProcesses',0) # 0 means extract in the download threads
+	ownMetrics = metrics is None
+	if ownMetrics:
+		metrics = metricsFromKwargs(kwargs)
+	fetcher = fetcherFromKwargs(kwargs, metrics) # see fetcherFromKwargs for the download settings
+	extractionSettings = extractionSettingsFromKwargs(kwargs)
+	fields, postProcess, selectors = extractionSettings[0], extractionSettings[3], extractionSettings[4]
+	newColumnNames = newColumnNamesFor(kwargs)
+	journal = journalFromKwargs(kwargs) # set checkpointFile in kwargs to be able to resume
+	archive = archiveFromKwargs(kwargs) # set archiveDir in kwargs to keep the pages (see PageArchive)
+	streamExtractors = None
+	if kwargs.get('streamBody',False):
+		# With streamBody, each download stops once every field's startQuote and endQuote have come in 
+		# (pages cut short that way aren't cached). That only gives the same answer as reading the whole 
+		# page when each field ends at its FIRST endQuote, so it needs lazy matching.
+		if extractionSettings[1] != 'lazy':
+			raise ValueError("streamBody needs matchMode 'lazy', since 'greedy' has to see the whole page to find the last endQuote")
+		if selectors:
+			raise ValueError("streamBody only works with quotes: selectors need the whole page to parse")
+		streamExtractors = [extractor for column, extractor, alternates in fieldExtractorsFor(fields, 'lazy')]
+	dedupeURLs = kwargs.get('dedupeURLs',True) # scrape each URL once, even if several rows have it
+	dedupeWindow = kwargs.get('dedupeWindow',10000) # how many of the most recent URLs to look for repeats in
+	extractionKey = hashlib.sha1(json.dumps([fields, extractionSettings[1], alternateEndQuoteList, 
+		kwargs.get('specialURLs')] + ([selectors, extractionSettings[5]] if selectors else []))).hexdigest()
+	memoryCache = fetcher.memoryCache # scraped results are kept under (URL, extractionKey)
+	refreshState = None
+	if kwargs.get('refreshStateFile') is not None and not (fetcher.cache is not None and fetcher.cache.offline):
+		refreshState = RefreshState(kwargs['refreshStateFile'], extractionKey)
+
+	def fetchIfChanged(item, uniqueID):
+		'''fetchItem for a refresh: returns the saved columns if the page hasn't changed since the last run.'''
+		URL = item.get(urlColumnName)
+		saved = refreshState.lookup(URL)
+		if saved is None:
+			webpage, etag, lastModified = fetcher.fetchIfChanged(URL)
+		else:
+			webpage, etag, lastModified = fetcher.fetchIfChanged(URL, saved[0], saved[1])
+		if webpage is None and saved is None:
+			raise FetchError("{0} said it hadn't changed, but there's nothing saved for it".format(URL))
+		if saved is not None and (webpage is None or contentHash(webpage) == saved[2]):
+			metrics.count('unchanged')
+			if journal is not None:
+				journal.record(uniqueID, True, saved[3])
+			return item, None, saved[3], None
+		return item, webpage, None, (etag, lastModified, contentHash(webpage))
+
+	def foundEverything(webpage):
+		'''Whether every field's quotes are in the part of the page downloaded so far.'''
+		return all(extractor.extract(webpage) is not None for extractor in streamExtractors)
+
+	def fetchItem(item):
+		'''Downloads the page for item. Returns (item, webpage, savedInfo, validators), where webpage is None
+		if it couldn't be downloaded, savedInfo is what the checkpoint file, refresh state or memory cache 
+		has if the row doesn't need scraping, and validators are what to save in the refresh state once it's scraped.'''
+		uniqueID = item.get(uniqueIDColumnName)
+		savedInfo = journal.lookup(uniqueID) if journal is not None else None
+		if savedInfo is not None:
+			metrics.count('resumed')
+			return item, None, savedInfo, None
+		if not item.get(urlColumnName) and any(item.get(column) for column in newColumnNames):
+			metrics.count('note') # a URL rule left a note instead of a URL, so there's nothing to download
+			return item, None, None, None
+		if memoryCache is not None and item.get(urlColumnName):
+			newInfo = memoryCache.results.get((item.get(urlColumnName), extractionKey))
+			if newInfo is not None:
+				metrics.count('memory result hit')
+				if journal is not None:
+					journal.record(uniqueID, True, newInfo)
+				return item, None, newInfo, None
+		try:
+			if not item.get(urlColumnName):
+				raise requests.exceptions.MissingSchema("There's no URL for {0}".format(uniqueID))
+			if refreshState is not None:
+				return fetchIfChanged(item, uniqueID)
+			if streamExtractors is not None:
+				return item, fetcher.fetchUntil(item.get(urlColumnName), foundEverything), None, None
+			return item, fetcher.fetch(item.get(urlColumnName)), None, None
+		except requests.exceptions.MissingSchema:
+			metrics.count('missing URL')
+			metrics.say("Row {0} has no usable URL ({1!r}).".format(uniqueID, item.get(urlColumnName)))
+			if strict:
+				raise
+		except OfflineCacheMiss:
+			metrics.count('offline miss')
+			metrics.say("Offline mode and {0} isn't in the cache.".format(item.get(urlColumnName)))
+			if strict:
+				raise
+		except (FetchError,) + retryableErrors as error:
+			if isinstance(error, FetchError):
+				metrics.count('HTTP error')
+			elif isinstance(error, requests.exceptions.Timeout):
+				metrics.count('timeout')
+			else:
+				metrics.count('connection error')
+			metrics.say("Couldn't download the page: {0}".format(error))
+			if strict:
+				if journal is not None:
+					journal.record(uniqueID, False, error=repr(error))
+				raise
+		except: 
+			metrics.count('other error')
+			metrics.say("Row {0} ({1}) failed: {2!r}".format(uniqueID, item.get(urlColumnName), sys.exc_info()[1]))
+			if journal is not None:
+				journal.record(uniqueID, False, error=repr(sys.exc_info()[1]))
+			raise
+		if journal is not None:
+			journal.record(uniqueID, False, error='no page')
+		return item, None, None, None
+
+	def markRepeats(rows):
+		'''Yields a job (row, share, isRepeat) for each row. share is a dictionary for the row's URL: the 
+		first row with that URL is scraped and finishItem fills in share, and the rows after it with the 
+		same URL (if it's among the last dedupeWindow URLs) are repeats that just copy share.'''
+		recentURLs = collections.OrderedDict()
+		for row in rows:
+			URL = row.get(urlColumnName)
+			if not dedupeURLs or not URL:
+				yield row, None, False
+				continue
+			share = recentURLs.pop(URL, None)
+			isRepeat = share is not None
+			if not isRepeat:
+				share = {}
+				if len(recentURLs) >= dedupeWindow:
+					recentURLs.popitem(False)
+			recentURLs[URL] = share # it goes (back) to the most recent end
+			yield row, share, isRepeat
+
+	def fetchJob(job):
+		item, share, isRepeat = job
+		if isRepeat:
+			return job, (item, None, None, None)
+		return job, fetchItem(item)
+
+	def fetchAndExtractJob(job):
+		job, fetchedItem = fetchJob(job)
+		if fetchedItem[1] is None:
+			return (job, fetchedItem), None
+		return (job, fetchedItem), extractPage((fetchedItem[1],) + extractionSettings)
+
+	def finishRepeat(item, share):
+		'''Fills in a row whose URL was already scraped for an earlier row.'''
+		metrics.count('repeated URL')
+		item.update(share['newInfo'])
+		if archive is not None and share.get('archived'):
+			archive.alias(item.get(uniqueIDColumnName), item.get(urlColumnName))
+		if journal is not None:
+			journal.record(item.get(uniqueIDColumnName), share['succeeded'], share['newInfo'], 
+				error='' if share['succeeded'] else 'same URL as a row that failed')
+		return item
+
+	def finishItem(fetchedItem, extracted, share=None):
+		'''Fills in the new columns of the row and records how it went in the checkpoint file (and in 
+		share, if other rows have the same URL).'''
+		item, webpage, savedInfo, validators = fetchedItem
+		if share is None:
+			share = {}
+		if savedInfo is not None:
+			item.update(savedInfo)
+			share.update(newInfo=savedInfo, succeeded=True)
+			return item
+		if extracted is None: # the page couldn't be downloaded, and fetchItem already said why
+			share.update(newInfo={}, succeeded=False)
+			return item
+		scrapedInfo, extractSeconds, postProcessSeconds = extracted
+		metrics.addTime('extract', extractSeconds)
+		if postProcess is not None:
+			metrics.addTime('post-process', postProcessSeconds)
+		uniqueID = item.get(uniqueIDColumnName)
+		if archive is not None:
+			archive.add(uniqueID, item.get(urlColumnName), webpage)
+			share['archived'] = True
+		newInfo = {}
+		succeeded = True
+		for column in newColumnNames:
+			newInfo[column] = item.get(column, '') # formulateBillURLList may have left a note here
+			if scrapedInfo[column] is not None:
+				newInfo[column] = scrapedInfo[column]
+				continue
+			succeeded = False
+			if strict:
+				if journal is not None:
+					journal.record(uniqueID, False, error='quotes not found for ' + column)
+				raise NoMatchError("Couldn't find the quotes for {0} on {1}".format(column, item.get(urlColumnName)))
+			elif alternateEndQuoteList != []:
+				metrics.say("Couldn't find {0} on {1} (row {2}), even with the alternate quotes {3}.".format(column,
+					item.get(urlColumnName), uniqueID, alternateEndQuoteList))
+				newInfo[column] = "Summary could not be scraped for this bill."
+			else:
+				metrics.say("Couldn't find {0} on {1}.".format(column, item.get(urlColumnName)))
+#		print newInfo
+		metrics.count('succeeded' if succeeded else 'no match')
+		item.update(newInfo)
+		share.update(newInfo=newInfo, succeeded=succeeded)
+		if journal is not None:
+			journal.record(uniqueID, succeeded, newInfo)
+		if refreshState is not None and succeeded:
+			etag, lastModified, pageHash = validators
+			refreshState.record(item.get(urlColumnName), etag, lastModified, pageHash, newInfo)
+		if memoryCache is not None and succeeded:
+			memoryCache.results.put((item.get(urlColumnName), extractionKey), newInfo)
+		return item
+
+	try:
+		jobs = markRepeats(fileRows)
+		if extractionProcesses > 0:
+			fetchedJobs = imapOrdered(fetchJob, jobs, concurrency)
+			extractionJobs = (((job, fetchedItem), None if fetchedItem[1] is None else (fetchedItem[1],) + extractionSettings)
+				for job, fetchedItem in fetchedJobs)
+			extractedItems = processMapOrdered(extractPage, extractionJobs, extractionProcesses)
+		else:
+			extractedItems = imapOrdered(fetchAndExtractJob, jobs, concurrency)
+		for (job, fetchedItem), extracted in extractedItems:
+			item, share, isRepeat = job
+			if isRepeat:
+				finishedItem = finishRepeat(item, share)
+			else:
+				finishedItem = finishItem(fetchedItem, extracted, share)
+			metrics.rowDone()
+			yield finishedItem
+	finally:
+		if isinstance(fetcher.rateLimiter, AdaptiveRateLimiter) and metrics.progress:
+			for host, (rate, limit, latency) in sorted(fetcher.rateLimiter.state().items()):
+				metrics.say("{0} ended up at {1:.1f} requests/sec with up to {2} in flight ({3:.0f} ms to first byte).".format(
+					host, rate, limit, 1000 * (latency or 0.0)))
+		if ownMetrics:
+			metrics.close()
+		if journal is not None:
+			journal.close()
+		if refreshState is not None:
+			refreshState.close()
+		if archive is not None:
+			archive.close()
+
 # Here's where it all comes together. 
 
 
@@ -164,27 +3246,37 @@ def scrapeUpdateDict(**kwargs):
 	#if you want to add a default, you can write variable = kwargs.get('variable',default) otherwise value is none
 	# steps are 1) create fileDict, 2) create urlDict, 3) scrape data, 
 	# 4) add data to newColumnName in fileDict, 5) write info/new info to csv_file or csv_file_destination
+	if kwargs.get('dryRun'):
+		return dryRunJob(dict(kwargs, driver='tsv')) # see probeJob
 	tsv_file = kwargs.get('tsv_file')
-	uniqueIDColumnName = kwargs.get('uniqueIDColumnName')
-	newColumnName = kwargs.get('newColumnName')
-	urlFormulaPrefix = kwargs.get('urlFormulaPrefix')
-	urlFormulaSuffix = kwargs.get('urlFormulaSuffix','')
 	tsv_file_destination = kwargs.get('tsv_file_destination','tsv_file')
 	headers = kwargs.get('headers')
-	startQuote = kwargs.get('startQuote')
-	endQuote = kwargs.get('endQuote')
+	newColumnNames = newColumnNamesFor(kwargs)
+	fileHeaders, fileRows = readRowsForShard(tsv_file, '\t', kwargs) # all of the rows, or just this machine's shard
+	sourceRows = fileRows # a ParallelRowReader has to be closed if the run stops before the last row
+	if not headers:
+		kwargs['headers'] = list(fileHeaders)
 # add other option to formulate URL Dict not from generic way (i.e. for bill summary URLs)	
 	kwargs['headers'].append('URL')
-	kwargs['headers'].append(newColumnName)
-	fileList = createListFromTSV(tsv_file)
-	fileList = formulateURLList(fileList, uniqueIDColumnName,urlFormulaPrefix, urlFormulaSuffix)
+	kwargs['headers'].extend(newColumnNames)
+	metrics = metricsFromKwargs(kwargs, expectedRowsFor(tsv_file, kwargs)) # progress line, timings and metricsFile
+	urlsMade = getattr(fileRows, 'formulatesURLs', False) # a ParallelRowReader makes the URLs as it reads
+	fileRows = timedRows(fileRows, metrics, 'read')
+	urlTemplate = urlTemplateFromKwargs(kwargs) # compiled once, before the first row (see URLTemplate)
+	if urlTemplate is not None:
+		if not urlsMade:
+			fileRows = urlTemplate.formulate(fileRows)
+	else:
+		print "I don't have instructions for that type of URL/file yet. Please try again - current options are None or 'Congress CRS'"
+	fileRows = timedRows(fileRows, metrics, 'URLs', 'read')
 #	print fileList
-	for item in fileList:
-		print item.get('URL')
-		newInfo = scrape(item.get('URL'), startQuote, endQuote)
-#		print newInfo
-		item[newColumnName] = newInfo
-	writeDictToTSV(fileList, tsv_file_destination, tsv_file, newColumnName)
+	try:
+		writeRowsToSink(scrapeRows(fileRows, kwargs, strict=True, metrics=metrics), sinkFromKwargs(kwargs, tsv_file_destination,
+			fileHeaders + ['URL'] + newColumnNames + shardColumns(kwargs), '\t'), metrics) # a CSV/TSV file, SQLite or Parquet
+	finally:
+		metrics.close()
+		if isinstance(sourceRows, ParallelRowReader):
+			sourceRows.close()
 
 # I wrote a separate function in case you wanted to create your URL list in your excel file.
 # Sometimes this is easier when a URL is formulaic but more complicated than prefix + uniqueID + suffix
@@ -239,82 +3331,66 @@ def csvScrapeUpdateDict(**kwargs):
 	#if you want to add a default, you can write variable = kwargs.get('variable',default) otherwise value is none
 	# steps are 1) create fileDict, 2) create urlDict, 3) scrape data, 
 	# 4) add data to newColumnName in fileDict, 5) write info/new info to csv_file or csv_file_destination
+	if kwargs.get('dryRun'):
+		return dryRunJob(dict(kwargs, driver='csv')) # see probeJob
 	csv_file = kwargs.get('csv_file')
-	uniqueIDColumnName = kwargs.get('uniqueIDColumnName')
-	newColumnName = kwargs.get('newColumnName')
-	urlFormulaPrefix = kwargs.get('urlFormulaPrefix','') # only optional if pulling CRS/congress info or if pulling URLs from a file
-	urlFormulaSuffix = kwargs.get('urlFormulaSuffix','')
 	csv_file_destination = kwargs.get('csv_file_destination','csv_file')
 	headers = kwargs.get('headers',[])
-	startQuote = kwargs.get('startQuote')
-	endQuote = kwargs.get('endQuote')
-	alternateStartQuoteList = kwargs.get('alternateStartQuoteList',[])
-	alternateEndQuoteList = kwargs.get('alternateEndQuoteList',[])
 	myDelimiter = kwargs.get('myDelimiter',',')
-	specialURLs = kwargs.get('specialURLs')
+	newColumnNames = newColumnNamesFor(kwargs)
+	fileHeaders, fileRows = readRowsForShard(csv_file, myDelimiter, kwargs) # all of the rows, or just this machine's shard
+	sourceRows = fileRows # a ParallelRowReader has to be closed if the run stops before the last row
 	if headers == []:
-		kwargs['headers'] = createCSVHeaderList(csv_file, myDelimiter)
+		kwargs['headers'] = list(fileHeaders)
 # add other option to formulate URL Dict not from generic way (i.e. for bill summary URLs)	
 #	print "Headers type before adding new columns is: ",type(headers)
 	kwargs['headers'].append('URL')
-	kwargs['headers'].append(newColumnName)
+	kwargs['headers'].extend(newColumnNames)
 #	print "Headers are: ",kwargs['headers']
 #	print "Headers type after adding new columns: ",type(headers)
-	fileList = createListFromCSV(csv_file, myDelimiter)
-	if specialURLs == None:
-		fileList = formulateURLList(fileList, uniqueIDColumnName,urlFormulaPrefix, urlFormulaSuffix)
-	elif specialURLs == 'Congress CRS':
-		fileList = formulateBillURLList(csv_file, uniqueIDColumnName)
+	metrics = metricsFromKwargs(kwargs, expectedRowsFor(csv_file, kwargs)) # progress line, timings and metricsFile
+	urlsMade = getattr(fileRows, 'formulatesURLs', False) # a ParallelRowReader makes the URLs as it reads
+	fileRows = timedRows(fileRows, metrics, 'read')
+	urlTemplate = urlTemplateFromKwargs(kwargs) # compiled once, before the first row (see URLTemplate)
+	if urlTemplate is not None:
+		if not urlsMade:
+			fileRows = urlTemplate.formulate(fileRows)
 	else:
 		print "I don't have instructions for that type of URL/file yet. Please try again - current options are None or 'Congress CRS'"
-	for item in fileList:
-		print "In line 271ish, the URL is:", item.get('URL')
-		try:
-			newInfo = scrape(item.get('URL'), startQuote, endQuote)
-		except requests.exceptions.MissingSchema:
-			print "Missing URL in line 283ish."
-		except AttributeError:
-			print "Attribute error. Moving down the exceptions list in line 281ish"
-			print "alternateEndQuoteList's type is {0} and it is: {1}".format(type(alternateEndQuoteList),alternateEndQuoteList)
-			for quote in alternateEndQuoteList:
-				print "In line 287ish, seeing if alternate quote {0} will work.".format(quote)
-				try:
-					newInfo = scrape(item.get('URL'), startQuote, quote)
-				except:
-					newInfo = "Summary could not be scraped for this bill (line 288ish)."
-		except: 
-			print "Some other error occurred in line 289ish." 
-			raise
-		if specialURLs == 'Congress CRS':
-			newInfo = newInfo.replace('<p>','')
-			newInfo = newInfo.replace('</li> <li>','')
-			newInfo = newInfo.replace('</p>','')
-			newInfo = newInfo.strip()
-#		print newInfo
-		item[newColumnName] = newInfo
-		
+	fileRows = timedRows(fileRows, metrics, 'URLs', 'read')
 #	print "fileList is: ",fileList
-	writeDictToCSV(fileList, csv_file_destination, csv_file, newColumnName)
+	try:
+		writeRowsToSink(scrapeRows(fileRows, kwargs, metrics=metrics), sinkFromKwargs(kwargs, csv_file_destination,
+			fileHeaders + ['URL'] + newColumnNames + shardColumns(kwargs), ','), metrics) # a CSV/TSV file, SQLite or Parquet
+	finally:
+		metrics.close()
+		if isinstance(sourceRows, ParallelRowReader):
+			sourceRows.close()
 
 # NEXT STEP: finish function to scrape from user-defined URL list.
 def scrapeFromURLList(**kwargs):
+	if kwargs.get('dryRun'):
+		return dryRunJob(dict(kwargs, driver='urlList')) # see probeJob
 	tsv_file = kwargs.get('tsv_file')
-	urlColumnName = kwargs.get('urlColumnName')
-	newColumnName = kwargs.get('newColumnName')
-	tsv_file_destination = kwargs.get('tsv_file_destinaton','tsv_file')
+	tsv_file_destination = kwargs.get('tsv_file_destination', kwargs.get('tsv_file_destinaton','tsv_file')) # (the old misspelling still works)
 	headers = kwargs.get('headers')
-	startQuote = kwargs.get('startQuote')
-	endQuote = kwargs.get('endQuote')
-	kwargs['headers'].append(newColumnName)
+	newColumnNames = newColumnNamesFor(kwargs)
+	reader = RowReader(tsv_file, '\t') # the headers and the rows in one pass
+	if not headers:
+		kwargs['headers'] = list(reader.headers)
+	kwargs['headers'].extend(newColumnNames)
 	print "Headers are: ",kwargs['headers']
-	fileList = createListFromTSV(tsv_file)
-	for item in fileList:
-		URL = item.get(urlColumnName)
-		newInfo = scrape(URL, startQuote, endQuote)
-		item[newColumnName] = newInfo
-#		print "Item is: ",item
-	writeDictToTSV(fileList, tsv_file_destination, tsv_file, newColumnName)
+	metrics = metricsFromKwargs(kwargs, expectedRowsFor(tsv_file, kwargs)) # progress line, timings and metricsFile
+	fileRows = timedRows(reader, metrics, 'read')
+	try:
+		writeRowsToSink(scrapeRows(fileRows, kwargs, strict=True, metrics=metrics), sinkFromKwargs(kwargs, tsv_file_destination,
+			reader.headers + ['URL'] + newColumnNames, '\t'), metrics) # a CSV/TSV file, SQLite or Parquet
+	finally:
+		metrics.close()
 	
+# These are the jobs I've run so far. They don't list their headers: the scraping functions read them
+# from the file when the job runs, so importing this module doesn't open any files.
+
 NTSBKwargsDict = { 'startQuote' : 'to\sprepare\sthis\saircraft\saccident\sreport\.', 'endQuote' : 'Index\sfor',
 'tsv_file' : '/Users/bethanylquinn/Desktop/Pyscripts/NTSB_ramp_accidents.txt', 
 'uniqueIDColumnName' : 'Event Id', 'newColumnName' : 'Description',
@@ -322,8 +3398,6 @@ NTSBKwargsDict = { 'startQuote' : 'to\sprepare\sthis\saircraft\saccident\sreport
 'urlFormulaSuffix' : '&key=1',
 'tsv_file_destination' : 'NTSB_ramp_accident_info.txt'}
 
-NTSBKwargsDict['headers']=createHeaderList('/Users/bethanylquinn/Desktop/Pyscripts/NTSB_ramp_accidents.txt')
-
 FAAKwargsDict = { 'csv_file' : 'FAA_ramp_incidents.csv', 
 'uniqueIDColumnName' : 'AIDS Report Number',
 'newColumnName' : 'Event Remarks', 
@@ -332,8 +3406,6 @@ FAAKwargsDict = { 'csv_file' : 'FAA_ramp_incidents.csv',
 'startQuote' : '<div\sid="narr_text">\s?<br>',
 'endQuote' : '</div>\n<HR>\n<div\sid="end_1">END\sREPORT'}
 
-FAAKwargsDict['headers']=createCSVHeaderList('FAA_ramp_incidents.csv')
-
 OSHAKwargsDict = { 'csv_file' : 'OSHAAccidentsNAICS4811_4812_4881.csv',
 'uniqueIDColumnName' : 'Summary NR',
 'newColumnName' : 'Accident Description',
@@ -343,8 +3415,6 @@ OSHAKwargsDict = { 'csv_file' : 'OSHAAccidentsNAICS4811_4812_4881.csv',
 'endQuote': '\n</td></tr>\n</TABLE>\n</td></tr>\n<tr><td>\n<TABLE\sbgcolor="white"\sborder="0"\scellspacing="1" cellpadding="3"\sWIDTH="99%">\n<tr><td\sclass="blueBoldTen"\svalign="top">Keywords:'
 }
 
-OSHAKwargsDict['headers'] = createCSVHeaderList('OSHAAccidentsNAICS4811_4812_4881.csv')
-
 congressCRSKwargsDict = {'csv_file' : 'CRSScrape2.csv',
 'uniqueIDColumnName' : 'Bill number',
 'newColumnName' : 'CRS Summary',
@@ -353,3 +3423,443 @@ congressCRSKwargsDict = {'csv_file' : 'CRSScrape2.csv',
 'endQuote' : '</p></div>',
 'specialURLs' : 'Congress CRS',
 'alternateEndQuoteList' : ['</div>']}
+
+# Jobs don't have to be written in Python. A job file (JSON, or YAML if PyYAML is installed) holds the
+# same settings as the dictionaries above, one dictionary per job:
+#   {"defaults" : {"requestsPerSecond" : 1, "concurrency" : 4},
+#    "jobs" : [{"jobName" : "FAA 2015", "base" : "FAA", "csv_file" : "FAA_ramp_incidents_2015.csv"},
+#              {"jobName" : "OSHA", "csv_file" : "OSHA.csv", "uniqueIDColumnName" : "Summary NR", ...}]}
+# (a plain list of jobs, or just one job, works too). The defaults go in every job. "base" starts a job
+# from one of the jobs above (NTSB, FAA, OSHA or Congress CRS), and "driver" says which function runs it:
+# 'tsv' (scrapeUpdateDict), 'csv' (csvScrapeUpdateDict) or 'urlList' (scrapeFromURLList). Without a
+# driver, it's 'csv' if there's a csv_file, 'urlList' if there's a urlColumnName, and 'tsv' otherwise.
+# Every job is checked before anything is downloaded, and all of the problems (misspelled settings, 
+# missing files and columns, quotes that aren't valid regular expressions...) are reported at once. 
+#   python websiteScraper.py jobs.json --parallel 3
+# then runs the jobs, up to three at a time (--check only checks them). Jobs that run together share 
+# one connection pool and one rate limiter, so two jobs on the same site don't add up to twice the 
+# requests per second: each host goes at the slowest requestsPerSecond of the jobs using it.
+
+builtinJobs = {'NTSB' : NTSBKwargsDict, 'FAA' : FAAKwargsDict, 'OSHA' : OSHAKwargsDict, 'Congress CRS' : congressCRSKwargsDict}
+
+jobDrivers = {'tsv' : scrapeUpdateDict, 'csv' : csvScrapeUpdateDict, 'urlList' : scrapeFromURLList}
+
+jobSettings = set(['jobName', 'driver', 'tsv_file', 'csv_file', 'tsv_file_destination', 'tsv_file_destinaton', 
+	'csv_file_destination', 'myDelimiter', 'headers', 'uniqueIDColumnName', 'urlColumnName', 'newColumnName', 
+	'startQuote', 'endQuote', 'alternateStartQuoteList', 'alternateEndQuoteList', 'extractors', 'selectors', 
+	'selectorOutput', 'matchMode', 'streamBody', 'extractionProcesses', 'urlFormulaPrefix', 'urlFormulaSuffix', 
+	'specialURLs', 'urlTemplate', 'urlRules', 'urlNormalizers', 'urlDefaults', 'concurrency', 
+	'requestsPerSecond', 'adaptive', 'minRequestsPerSecond', 'maxRequestsPerSecond', 'minConcurrency', 
+	'maxConcurrency', 'latencyTolerance', 'adaptiveErrorRate', 'adaptiveIncrease', 'adaptiveDecrease', 
+	'rateLimiter', 'session', 'poolSize', 'compression', 'fetcher', 'connectTimeout', 'readTimeout', 
+	'maxRetries', 'retryBackoff', 'maxRetryWait', 'circuitBreaker', 'circuitErrorRate', 'circuitCooldown', 
+	'circuitMaxCooldown', 'cacheDir', 'cacheTTL', 'cacheMaxBytes', 'offline', 'memoryCacheBytes', 
+	'memoryResultBytes', 'memoryCache', 'checkpointFile', 'refreshStateFile', 'dedupeURLs', 'dedupeWindow', 
+	'shard', 'shardByteRange', 'flushEvery', 'outputFormat', 'outputTable', 'outputAppend', 'outputBatchSize', 
+	'progress', 'progressEvery', 'metricsFile', 'metricsEvery', 'metricsFormat', 'dryRun', 'probeSample', 
+	'probeMinMatchRate', 'parallelRead', 'parallelReadChunkBytes', 'parallelReadPool', 'archiveDir', 'archiveSegmentBytes', 
+	'archiveBatchSize', 'reextractDestination'])
+
+def utf8Strings(value):
+	'''Turns the unicode strings that json (and YAML) hand back into utf-8 encoded strings, like the 
+	rest of the module uses.'''
+	if isinstance(value, unicode):
+		return value.encode('utf-8')
+	if isinstance(value, list):
+		return [utf8Strings(item) for item in value]
+	if isinstance(value, dict):
+		return dict((utf8Strings(key), utf8Strings(item)) for key, item in value.items())
+	return value
+
+def loadJobFile(fileName):
+	'''Reads a job file (see above) and returns its jobs as a list of kwargs dictionaries.'''
+	with open(fileName) as jobFile:
+		if os.path.splitext(fileName)[1].lower() in ('.yaml', '.yml'):
+			if yaml is None:
+				raise ImportError("Reading YAML job files needs PyYAML (pip install pyyaml). JSON job files don't.")
+			spec = yaml.safe_load(jobFile)
+		else:
+			spec = json.load(jobFile)
+	spec = utf8Strings(spec)
+	defaults = {}
+	if isinstance(spec, dict) and 'jobs' in spec:
+		defaults = spec.get('defaults') or {}
+		spec = spec['jobs']
+	if isinstance(spec, dict):
+		spec = [spec]
+	jobs = []
+	for number, settings in enumerate(spec):
+		if not isinstance(settings, dict):
+			raise ValueError("Job #{0} in {1} isn't a dictionary of settings.".format(number + 1, fileName))
+		jobs.append(jobFromSettings(dict(defaults, **settings), '{0} #{1}'.format(os.path.basename(fileName), number + 1)))
+	return jobs
+
+def jobFromSettings(settings, defaultName='job'):
+	'''Fills in a job's base, driver and jobName. The headers list is copied, since the scraping 
+	functions add to it.'''
+	settings = dict(settings)
+	base = settings.pop('base', None)
+	if base is not None:
+		if base not in builtinJobs:
+			raise ValueError("There's no built-in job called {0!r}. The options are {1}.".format(base, ', '.join(sorted(builtinJobs))))
+		settings = dict(builtinJobs[base], **settings)
+	settings.setdefault('jobName', base or defaultName)
+	if 'driver' not in settings:
+		if 'csv_file' in settings:
+			settings['driver'] = 'csv'
+		elif 'urlColumnName' in settings:
+			settings['driver'] = 'urlList'
+		else:
+			settings['driver'] = 'tsv'
+	if settings.get('headers') is not None:
+		settings['headers'] = list(settings['headers'])
+	return settings
+
+def checkJob(job):
+	'''Returns a list of what's wrong with a job (an empty list if it looks ready to run). Only the 
+	first line of the job's file is read.'''
+	problems = ["unknown setting {0!r}".format(setting) for setting in sorted(set(job) - jobSettings)]
+	driver = job.get('driver')
+	if driver not in jobDrivers:
+		problems.append("unknown driver {0!r} (the options are {1})".format(driver, ', '.join(sorted(jobDrivers))))
+		return problems
+	fileSetting = 'csv_file' if driver == 'csv' else 'tsv_file'
+	fileName = job.get(fileSetting)
+	headers = None
+	if fileName is None:
+		problems.append("there's no {0}".format(fileSetting))
+	elif not os.path.isfile(fileName):
+		problems.append("the {0} {1!r} doesn't exist".format(fileSetting, fileName))
+	else:
+		headers = createCSVHeaderList(fileName, job.get('myDelimiter',',') if driver == 'csv' else '\t')
+	columns = []
+	matchMode = job.get('matchMode','greedy')
+	if matchMode not in ('greedy', 'lazy'):
+		problems.append("matchMode has to be 'greedy' or 'lazy', not {0!r}".format(matchMode))
+		matchMode = 'greedy' # so the quotes can still be checked
+	elif job.get('streamBody') and matchMode != 'lazy':
+		problems.append("streamBody only works with matchMode 'lazy'")
+	fields = fieldsFromKwargs(job)
+	for field in fields:
+		if len(field) != 3 or None in field:
+			problems.append("every new column needs a name, a startQuote and an endQuote (newColumnName/startQuote/endQuote or extractors)")
+			break
+	else:
+		try:
+			fieldExtractorsFor(fields, matchMode, job.get('alternateEndQuoteList',[]))
+		except re.error as error:
+			problems.append("the quotes aren't a valid regular expression ({0})".format(error))
+	try:
+		for column, columnSelectors in selectorsFromKwargs(job):
+			selectorExtractorFor(columnSelectors, job.get('selectorOutput','html'))
+	except Exception as error: # ValueError, or lxml's and cssselect's own errors
+		problems.append("a selector doesn't work ({0})".format(error))
+	if job.get('streamBody') and job.get('selectors'):
+		problems.append("streamBody only works with quotes, not selectors")
+	if driver == 'urlList':
+		if job.get('urlColumnName') is None:
+			problems.append("there's no urlColumnName")
+		else:
+			columns.append(job['urlColumnName'])
+	elif job.get('urlTemplate') is None and not job.get('urlRules') and job.get('uniqueIDColumnName') is None:
+		problems.append("there's no uniqueIDColumnName (or urlTemplate/urlRules) to make the URLs from")
+	else:
+		try:
+			urlTemplate = urlTemplateFromKwargs(job)
+		except (re.error, ValueError, KeyError, TypeError, IndexError) as error:
+			problems.append("the URL settings don't work ({0})".format(error))
+		else:
+			if urlTemplate is None:
+				problems.append("unknown specialURLs {0!r} (the only option is 'Congress CRS')".format(job.get('specialURLs')))
+			else:
+				names = [piece for isName, piece in urlTemplate.template or [] if isName]
+				columns += [name for name in names if name not in urlTemplate.defaults]
+				columns += [column for column, pattern, pieces, note in urlTemplate.rules]
+	if job.get('uniqueIDColumnName') is not None:
+		columns.append(job['uniqueIDColumnName'])
+	if headers is not None:
+		for column in sorted(set(columns) - set(headers)):
+			problems.append("there's no {0!r} column in {1}".format(column, fileName))
+	destination = job.get('csv_file_destination' if driver == 'csv' else 'tsv_file_destination') or ''
+	outputFormat = job.get('outputFormat') or outputFormatsByExtension.get(os.path.splitext(destination)[1].lower())
+	if outputFormat not in (None, 'csv', 'tsv', 'sqlite', 'parquet'):
+		problems.append("unknown outputFormat {0!r}".format(outputFormat))
+	elif outputFormat == 'parquet' and pyarrow is None:
+		problems.append("writing Parquet files needs pyarrow (pip install pyarrow)")
+	if job.get('adaptive'):
+		if job.get('minRequestsPerSecond',0.5) <= 0 or job.get('minRequestsPerSecond',0.5) > job.get('maxRequestsPerSecond',50.0):
+			problems.append("minRequestsPerSecond has to be more than 0 and no more than maxRequestsPerSecond")
+		if job.get('maxConcurrency') is not None and job.get('minConcurrency',1) > job['maxConcurrency']:
+			problems.append("minConcurrency can't be more than maxConcurrency")
+		if not 0 < job.get('adaptiveDecrease',0.5) < 1:
+			problems.append("adaptiveDecrease has to be between 0 and 1")
+		if not isinstance(job.get('adaptiveMinRequests',20), (int, long)) or job.get('adaptiveMinRequests',20) < 1:
+			problems.append("adaptiveMinRequests has to be a whole number (1 or more)")
+	for setting in ('memoryCacheBytes', 'memoryResultBytes', 'archiveSegmentBytes', 'archiveBatchSize'):
+		if job.get(setting) is not None and (not isinstance(job[setting], (int, long)) or job[setting] < 0):
+			problems.append("{0} has to be a whole number (0 or more)".format(setting))
+	if job.get('shard') is not None and job.get('shardByteRange') is not None:
+		problems.append("a job can have a shard or a shardByteRange, not both")
+	if job.get('parallelRead') and (job.get('shard') is not None or job.get('shardByteRange') is not None):
+		problems.append("parallelRead doesn't work with a shard or a shardByteRange")
+	if job.get('parallelRead') and driver == 'urlList':
+		problems.append("parallelRead only works with the 'csv' and 'tsv' drivers")
+	return problems
+
+def runJobs(jobs, parallel=1):
+	'''Runs jobs (kwargs dictionaries with a driver, see jobFromSettings), up to parallel at a time. 
+	The jobs share one session and one rate limiter unless they bring their own. One job failing 
+	doesn't stop the others. Returns a list of (jobName, error), with error None for the jobs that worked.'''
+	concurrency = sum(job.get('concurrency',1) for job in jobs)
+	session = createSession(max(10, concurrency)) if concurrency > 10 else getSharedSession()
+	rateLimiter = HostRateLimiter()
+	adaptiveJobs = [job for job in jobs if job.get('adaptive') and job.get('rateLimiter') is None]
+	if adaptiveJobs: # adaptive jobs share one AdaptiveRateLimiter, with the first one's settings
+		adaptiveLimiter = rateLimiterFromKwargs(dict(adaptiveJobs[0], concurrency=max(job.get('concurrency',1) for job in adaptiveJobs)))
+	# parallelRead jobs share one pool of reading processes, started now, before any job's threads are
+	# (see ParallelRowReader)
+	readingPoolSize = 0
+	for job in jobs:
+		fileName = job.get('csv_file' if job.get('driver') == 'csv' else 'tsv_file')
+		if (job.get('parallelRead') and job.get('driver') in ('csv', 'tsv') and job.get('parallelReadPool') is None and
+				job.get('shard') is None and job.get('shardByteRange') is None and fileName and os.path.isfile(fileName)):
+			readingPoolSize = max(readingPoolSize, readingProcesses(job['parallelRead'], fileName, job.get('parallelReadChunkBytes',4*1024*1024)))
+	readingPool = multiprocessing.Pool(readingPoolSize) if readingPoolSize else None
+	def runJob(job):
+		settings = dict(job)
+		if settings.get('session') is None and settings.get('compression',True):
+			settings['session'] = session
+		if settings.get('parallelReadPool') is None:
+			settings['parallelReadPool'] = readingPool
+		if settings.get('rateLimiter') is None:
+			if settings.get('adaptive'):
+				settings['rateLimiter'] = adaptiveLimiter
+			else:
+				settings['rateLimiter'] = rateLimiter.forJob(settings.get('requestsPerSecond',2.0))
+		start = time.time()
+		try:
+			jobDrivers[settings['driver']](**settings)
+		except Exception as error:
+			print "[{0}] failed after {1}: {2!r}".format(settings['jobName'], formatSeconds(time.time() - start), error)
+			return settings['jobName'], error
+		return settings['jobName'], None
+	try:
+		results = concurrentMap(runJob, jobs, max(1, parallel))
+	finally:
+		if readingPool is not None:
+			readingPool.terminate()
+	if sharedMemoryCache is not None and any(job.get('memoryCacheBytes') and job.get('memoryCache') is None for job in jobs):
+		print sharedMemoryCache.summary() # the jobs all used the shared memory cache (unless they failed first)
+	return results
+
+# The runs that go wrong usually go wrong hours in: a row with no ID, a URL that isn't a web address
+# (MissingSchema), or quotes that match on the first few pages and hardly any of the rest. A dry run
+# (dryRun=True in a scraping function's kwargs, or --probe on the command line) finds that out first:
+# 1) every row is read and given its URL, without going online, and the rows that won't work are
+#    counted (no unique ID, no URL, not a web address, the wrong number of columns)
+# 2) a sample of probeSample pages (20 by default), picked at random from the whole file, is downloaded
+#    with the job's own settings (concurrency, rate limit, cache...), and each column's quotes or
+#    selectors are tried on them
+# 3) it says how often each column was found and about how long the whole run would take
+# Nothing is written. The sampled pages go in the page cache if there is one, so the real run doesn't
+# download them again. A job "looks good" when nothing is wrong with its rows and each column was found
+# on at least probeMinMatchRate (0.9 by default) of the sample pages.
+
+def probeJob(job, sampleSize=None):
+	'''Dry-runs a job (a kwargs dictionary with a driver, see jobFromSettings) as described above. Returns
+	a dictionary with problems (from checkJob; if there are any, nothing else is done), rows, notes,
+	uniqueURLs, rowProblems ({kind : (count, the first few line numbers)}), strict (whether the driver
+	stops at the first row that fails), sampled, downloadErrors
+	([(URL, error)]), matches ({column : how many sample pages it was found on}), sampleSeconds,
+	estimatedSeconds and ok.'''
+	if sampleSize is None:
+		sampleSize = job.get('probeSample',20)
+	report = {'problems' : checkJob(job), 'ok' : False}
+	if report['problems']:
+		return report
+	driver = job['driver']
+	if driver == 'csv':
+		reader = RowReader(job['csv_file'], job.get('myDelimiter',','))
+	else:
+		reader = RowReader(job['tsv_file'], '\t')
+	if driver == 'urlList':
+		urlColumnName, urlTemplate = job['urlColumnName'], None
+	else:
+		urlColumnName, urlTemplate = 'URL', urlTemplateFromKwargs(job)
+	uniqueIDColumnName = job.get('uniqueIDColumnName')
+	newColumnNames = newColumnNamesFor(job)
+	rowProblems = {}
+	def rowProblem(kind):
+		count, lines = rowProblems.get(kind, (0, []))
+		if len(lines) < 5:
+			lines.append(reader.reader.line_num)
+		rowProblems[kind] = (count + 1, lines)
+	rows = notes = 0
+	seenURLs = set() # hashes of the URLs, which take a lot less memory than the URLs on a big file
+	sample = []
+	chooser = random.Random(0) # the same file gets the same sample every time
+	for row in reader:
+		rows += 1
+		if len(row.values) != len(reader.headers):
+			rowProblem('the wrong number of columns')
+		if urlTemplate is not None:
+			urlTemplate.apply(row)
+		URL = row.get(urlColumnName)
+		if not URL and any(row.get(column) for column in newColumnNames):
+			notes += 1 # a URL rule left a note instead (like the Congress CRS rules do for a blank bill number), which is fine
+			continue
+		if uniqueIDColumnName is not None and not row.get(uniqueIDColumnName):
+			rowProblem('no unique ID')
+		if not URL:
+			rowProblem('no URL')
+			continue
+		parts = urlparse.urlparse(URL)
+		if parts.scheme not in ('http', 'https') or not parts.netloc:
+			rowProblem('a URL that isn\'t a web address')
+			continue
+		if hash(URL) in seenURLs:
+			continue
+		seenURLs.add(hash(URL))
+		if len(sample) < sampleSize: # reservoir sampling: every URL has the same chance of being picked
+			sample.append(URL)
+		else:
+			slot = chooser.randint(0, len(seenURLs) - 1)
+			if slot < sampleSize:
+				sample[slot] = URL
+	report.update(rows=rows, notes=notes, uniqueURLs=len(seenURLs), rowProblems=rowProblems, strict=driver != 'csv')
+	probeKwargs = dict(job, progress=False, metricsFile=None, checkpointFile=None, refreshStateFile=None)
+	fetcher = fetcherFromKwargs(probeKwargs, RunMetrics(progress=False))
+	extractionSettings = extractionSettingsFromKwargs(probeKwargs)
+	def probePage(URL):
+		try:
+			webpage = fetcher.fetch(URL)
+		except (requests.exceptions.RequestException, OfflineCacheMiss) as error:
+			return URL, None, error
+		return URL, extractPage((webpage,) + extractionSettings)[0], None
+	start = time.time()
+	results = list(imapOrdered(probePage, sample, job.get('concurrency',1)))
+	report['sampleSeconds'] = time.time() - start
+	report['sampled'] = len(results)
+	report['downloadErrors'] = [(URL, error) for URL, scrapedInfo, error in results if error is not None]
+	downloaded = [scrapedInfo for URL, scrapedInfo, error in results if error is None]
+	report['matches'] = dict((column, sum(1 for scrapedInfo in downloaded if scrapedInfo.get(column) is not None))
+		for column in newColumnNames)
+	report['estimatedSeconds'] = None
+	if results:
+		estimate = len(seenURLs) * report['sampleSeconds'] / len(results)
+		if not job.get('adaptive'): # the sample is too small for the rate limit to show
+			estimate = max(estimate, len(seenURLs) / float(job.get('requestsPerSecond',2.0)))
+		report['estimatedSeconds'] = estimate
+	minMatchRate = job.get('probeMinMatchRate',0.9)
+	report['ok'] = not rowProblems and bool(downloaded) and all(found >= minMatchRate * len(downloaded)
+		for found in report['matches'].values())
+	return report
+
+def printProbeReport(report, jobName=None):
+	'''Prints what probeJob found.'''
+	prefix = '[{0}] '.format(jobName) if jobName else ''
+	for problem in report['problems']:
+		print prefix + problem
+	if report['problems']:
+		return
+	print prefix + "{0:,} rows, {1:,} different URLs{2}.".format(report['rows'], report['uniqueURLs'],
+		", {0:,} notes instead of URLs".format(report['notes']) if report['notes'] else '')
+	for kind, (count, lines) in sorted(report['rowProblems'].items()):
+		print prefix + "{0:,} {1} {2} (line {3}{4}).".format(count, 'row has' if count == 1 else 'rows have', kind, 
+			', '.join(str(line) for line in lines), ' and more' if count > len(lines) else '')
+	if report['rowProblems'] and report['strict']:
+		firstLine = min(lines[0] for count, lines in report['rowProblems'].values())
+		print prefix + "This driver stops at the first row that fails, so the run would stop at line {0}.".format(firstLine)
+	print prefix + "Downloaded {0} of {1} sample pages in {2:.1f} seconds.".format(
+		report['sampled'] - len(report['downloadErrors']), report['sampled'], report['sampleSeconds'])
+	for URL, error in report['downloadErrors']:
+		print prefix + "  Couldn't download {0}: {1}".format(URL, error)
+	downloaded = report['sampled'] - len(report['downloadErrors'])
+	for column, found in sorted(report['matches'].items()):
+		print prefix + "{0} was found on {1} of {2} pages ({3:.0%}).".format(column, found, downloaded,
+			found / float(downloaded) if downloaded else 0.0)
+	if report['estimatedSeconds'] is not None:
+		print prefix + "The whole run should take about {0}.".format(formatSeconds(report['estimatedSeconds']))
+	print prefix + ("It looks good." if report['ok'] else "Fix the problems above before the real run.")
+
+def dryRunJob(job):
+	'''What a scraping function does with dryRun=True: probes the job, prints the report and returns it.'''
+	report = probeJob(job)
+	printProbeReport(report, job.get('jobName'))
+	return report
+
+def main(arguments=None):
+	'''The command line: python websiteScraper.py jobs.json [more job files] [--job NAME] [--parallel N] [--check] [--probe [N]] [--reextract]
+	[--merge MERGED PARTIAL [PARTIAL ...]]'''
+	parser = argparse.ArgumentParser(description='Runs the scraping jobs in one or more job files (JSON, or YAML with PyYAML).')
+	parser.add_argument('jobFiles', nargs='+', help='the job files')
+	parser.add_argument('--job', action='append', help='only run the job with this jobName (can be given more than once)')
+	parser.add_argument('--parallel', type=int, default=1, help='how many jobs run at once (default 1)')
+	parser.add_argument('--check', action='store_true', help='check the jobs without running them')
+	parser.add_argument('--probe', type=int, nargs='?', const=20, metavar='N', 
+		help='dry-run the jobs: check every row and try the quotes on N sample pages (20 by default) instead of running them')
+	parser.add_argument('--reextract', action='store_true', help="run the jobs' quotes over the pages in their archiveDir "
+		"instead of downloading them, writing to reextractDestination (reextracted.csv in the archiveDir by default)")
+	parser.add_argument('--merge', nargs='+', metavar=('MERGED', 'PARTIAL'), help="put the PARTIAL files from a sharded "
+		"run of the job (pick it with --job if there are several) back together into MERGED instead of running it")
+	options = parser.parse_args(arguments)
+	jobs = []
+	try:
+		for jobFile in options.jobFiles:
+			jobs.extend(loadJobFile(jobFile))
+	except (IOError, ValueError, ImportError) as error:
+		print "Couldn't read the jobs: {0}".format(error)
+		return 2
+	if options.job:
+		missing = set(options.job) - set(job['jobName'] for job in jobs)
+		if missing:
+			print "There's no job called {0}.".format(', '.join(repr(name) for name in sorted(missing)))
+			return 2
+		jobs = [job for job in jobs if job['jobName'] in options.job]
+	problemCount = 0
+	for job in jobs:
+		for problem in checkJob(job):
+			print "{0}: {1}".format(job['jobName'], problem)
+			problemCount += 1
+	if problemCount:
+		print "Found {0} problem(s), so nothing was run.".format(problemCount)
+		return 2
+	if options.check:
+		print "{0} job(s) look ready to run.".format(len(jobs))
+		return 0
+	if options.merge is not None:
+		if len(jobs) != 1:
+			print "--merge needs one job (pick it with --job), not {0}.".format(len(jobs))
+			return 2
+		if len(options.merge) < 2:
+			print "--merge needs the merged file and then the partial files."
+			return 2
+		try:
+			rowsWritten = mergeJobShards(jobs[0], options.merge[1:], options.merge[0])
+		except (IOError, ValueError) as error:
+			print "Couldn't merge the partial files: {0}".format(error)
+			return 2
+		print "Merged {0:,} rows from {1} partial file(s) into {2}.".format(rowsWritten, len(options.merge) - 1, options.merge[0])
+		return 0
+	if options.probe is not None:
+		reports = []
+		for job in jobs:
+			reports.append(probeJob(job, options.probe))
+			printProbeReport(reports[-1], job['jobName'])
+		return 0 if all(report['ok'] for report in reports) else 1
+	if options.reextract:
+		unarchived = [job['jobName'] for job in jobs if job.get('archiveDir') is None]
+		if unarchived:
+			print "There's no archiveDir for {0}.".format(', '.join(unarchived))
+			return 2
+		for job in jobs:
+			reextractArchive(job['archiveDir'], job, job.get('reextractDestination') or os.path.join(job['archiveDir'], 'reextracted.csv'))
+		return 0
+	failed = [jobName for jobName, error in runJobs(jobs, options.parallel) if error is not None]
+	if failed:
+		print "{0} of {1} job(s) failed: {2}".format(len(failed), len(jobs), ', '.join(failed))
+		return 1
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())